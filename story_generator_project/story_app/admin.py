@@ -1,13 +1,46 @@
 from django.contrib import admin
-from .models import StoryGeneration
+from django.db.models.expressions import RawSQL
+from .models import Character, StoryGeneration, StoryScene
+from .search import fts5_available, matching_ids_sql, search_index_exists
+
+class StorySceneInline(admin.TabularInline):
+    model = StoryScene
+    fields = ['order', 'text', 'background_model', 'image_tier']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
 
 @admin.register(StoryGeneration)
 class StoryGenerationAdmin(admin.ModelAdmin):
     list_display = ['prompt_preview', 'created_at']
     list_filter = ['created_at']
     search_fields = ['prompt', 'generated_story']
-    readonly_fields = ['created_at']
+    readonly_fields = ['created_at', 'stage_timings']
+    inlines = [StorySceneInline]
     
     def prompt_preview(self, obj):
         return obj.prompt[:100] + "..." if len(obj.prompt) > 100 else obj.prompt
-    prompt_preview.short_description = 'Prompt'
\ No newline at end of file
+    prompt_preview.short_description = 'Prompt'
+    
+    def get_search_results(self, request, queryset, search_term):
+        """Use the FTS5 index instead of LIKE scans over the large text columns"""
+        if search_term.strip() and fts5_available() and search_index_exists():
+            sql, params = matching_ids_sql(search_term)
+            if params[0]:
+                return queryset.filter(id__in=RawSQL(sql, params)), False
+        return super().get_search_results(request, queryset, search_term)
+
+@admin.register(Character)
+class CharacterAdmin(admin.ModelAdmin):
+    list_display = ['name', 'genre', 'usage_count', 'last_used_at', 'created_at']
+    list_filter = ['genre']
+    search_fields = ['name', 'description']
+    readonly_fields = ['usage_count', 'last_used_at', 'created_at', 'source_story']
+    exclude = ['image_data']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('image_data')
+    
+    def has_add_permission(self, request):
+        # Characters are saved from a story's portrait (see characters.py)
+        return False
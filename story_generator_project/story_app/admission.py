@@ -0,0 +1,317 @@
+"""
+Admission control for the generation views (STORY_ADMISSION).
+
+Each worker process runs at most CAPACITY cost units of generation at once. Requests
+beyond that wait in a bounded queue ordered by request class, so short text stories
+aren't stuck behind audio transcriptions; a waiting request moves up one class every
+AGING_SECONDS so heavy requests still get their turn. Each client also has a token
+bucket (kept in the cache, so it is shared between processes with a shared backend)
+that is charged the request's cost.
+
+Rejections are fast: 429 when a client is over its rate, 503 when the queue is full or
+the wait runs out, both with Retry-After.
+"""
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from functools import wraps
+import asyncio
+import itertools
+import logging
+import math
+import threading
+import time
+
+from .metrics import (
+    ADMISSION_DECISIONS, ADMISSION_IN_USE, ADMISSION_QUEUE_DEPTH, ADMISSION_WAIT_SECONDS, record_stage,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ADMISSION_SETTINGS = {
+    'ENABLED': True,
+    # Cost units running at once in each worker process
+    'CAPACITY': 4,
+    'MAX_QUEUE': 16,
+    # Seconds a queued request waits for capacity before it gets a 503
+    'MAX_WAIT': 30,
+    'AGING_SECONDS': 20,
+    # Per-client token bucket; a request takes as many tokens as it costs
+    'RATE_PER_MINUTE': 12,
+    'BURST': 6,
+    'TRUST_X_FORWARDED_FOR': False,
+}
+
+# Request class -> (priority, cost). Lower priority is served first.
+REQUEST_CLASSES = {
+    'short': (0, 1),
+    'medium': (1, 1),
+    'long': (2, 2),
+    'audio': (3, 3),
+}
+
+
+def admission_settings():
+    config = dict(DEFAULT_ADMISSION_SETTINGS)
+    config.update(getattr(settings, 'STORY_ADMISSION', {}))
+    return config
+
+
+def classify_request(request):
+    """Request class from the submitted form: any audio upload, otherwise the story length"""
+    if request.POST.get('input_type') in ('audio', 'both') and request.FILES.get('audio_file'):
+        return 'audio'
+    length = request.POST.get('story_length')
+    return length if length in REQUEST_CLASSES else 'medium'
+
+
+def client_id(request, config):
+    if config['TRUST_X_FORWARDED_FOR']:
+        forwarded = request.META.get('HTTP_X_FORWARDED_FOR', '')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', 'unknown')
+
+
+# --- per-client token bucket ---
+
+_bucket_lock = threading.Lock()
+
+
+def take_tokens(client, cost, config):
+    """Charge ``cost`` tokens to the client; returns 0 when allowed, else seconds until it would be"""
+    rate = config['RATE_PER_MINUTE'] / 60.0
+    if rate <= 0:
+        return 0
+    burst = max(config['BURST'], cost)
+    key = f"story_admission:bucket:{client}"
+    # The lock covers this process only; across processes the bucket is best effort
+    with _bucket_lock:
+        now = time.time()
+        tokens, updated = cache.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        cache.set(key, (tokens, now), timeout=int(burst / rate) + 60)
+    return 0 if allowed else (cost - tokens) / rate
+
+
+# --- per-process scheduler ---
+
+class _Waiter:
+    __slots__ = ('request_class', 'priority', 'cost', 'seq', 'enqueued_at', 'granted', 'notify')
+
+    def __init__(self, request_class, priority, cost, seq, notify):
+        self.request_class = request_class
+        self.priority = priority
+        self.cost = cost
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self.notify = notify
+
+
+class AdmissionScheduler:
+    """Cost-weighted concurrency limit with a priority queue; thread-safe, usable from event loops"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._waiters = []
+        self._in_use = 0
+        # Smoothed run time of an admitted request, for Retry-After estimates
+        self._avg_run = None
+
+    def enqueue(self, request_class, notify, config):
+        """
+        Returns ('admitted', None), ('queued', waiter) or ('full', None). ``notify`` is
+        called (under the scheduler lock, so it must not block) when a queued waiter is admitted.
+        """
+        priority, cost = REQUEST_CLASSES[request_class]
+        cost = min(cost, config['CAPACITY'])
+        with self._lock:
+            if not self._waiters and self._in_use + cost <= config['CAPACITY']:
+                self._in_use += cost
+                self._update_gauges()
+                return 'admitted', None
+            if len(self._waiters) >= config['MAX_QUEUE']:
+                return 'full', None
+            waiter = _Waiter(request_class, priority, cost, next(self._seq), notify)
+            self._waiters.append(waiter)
+            self._dispatch(config)
+            self._update_gauges()
+            return ('admitted', None) if waiter.granted else ('queued', waiter)
+
+    def cancel(self, waiter):
+        """Give up waiting; returns False when the waiter was admitted in the meantime"""
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._waiters.remove(waiter)
+            self._update_gauges()
+            return True
+
+    def release(self, cost, ran_for, config):
+        with self._lock:
+            self._in_use -= min(cost, config['CAPACITY'])
+            if ran_for is not None:
+                self._avg_run = ran_for if self._avg_run is None else 0.8 * self._avg_run + 0.2 * ran_for
+            self._dispatch(config)
+            self._update_gauges()
+
+    def retry_after(self, config):
+        """Rough seconds until the current queue drains enough to take one more request"""
+        with self._lock:
+            avg_run = self._avg_run or config['MAX_WAIT']
+            queued = len(self._waiters)
+        return max(1, math.ceil(avg_run * (queued + 1) / config['CAPACITY']))
+
+    def _dispatch(self, config):
+        # Aging lets a long-waiting heavy request overtake newer cheap ones
+        now = time.monotonic()
+        aging = max(config['AGING_SECONDS'], 0.001)
+        self._waiters.sort(key=lambda w: (w.priority - (now - w.enqueued_at) / aging, w.seq))
+        # Admit strictly in order: stopping at the first waiter that doesn't fit keeps
+        # cheap requests from starving a heavy one that has reached the head
+        while self._waiters and self._in_use + self._waiters[0].cost <= config['CAPACITY']:
+            waiter = self._waiters.pop(0)
+            waiter.granted = True
+            self._in_use += waiter.cost
+            waiter.notify()
+
+    def _update_gauges(self):
+        ADMISSION_QUEUE_DEPTH.set(len(self._waiters))
+        ADMISSION_IN_USE.set(self._in_use)
+
+
+scheduler = AdmissionScheduler()
+
+
+class Ticket:
+    """An admitted request; release() frees its capacity for the next waiter"""
+
+    def __init__(self, request_class, waited):
+        self.request_class = request_class
+        self.waited = waited
+        self.admitted_at = time.monotonic()
+        self._released = False
+
+    def release(self, config):
+        if not self._released:
+            self._released = True
+            scheduler.release(REQUEST_CLASSES[self.request_class][1], time.monotonic() - self.admitted_at, config)
+
+
+def _rejection(status, reason, retry_after, request_class):
+    ADMISSION_DECISIONS.inc(request_class=request_class, outcome=reason)
+    retry_after = max(1, math.ceil(retry_after))
+    response = HttpResponse(
+        render_to_string('story_app/overloaded.html', {
+            'rate_limited': status == 429,
+            'retry_after': retry_after,
+        }),
+        status=status,
+    )
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+def _admitted(request_class, waited):
+    ADMISSION_DECISIONS.inc(request_class=request_class, outcome='admitted')
+    ADMISSION_WAIT_SECONDS.observe(waited, request_class=request_class)
+    return Ticket(request_class, waited)
+
+
+def _admit(request, config):
+    """Blocking admission for sync views; returns (ticket, None) or (None, rejection response)"""
+    request_class = classify_request(request)
+    wait = take_tokens(client_id(request, config), REQUEST_CLASSES[request_class][1], config)
+    if wait:
+        return None, _rejection(429, 'rate_limited', wait, request_class)
+
+    started = time.monotonic()
+    event = threading.Event()
+    state, waiter = scheduler.enqueue(request_class, event.set, config)
+    if state == 'full':
+        return None, _rejection(503, 'queue_full', scheduler.retry_after(config), request_class)
+    if state == 'queued' and not event.wait(config['MAX_WAIT']) and scheduler.cancel(waiter):
+        return None, _rejection(503, 'queue_timeout', scheduler.retry_after(config), request_class)
+    return _admitted(request_class, time.monotonic() - started), None
+
+
+async def _aadmit(request, config):
+    """Admission for async views; waiting holds no thread"""
+    request_class = classify_request(request)
+    wait = await sync_to_async(take_tokens)(client_id(request, config), REQUEST_CLASSES[request_class][1], config)
+    if wait:
+        return None, _rejection(429, 'rate_limited', wait, request_class)
+
+    started = time.monotonic()
+    loop = asyncio.get_running_loop()
+    granted = loop.create_future()
+
+    def notify():
+        # Called from whichever thread released capacity
+        loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+    state, waiter = scheduler.enqueue(request_class, notify, config)
+    if state == 'full':
+        return None, _rejection(503, 'queue_full', scheduler.retry_after(config), request_class)
+    if state == 'queued':
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), config['MAX_WAIT'])
+        except asyncio.TimeoutError:
+            if scheduler.cancel(waiter):
+                return None, _rejection(503, 'queue_timeout', scheduler.retry_after(config), request_class)
+        except asyncio.CancelledError:
+            # Client went away while queued; hand back the slot if it was granted meanwhile
+            if not scheduler.cancel(waiter):
+                scheduler.release(REQUEST_CLASSES[request_class][1], None, config)
+            raise
+    return _admitted(request_class, time.monotonic() - started), None
+
+
+def admission_controlled(view):
+    """Limit concurrent generations and queue/reject the overflow; works on sync and async views"""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            config = admission_settings()
+            if not config['ENABLED'] or request.method != 'POST':
+                return await view(request, *args, **kwargs)
+            ticket, rejection = await _aadmit(request, config)
+            if rejection is not None:
+                return rejection
+            request.admission = ticket
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                ticket.release(config)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        config = admission_settings()
+        if not config['ENABLED'] or request.method != 'POST':
+            return view(request, *args, **kwargs)
+        ticket, rejection = _admit(request, config)
+        if rejection is not None:
+            return rejection
+        request.admission = ticket
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            ticket.release(config)
+    return wrapper
+
+
+def record_admission_wait(request):
+    """Add the queue wait to the story's stage breakdown (call after start_stage_log); returns the wait"""
+    ticket = getattr(request, 'admission', None)
+    if ticket is None:
+        return 0.0
+    record_stage('admission.wait', ticket.waited, request_class=ticket.request_class)
+    return ticket.waited
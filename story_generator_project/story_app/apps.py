@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class StoryAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'story_app'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import signals  # noqa: F401
+        from .db import configure_sqlite_connection
+        connection_created.connect(configure_sqlite_connection)
@@ -0,0 +1,294 @@
+"""
+Async variant of the generation pipeline for the ASGI path (generate_story_async).
+
+Remote calls (Ollama, Hugging Face, Stability) are awaited and backoffs use
+asyncio.sleep, so a generation waiting on a provider holds no thread. CPU-bound
+stages (Whisper, PNG transcoding, scene composition) are handed to executor threads
+with sync_to_async. Everything between the awaits (request building, response
+handling, backoff decisions, prompt preparation, story assembly) is shared with
+StoryGeneratorService through its private helpers, so only the I/O differs.
+"""
+from asgiref.sync import sync_to_async
+import asyncio
+import httpx
+import logging
+
+from .characters import apply_character
+from .deadline import can_afford, deadline_settings, fit_timeout
+from .metrics import IMAGE_ATTEMPTS, timed_stage
+from .quality import image_tier
+from .scenes import agenerate_scenes
+from .services import StoryGeneratorService
+from .speculative import astart_speculative_background
+
+logger = logging.getLogger(__name__)
+
+
+def _in_thread(func):
+    """Run a blocking/CPU-bound callable on an executor thread, off the event loop"""
+    return sync_to_async(func, thread_sensitive=False)
+
+
+class AsyncStoryGeneratorService(StoryGeneratorService):
+    """
+    ``a``-prefixed coroutine versions of the StoryGeneratorService pipeline.
+    Use as an async context manager so the pooled HTTP client is closed afterwards:
+
+        service = await sync_to_async(AsyncStoryGeneratorService)()
+        async with service:
+            story = await service.agenerate_complete_story_with_images(prompt)
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.http = None
+
+    async def __aenter__(self):
+        # One connection pool per generation; retries and fallbacks reuse its connections
+        self.http = httpx.AsyncClient()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self.http is not None:
+            await self.http.aclose()
+            self.http = None
+
+    async def atranscribe_audio(self, audio_file):
+        return await _in_thread(self.transcribe_audio)(audio_file)
+
+    async def avalidate_audio_file(self, audio_file):
+        return await _in_thread(self.validate_audio_file)(audio_file)
+
+    async def agenerate_story_from_audio(self, audio_file, length='medium', genre='fantasy', character=None):
+        """Complete pipeline: transcribe audio -> generate story with images"""
+        try:
+            logger.info("Starting audio transcription...")
+            transcription_result = await self.atranscribe_audio(audio_file)
+            error = self._transcription_error(transcription_result)
+            if error:
+                return error
+
+            logger.info("Generating story from transcription...")
+            story_package = await self.agenerate_complete_story_with_images(
+                prompt=transcription_result['transcription'],
+                length=length,
+                genre=genre,
+                character=character
+            )
+            story_package.update(self._audio_story_metadata(transcription_result))
+            return story_package
+
+        except Exception as e:
+            logger.error(f"Error in audio story generation pipeline: {e}")
+            return self._input_error(str(e))
+
+    async def agenerate_story_from_mixed_input(self, text_prompt=None, audio_file=None, length='medium', genre='fantasy',
+                                               character=None):
+        """Generate story from both text and audio inputs"""
+        transcription_result = None
+        try:
+            if audio_file:
+                logger.info("Transcribing audio for mixed input...")
+                transcription_result = await self.atranscribe_audio(audio_file)
+
+            combined_prompt = self._mixed_prompt(text_prompt, transcription_result)
+            if not combined_prompt:
+                return self._input_error('No valid input provided (text or audio)', transcription_result)
+
+            logger.info("Generating story from mixed input...")
+            story_package = await self.agenerate_complete_story_with_images(
+                prompt=combined_prompt,
+                length=length,
+                genre=genre,
+                character=character
+            )
+            story_package.update(self._mixed_story_metadata(transcription_result, combined_prompt))
+            return story_package
+
+        except Exception as e:
+            logger.error(f"Error in mixed input story generation: {e}")
+            return self._input_error(str(e), transcription_result)
+
+    async def agenerate_complete_story_with_images(self, prompt, length='medium', genre='fantasy', character=None):
+        """Story package, character and background images, and the combined scene (see the sync version)"""
+        visual_style = self._get_visual_style_for_genre(genre)
+        speculation = astart_speculative_background(self, prompt, genre, visual_style)
+        story_package = await self.agenerate_complete_story(self._story_prompt(prompt, character), length, genre)
+        speculative_hit = self._settle_speculation(speculation, story_package)
+
+        library_image = apply_character(story_package, character) if character is not None else None
+        character_prompt, background_prompt = await self.aprepare_image_prompts(
+            story_package, visual_style, genre, skip_background=speculative_hit, skip_character=character is not None
+        )
+
+        if library_image is not None:
+            logger.info(f"Using library character {character.name!r}")
+        elif self._has_description(story_package, 'character'):
+            logger.info("Generating character image...")
+            story_package['character_image'] = await self.agenerate_character_image(
+                story_package['character_description'],
+                visual_style=visual_style,
+                genre=genre,
+                image_prompt=character_prompt
+            )
+
+        if self._has_description(story_package, 'background'):
+            background_image_result = await speculation.result() if speculative_hit else None
+            if background_image_result is None:
+                logger.info("Generating background image...")
+                background_image_result = await self.agenerate_background_image(
+                    story_package['background_description'],
+                    visual_style=visual_style,
+                    genre=genre,
+                    image_prompt=background_prompt
+                )
+            story_package['background_image'] = background_image_result
+
+        scene_inputs = self._scene_inputs(story_package, genre)
+        if scene_inputs:
+            logger.info("Combining images into cohesive scene...")
+            story_package['combined_scene'] = await self.acombine_images_into_scene(*scene_inputs)
+
+        story_package['scenes'] = await agenerate_scenes(self, story_package, genre, visual_style)
+        return story_package
+
+    async def aprepare_image_prompts(self, story_package, visual_style, genre, skip_background=False,
+                                     skip_character=False):
+        """prepare_image_prompts with the two extraction calls of 'concurrent' mode gathered"""
+        character_description = '' if skip_character else story_package['character_description']
+        background_description = '' if skip_background else story_package['background_description']
+        if self.image_prompt_mode != 'concurrent' or not (character_description and background_description):
+            return self.prepare_image_prompts(story_package, visual_style, genre, skip_background, skip_character)
+        character_prompt, background_prompt = await asyncio.gather(
+            self.agenerate_character_image_prompt(character_description, visual_style, genre),
+            self.agenerate_background_image_prompt(background_description, visual_style, genre),
+        )
+        return character_prompt, background_prompt
+
+    async def acombine_images_into_scene(self, character_b64, background_b64, character_desc, background_desc, genre):
+        # The pool (or in-thread compositor) blocks until the scene is ready, so wait in a thread
+        return await _in_thread(self.combine_images_into_scene)(
+            character_b64, background_b64, character_desc, background_desc, genre
+        )
+
+    async def agenerate_complete_story(self, prompt, length='medium', genre='fantasy'):
+        """Generate story, character description, and background description in a single chain"""
+        if not self.llm:
+            return self._generate_mock_complete_story(prompt, genre)
+
+        try:
+            chain = self._story_chain(length)
+            with timed_stage('llm.story', length=length):
+                complete_response = await chain.ainvoke(self._story_inputs(prompt, length, genre))
+            return self._parse_response(complete_response)
+
+        except Exception as e:
+            logger.error(f"Error generating complete story: {e}")
+            return self._generate_mock_complete_story(prompt, genre)
+
+    async def agenerate_character_image_prompt(self, character_description, visual_style, genre):
+        return await self._aextract_image_prompt('character', character_description, visual_style, genre)
+
+    async def agenerate_background_image_prompt(self, background_description, visual_style, genre):
+        return await self._aextract_image_prompt('background', background_description, visual_style, genre)
+
+    async def _aextract_image_prompt(self, kind, description, visual_style, genre):
+        chain = self._image_prompt_chain(kind)
+        if chain is None:
+            return self._mock_image_prompt(kind, description, genre)
+
+        try:
+            with timed_stage(f'llm.{kind}_prompt'):
+                image_prompt = await chain.ainvoke(self._image_prompt_inputs(kind, description, visual_style, genre))
+            return self._finish_image_prompt(kind, image_prompt, visual_style)
+
+        except Exception as e:
+            logger.error(f"Error generating {kind} image prompt: {e}")
+            return self._mock_image_prompt(kind, description, genre)
+
+    async def agenerate_character_image(self, character_description, visual_style, genre, image_prompt=None):
+        try:
+            if image_prompt is None:
+                image_prompt = await self.agenerate_character_image_prompt(character_description, visual_style, genre)
+            full_prompt = self._character_full_prompt(image_prompt)
+            return await self.arender_image(full_prompt, "character", genre)
+
+        except Exception as e:
+            logger.error(f"Error in character image generation: {e}")
+            return self._generate_placeholder_image("character")
+
+    async def agenerate_background_image(self, background_description, visual_style, genre, image_prompt=None):
+        try:
+            if image_prompt is None:
+                image_prompt = await self.agenerate_background_image_prompt(background_description, visual_style, genre)
+            full_prompt = self._background_full_prompt(image_prompt)
+            return await self.arender_image(full_prompt, "background", genre)
+
+        except Exception as e:
+            logger.error(f"Error in background image generation: {e}")
+            return self._generate_placeholder_image("background")
+
+    async def arender_image(self, full_prompt, image_type, genre):
+        tier = image_tier(self.image_tier)
+        for model in tier['hf_models']:
+            if not self._can_afford_image_call(f"image.{image_type}"):
+                return self._budget_placeholder(image_type)
+            try:
+                image_data = await self._acall_huggingface_api(
+                    model, full_prompt, max_retries=tier['retries'], image_type=self._provider_image_type(image_type)
+                )
+                if image_data:
+                    return self._image_result(image_data, full_prompt, model, image_type)
+            except Exception as e:
+                logger.warning(f"Failed to generate {image_type} with {model}: {e}")
+
+        return self._render_failed(image_type)
+
+    async def _acall_stability_api(self, prompt, image_type="portrait"):
+        if not self._can_afford_image_call('image.stability_request'):
+            return None
+        try:
+            with timed_stage('image.stability_request', image_type=image_type) as stage:
+                resp = await self.http.post(self.stability_url_map[image_type], headers=self.stability_headers,
+                                            json=self._stability_payload(prompt, image_type), timeout=fit_timeout(40))
+                stage['status'] = resp.status_code
+            return self._stability_image(resp)
+        except Exception as e:
+            self._image_call_error('stability', e)
+            return None
+
+    async def _acall_huggingface_api(self, model, prompt, max_retries=3, image_type="portrait"):
+        api_url = self._huggingface_url(model)
+        payload = self._huggingface_payload(prompt, image_type)
+
+        for attempt in range(max_retries):
+            if not can_afford(deadline_settings()['MIN_IMAGE_CALL']):
+                break
+            try:
+                with timed_stage('image.hf_request', model=model, attempt=attempt + 1) as stage:
+                    response = await self.http.post(api_url, headers=self.hf_headers, json=payload,
+                                                    timeout=fit_timeout(35))
+                    stage['status'] = response.status_code
+
+                if response.status_code == 200:
+                    IMAGE_ATTEMPTS.inc(provider='huggingface', outcome='success')
+                    with timed_stage('image.transcode'):
+                        return await _in_thread(self._transcode_image)(response.content)
+
+                delay = self._huggingface_retry_delay(model, response)
+                if delay is None:
+                    break
+                with timed_stage('image.backoff_sleep', reason='model_loading'):
+                    await asyncio.sleep(delay)
+
+            except httpx.TimeoutException:
+                delay = self._huggingface_timeout_delay(attempt, max_retries)
+                if delay:
+                    with timed_stage('image.backoff_sleep', reason='timeout'):
+                        await asyncio.sleep(delay)
+            except Exception as e:
+                self._image_call_error('huggingface', e)
+                break
+
+        self._note_stability_fallback(image_type)
+        return await self._acall_stability_api(prompt, image_type=image_type)
@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.core.cache import cache
+import logging
+
+logger = logging.getLogger(__name__)
+
+GENERATION_KEY = 'story_cache:generation'
+STATS_KEY = 'story_cache:stats:{kind}:{outcome}'
+FRAGMENT_KINDS = ['detail', 'list', 'recent']
+
+
+def _timeout(kind):
+    """Detail fragments never go stale; list fragments show relative times so expire sooner"""
+    config = getattr(settings, 'STORY_FRAGMENT_CACHE', {})
+    if kind == 'detail':
+        return config.get('DETAIL_TIMEOUT', 60 * 60)
+    return config.get('LIST_TIMEOUT', 60)
+
+
+def _incr(key):
+    """Increment a counter; shared by all workers only with a shared backend (LocMemCache is per process)"""
+    try:
+        cache.add(key, 0, None)
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def get_generation():
+    """Current list generation; bumped whenever a story is created or deleted"""
+    return cache.get_or_set(GENERATION_KEY, 1, None)
+
+
+def bump_generation():
+    """Invalidate every cached list fragment"""
+    _incr(GENERATION_KEY)
+
+
+def detail_key(story_id, updated_at):
+    return f"story_fragment:detail:{story_id}:{updated_at.timestamp()}"
+
+
+def list_key(kind, latest_created_at, *parts):
+    """Key for a list fragment, tied to the newest story and the list generation"""
+    latest = latest_created_at.timestamp() if latest_created_at else 0
+    suffix = ':'.join(str(p) for p in parts)
+    return f"story_fragment:{kind}:{get_generation()}:{latest}:{suffix}"
+
+
+def cached_fragment(kind, key, render_func):
+    """Return the cached fragment for ``key``, rendering and storing it on a miss"""
+    fragment = cache.get(key)
+    if fragment is not None:
+        _incr(STATS_KEY.format(kind=kind, outcome='hits'))
+        return fragment
+
+    _incr(STATS_KEY.format(kind=kind, outcome='misses'))
+    fragment = render_func()
+    cache.set(key, fragment, _timeout(kind))
+    return fragment
+
+
+def invalidate_story(story):
+    """Drop the fragments that may contain this story"""
+    try:
+        cache.delete(detail_key(story.id, story.content_updated_at))
+    except Exception as e:
+        logger.warning(f"Could not drop cached detail fragment for story {story.id}: {e}")
+    bump_generation()
+
+
+def cache_stats():
+    """Hit/miss counters and hit ratio for each fragment kind"""
+    stats = {}
+    for kind in FRAGMENT_KINDS:
+        hits = cache.get(STATS_KEY.format(kind=kind, outcome='hits'), 0)
+        misses = cache.get(STATS_KEY.format(kind=kind, outcome='misses'), 0)
+        total = hits + misses
+        stats[kind] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / total, 4) if total else 0.0,
+        }
+    return stats
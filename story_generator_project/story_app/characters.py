@@ -0,0 +1,103 @@
+"""
+Character library and series mode.
+
+A library Character is a saved protagonist: the description, the portrait (base64 PNG,
+stored like story images) and the image prompt it was rendered from. Any story's
+character can be saved to the library under a name.
+
+A story that references a library character is written as a sequel. The story prompt
+names the character and includes the saved description. The character image prompt call
+and the portrait render are skipped, and the saved portrait goes straight to
+combine_images_into_scene with the new background. Multi-scene stories reuse it the
+same way. The story keeps a link to its character, and refinement leaves the portrait
+alone.
+
+Characters are looked up by a case- and whitespace-insensitive name key, which has a
+unique index (the ``character`` key in generate_stories input). Each saved story bumps
+the character's usage_count and last_used_at with an UPDATE.
+"""
+from collections import Counter
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+import logging
+
+from .metrics import LIBRARY_CHARACTER_USES
+from .models import Character, character_name_key
+
+logger = logging.getLogger(__name__)
+
+
+class CharacterError(Exception):
+    """A story's character can't be saved to the library"""
+
+
+def series_prompt(prompt, character):
+    """Story prompt for a sequel about ``character``"""
+    return f"{prompt} | Recurring character: {character.name}, {character.description}"
+
+
+def apply_character(story_package, character):
+    """Put the library character's description and portrait in place of generated ones"""
+    story_package['character_description'] = character.description
+    story_package['character_image'] = {
+        'image_data': character.image_data,
+        'prompt': character.image_prompt,
+        'model_used': character.image_model,
+        'success': True,
+        'type': 'character',
+        'tier': character.image_tier,
+        'library': True,
+    }
+    story_package['character_id'] = character.id
+    story_package['character_name'] = character.name
+    LIBRARY_CHARACTER_USES.inc()
+    return story_package['character_image']
+
+
+def record_character_use(character_ids):
+    """Bump the usage counters of the characters used by newly saved stories (ids may repeat)"""
+    now = timezone.now()
+    for character_id, uses in Counter(filter(None, character_ids)).items():
+        Character.objects.filter(id=character_id).update(
+            usage_count=F('usage_count') + uses, last_used_at=now
+        )
+
+
+def save_story_character(story, name):
+    """
+    Save ``story``'s character to the library as ``name``. If a character with that name
+    already exists, it is updated in place, so the name keeps pointing at the latest version.
+    """
+    name = ' '.join((name or '').split())
+    if not name:
+        raise CharacterError("The character needs a name")
+    if story.character_image_placeholder:
+        raise CharacterError("This story's character image is only a placeholder")
+    if not (story.character_image_data and story.character_description):
+        raise CharacterError("This story has no character portrait to save")
+
+    fields = {
+        'name': name,
+        'genre': story.genre,
+        'description': story.character_description,
+        'image_data': story.character_image_data,
+        'image_prompt': story.character_image_prompt,
+        'image_model': story.character_image_model,
+        'image_tier': story.character_image_tier,
+        'source_story': story,
+    }
+    try:
+        with transaction.atomic():
+            character, created = Character.objects.update_or_create(
+                name_key=character_name_key(name), defaults=fields
+            )
+    except IntegrityError:
+        # Another request created the same name first; update that one
+        character = Character.objects.lookup(name)
+        for field, value in fields.items():
+            setattr(character, field, value)
+        character.save()
+        created = False
+    logger.info(f"{'Saved' if created else 'Updated'} library character {name!r} from story {story.id}")
+    return character, created
@@ -0,0 +1,254 @@
+"""
+Runs scene composition in a warm process pool instead of the request thread.
+
+PIL, OpenCV, NumPy and the rembg ONNX model are CPU-bound and hold the GIL for long
+stretches, so compositing inside a threaded WSGI/ASGI worker stalls every other request
+in that process. Each pool worker keeps its own SceneCompositor and rembg session. Image
+bytes travel through shared memory in both directions, so megabytes of PNG data are never
+pickled through the pool's pipes.
+
+STORY_COMPOSITOR['MODE'] = 'thread' keeps the old in-request behaviour.
+"""
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from django.conf import settings
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+import atexit
+import base64
+import logging
+import os
+import threading
+import time
+
+from .compositor import SceneCompositor, get_rembg_session
+from .inference import get_inference_client
+from .metrics import (
+    COMPOSITOR_INFLIGHT, COMPOSITOR_POOL_SIZE, COMPOSITOR_TASKS, COMPOSITOR_TASK_SECONDS,
+    merge_stage_entries, start_stage_log, timed_stage,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMPOSITOR_SETTINGS = {
+    'MODE': 'process',
+    'POOL_SIZE': 2,
+    # Tasks allowed to wait for a free worker; beyond that new scenes are rejected
+    'QUEUE_DEPTH': 8,
+    'TASK_TIMEOUT': 120,
+    'START_METHOD': 'spawn',
+    'ONNX_THREADS': 1,
+}
+
+
+class CompositorBusy(Exception):
+    """The pool's queue is full"""
+
+
+def compositor_settings():
+    config = dict(DEFAULT_COMPOSITOR_SETTINGS)
+    config.update(getattr(settings, 'STORY_COMPOSITOR', {}))
+    return config
+
+
+# --- worker process side ---
+
+_worker_compositor = None
+
+
+def _init_worker(onnx_threads):
+    global _worker_compositor
+    _worker_compositor = SceneCompositor()
+    if get_inference_client() is not None:
+        # Background removal goes to the inference sidecar; don't load a model per worker
+        return
+    try:
+        get_rembg_session(onnx_threads)
+    except Exception as e:
+        # Compositing still works; _composite_final_scene logs and skips removal
+        logger.warning(f"Compositor worker {os.getpid()} could not load rembg: {e}")
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _composite_task(input_name, char_size, bg_size, character_desc, background_desc, genre, submitted_at):
+    """Runs in a pool worker: read input PNGs from shared memory, write the scene PNG to a new block"""
+    started = time.time()
+    stage_log = start_stage_log()
+
+    inputs = SharedMemory(name=input_name)
+    try:
+        char_bytes = bytes(inputs.buf[:char_size])
+        bg_bytes = bytes(inputs.buf[char_size:char_size + bg_size])
+    finally:
+        inputs.close()
+
+    compositor = _worker_compositor
+    with timed_stage('compose.decode'):
+        char_img = compositor._decode_image_bytes(char_bytes)
+        bg_img = compositor._decode_image_bytes(bg_bytes)
+    final_image, position_info = compositor.compose(char_img, bg_img, character_desc, background_desc, genre)
+    with timed_stage('compose.encode'):
+        png = compositor._encode_image_to_png(final_image)
+
+    output = SharedMemory(create=True, size=len(png))
+    output.buf[:len(png)] = png
+    output.close()
+    return {
+        'output_name': output.name,
+        'output_size': len(png),
+        'position_info': position_info,
+        'stages': stage_log,
+        'queue_wait': started - submitted_at,
+        'run': time.time() - started,
+    }
+
+
+# --- request process side ---
+
+_pool = {'executor': None, 'pid': None, 'slots': None}
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """The process's executor, created lazily (and again after a fork, e.g. gunicorn --preload)"""
+    with _pool_lock:
+        if _pool['executor'] is None or _pool['pid'] != os.getpid():
+            config = compositor_settings()
+            executor = ProcessPoolExecutor(
+                max_workers=config['POOL_SIZE'],
+                mp_context=get_context(config['START_METHOD']),
+                initializer=_init_worker,
+                initargs=(config['ONNX_THREADS'],),
+            )
+            # Start every worker now so the first scenes don't pay for spawning and model loading
+            for _ in range(config['POOL_SIZE']):
+                executor.submit(_warm_up)
+            _pool.update(
+                executor=executor,
+                pid=os.getpid(),
+                slots=threading.BoundedSemaphore(config['POOL_SIZE'] + config['QUEUE_DEPTH']),
+            )
+            COMPOSITOR_POOL_SIZE.set(config['POOL_SIZE'], kind='workers')
+            COMPOSITOR_POOL_SIZE.set(config['QUEUE_DEPTH'], kind='queue_depth')
+            logger.info(f"Started compositor pool with {config['POOL_SIZE']} workers")
+        return _pool['executor'], _pool['slots']
+
+
+def _reset_pool():
+    with _pool_lock:
+        executor = _pool['executor']
+        _pool.update(executor=None, pid=None, slots=None)
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+@atexit.register
+def shutdown_pool():
+    if _pool['executor'] is not None and _pool['pid'] == os.getpid():
+        _reset_pool()
+
+
+def _release_output(result):
+    output = SharedMemory(name=result['output_name'])
+    try:
+        return bytes(output.buf[:result['output_size']])
+    finally:
+        output.close()
+        output.unlink()
+
+
+def _discard_late_output(future):
+    """A task that finished after we gave up on it still left a shared memory block behind"""
+    try:
+        _release_output(future.result())
+    except Exception:
+        pass
+
+
+def _composite_in_pool(character_b64, background_b64, character_desc, background_desc, genre, timeout=None):
+    config = compositor_settings()
+    timeout = config['TASK_TIMEOUT'] if timeout is None else min(timeout, config['TASK_TIMEOUT'])
+    executor, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        COMPOSITOR_TASKS.inc(outcome='rejected')
+        raise CompositorBusy(f"Compositor queue is full ({config['POOL_SIZE']} workers, depth {config['QUEUE_DEPTH']})")
+
+    COMPOSITOR_INFLIGHT.inc()
+    started = time.time()
+    inputs = None
+    release_slot = True
+    try:
+        char_bytes = base64.b64decode(character_b64)
+        bg_bytes = base64.b64decode(background_b64)
+        inputs = SharedMemory(create=True, size=len(char_bytes) + len(bg_bytes))
+        inputs.buf[:len(char_bytes)] = char_bytes
+        inputs.buf[len(char_bytes):len(char_bytes) + len(bg_bytes)] = bg_bytes
+
+        future = executor.submit(
+            _composite_task, inputs.name, len(char_bytes), len(bg_bytes),
+            character_desc, background_desc, genre, started,
+        )
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # The worker is still busy with it; keep its slot taken until it finishes
+            release_slot = False
+            future.add_done_callback(lambda done: (_discard_late_output(done), slots.release()))
+            COMPOSITOR_TASKS.inc(outcome='timeout')
+            raise
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool for the next request
+            COMPOSITOR_TASKS.inc(outcome='broken_pool')
+            _reset_pool()
+            raise
+
+        png = _release_output(result)
+        merge_stage_entries(result['stages'])
+        with timed_stage('compose.encode_base64'):
+            combined_b64 = base64.b64encode(png).decode()
+
+        COMPOSITOR_TASK_SECONDS.observe(result['queue_wait'], phase='queue_wait')
+        COMPOSITOR_TASK_SECONDS.observe(result['run'], phase='run')
+        COMPOSITOR_TASK_SECONDS.observe(time.time() - started, phase='total')
+        COMPOSITOR_TASKS.inc(outcome='success')
+        return combined_b64, result['position_info']
+    except (CompositorBusy, FutureTimeoutError, BrokenProcessPool):
+        raise
+    except Exception:
+        COMPOSITOR_TASKS.inc(outcome='error')
+        raise
+    finally:
+        if inputs is not None:
+            inputs.close()
+            inputs.unlink()
+        COMPOSITOR_INFLIGHT.inc(-1)
+        if release_slot:
+            slots.release()
+
+
+def _composite_in_thread(character_b64, background_b64, character_desc, background_desc, genre):
+    compositor = SceneCompositor()
+    with timed_stage('compose.decode'):
+        char_img = compositor._decode_base64_image(character_b64)
+        bg_img = compositor._decode_base64_image(background_b64)
+    if char_img is None or bg_img is None:
+        raise ValueError("Failed to decode input images")
+
+    final_image, position_info = compositor.compose(char_img, bg_img, character_desc, background_desc, genre)
+    with timed_stage('compose.encode'):
+        combined_b64 = compositor._encode_image_to_base64(final_image)
+    return combined_b64, position_info
+
+
+def composite_scene(character_b64, background_b64, character_desc, background_desc, genre, timeout=None):
+    """
+    Compose a scene from base64 images; returns (scene base64 PNG, position_info).
+    ``timeout`` caps the wait for a pool worker (the in-thread mode can't be interrupted).
+    """
+    if compositor_settings()['MODE'] == 'process':
+        return _composite_in_pool(character_b64, background_b64, character_desc, background_desc, genre, timeout)
+    return _composite_in_thread(character_b64, background_b64, character_desc, background_desc, genre)
+
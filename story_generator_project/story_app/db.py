@@ -0,0 +1,44 @@
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# PRAGMAs that only take effect outside a transaction and persist in the database file
+PERSISTENT_PRAGMAS = {'journal_mode'}
+
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 10000,
+    'temp_store': 'MEMORY',
+    'cache_size': -32000,
+    'foreign_keys': 'ON',
+}
+
+
+def sqlite_pragmas():
+    """PRAGMAs applied to every new SQLite connection (settings.SQLITE_PRAGMAS overrides defaults)"""
+    pragmas = dict(DEFAULT_SQLITE_PRAGMAS)
+    pragmas.update(getattr(settings, 'SQLITE_PRAGMAS', {}))
+    return pragmas
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """
+    connection_created handler: switch SQLite to WAL so readers never block the
+    writer, and wait on locks instead of failing with "database is locked"
+    """
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas().items():
+            try:
+                cursor.execute(f"PRAGMA {name} = {value}")
+                if name in PERSISTENT_PRAGMAS:
+                    mode = cursor.fetchone()
+                    if mode and str(mode[0]).lower() != str(value).lower():
+                        # In-memory databases cannot use WAL; that's fine for tests
+                        logger.debug(f"SQLite kept {name}={mode[0]} (requested {value})")
+            except Exception as e:
+                logger.warning(f"Could not apply PRAGMA {name}={value}: {e}")
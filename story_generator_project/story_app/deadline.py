@@ -0,0 +1,95 @@
+"""
+Per-request time budget for the generation pipeline (STORY_DEADLINE).
+
+The view starts a deadline; every stage asks how much is left and shrinks its timeouts,
+retries and backoffs to fit, or switches to a local fallback (template image prompts,
+a placeholder image drawn by the page, skipping the composite) once the budget runs low.
+RESERVE seconds are held back for saving the story and rendering the page. The deadline
+lives in a ContextVar, so it follows the request into executor threads and coroutines.
+"""
+from contextvars import ContextVar
+from django.conf import settings
+import time
+
+from .metrics import DEADLINE_FALLBACKS
+
+DEFAULT_DEADLINE_SETTINGS = {
+    'ENABLED': True,
+    # Seconds from the request's arrival to the rendered page
+    'BUDGET': 90,
+    'RESERVE': 5,
+    # The story chain may use at most this share of what is left when it starts
+    'STORY_SHARE': 0.5,
+    # Minimum time left to attempt each kind of remote call
+    'MIN_LLM_CALL': 10,
+    'MIN_IMAGE_CALL': 6,
+    'MIN_COMPOSITE': 4,
+}
+
+# Model name stored for an image the budget left no time to render. Its data is NULL and
+# the page draws a gradient in the genre's colors in its place.
+PLACEHOLDER_MODEL = 'local_placeholder'
+
+# (dark, light) gradient ends for budget placeholders
+GENRE_PLACEHOLDER_COLORS = {
+    'fantasy': ('#1d1040', '#c7a6ff'),
+    'sci-fi': ('#04161f', '#35e0ff'),
+    'mystery': ('#0b0b0f', '#6b6f80'),
+    'romance': ('#3a0f24', '#ffc2d6'),
+    'adventure': ('#1f2a10', '#f2c76b'),
+    'horror': ('#080203', '#7a0c12'),
+    'drama': ('#1c1c1c', '#c8bfae'),
+    'comedy': ('#ff8a00', '#fff36b'),
+}
+
+# Absolute time.monotonic() deadline of the current request; None when unbounded
+_deadline = ContextVar('story_deadline', default=None)
+
+
+def deadline_settings():
+    config = dict(DEFAULT_DEADLINE_SETTINGS)
+    config.update(getattr(settings, 'STORY_DEADLINE', {}))
+    return config
+
+
+def start_deadline(already_spent=0.0):
+    """Bound the current request; ``already_spent`` covers time before the view (e.g. queueing)"""
+    config = deadline_settings()
+    if not config['ENABLED']:
+        _deadline.set(None)
+        return None
+    deadline = time.monotonic() + config['BUDGET'] - config['RESERVE'] - already_spent
+    _deadline.set(deadline)
+    return deadline
+
+
+def remaining():
+    """Seconds left for pipeline work (RESERVE excluded), or None without a deadline"""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+def fit_timeout(timeout, share=1.0):
+    """``timeout`` shortened to ``share`` of the time left"""
+    left = remaining()
+    if left is None:
+        return timeout
+    return max(0.1, min(timeout, left * share)) if timeout else max(0.1, left * share)
+
+
+def can_afford(seconds):
+    left = remaining()
+    return left is None or left >= seconds
+
+
+def placeholder_gradient(genre):
+    """CSS background standing in for a budget placeholder image"""
+    dark, light = GENRE_PLACEHOLDER_COLORS.get(genre, ('#202020', '#d0d0d0'))
+    return f"linear-gradient(to bottom, {dark}, {light})"
+
+
+def budget_fallback(stage):
+    """Count a stage that switched to its local fallback because the budget ran low"""
+    DEADLINE_FALLBACKS.inc(stage=stage)
@@ -0,0 +1,168 @@
+import base64
+import hashlib
+import mimetypes
+import os
+import re
+
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.encoding import smart_str
+from django.utils.http import parse_etags
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# mimetypes does not know every format we accept for audio uploads
+AUDIO_CONTENT_TYPES = {
+    '.mp3': 'audio/mpeg',
+    '.wav': 'audio/wav',
+    '.m4a': 'audio/mp4',
+    '.ogg': 'audio/ogg',
+    '.flac': 'audio/flac',
+    '.aac': 'audio/aac',
+    '.webm': 'audio/webm',
+}
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def guess_content_type(filename, default='application/octet-stream'):
+    """Return the content type for a stored file based on its extension"""
+    ext = os.path.splitext(filename.lower())[1]
+    if ext in AUDIO_CONTENT_TYPES:
+        return AUDIO_CONTENT_TYPES[ext]
+    content_type, _ = mimetypes.guess_type(filename)
+    return content_type or default
+
+
+def make_etag(*parts):
+    """Build a quoted ETag from the given identifying parts"""
+    digest = hashlib.sha1('|'.join(str(p) for p in parts).encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def parse_range_header(range_header, size):
+    """
+    Parse a single-range ``Range`` header.
+    Returns (start, end) inclusive, None to serve the whole file,
+    or False when the range cannot be satisfied.
+    """
+    if not range_header:
+        return None
+
+    match = RANGE_RE.match(range_header.strip())
+    if not match:
+        # Multiple or malformed ranges: ignore and send the full body
+        return None
+
+    start_str, end_str = match.groups()
+    if not start_str and not end_str:
+        return None
+
+    if not start_str:
+        # Suffix range: last N bytes
+        length = int(end_str)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+
+    start = int(start_str)
+    end = int(end_str) if end_str else size - 1
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def iter_file_chunks(file_obj, start, length, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield ``length`` bytes of an open file from ``start`` and close it afterwards"""
+    try:
+        file_obj.seek(start)
+        remaining = length
+        while remaining > 0:
+            chunk = file_obj.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file_obj.close()
+
+
+def base64_decoded_size(b64_data):
+    """Size in bytes of the decoded payload without decoding it"""
+    padding = len(b64_data) - len(b64_data.rstrip('='))
+    return len(b64_data) * 3 // 4 - padding
+
+
+def iter_base64_chunks(b64_data, start, length, chunk_size=STREAM_CHUNK_SIZE):
+    """Decode a slice of a base64 string incrementally, one aligned block at a time"""
+    # Every 4 base64 characters decode to 3 bytes, so jump straight to the block holding ``start``
+    block_start = (start // 3) * 4
+    skip = start % 3
+    step = (chunk_size // 3) * 4
+    remaining = length
+
+    pos = block_start
+    while remaining > 0 and pos < len(b64_data):
+        decoded = base64.b64decode(b64_data[pos:pos + step])
+        pos += step
+        if skip:
+            decoded = decoded[skip:]
+            skip = 0
+        if len(decoded) > remaining:
+            decoded = decoded[:remaining]
+        remaining -= len(decoded)
+        yield decoded
+
+
+def not_modified(request, etag):
+    """
+    304 response when the request's If-None-Match matches ``etag``, else None.
+    Views call this before loading a large body, so a revalidation costs only the ETag lookup.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == '*'):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+    return None
+
+
+def ranged_response(request, size, chunk_iter_factory, content_type, etag,
+                    filename=None, as_attachment=True):
+    """
+    Build a streaming response with Range, Content-Length and ETag handling.
+    ``chunk_iter_factory(start, length)`` must return an iterator over the body bytes.
+    """
+    response = not_modified(request, etag)
+    if response is not None:
+        return response
+
+    byte_range = parse_range_header(request.META.get('HTTP_RANGE'), size)
+
+    # If-Range: only honour the range when the client's copy is still current
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if byte_range and if_range and if_range.strip() != etag:
+        byte_range = None
+
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(chunk_iter_factory(start, length), status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        length = size
+        response = StreamingHttpResponse(chunk_iter_factory(0, size), content_type=content_type)
+
+    response['Content-Length'] = str(length)
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    if filename:
+        disposition = 'attachment' if as_attachment else 'inline'
+        response['Content-Disposition'] = f'{disposition}; filename="{smart_str(filename)}"'
+
+    return response
@@ -0,0 +1,277 @@
+"""
+Streaming bulk export of stories (manage.py export_stories and /export/).
+
+Rows are read in (created_at, id) order with chunked ``iterator()`` queries. Metadata
+exports select only the text columns, so the multi-megabyte image data is never loaded.
+Media archives fetch one image column at a time. Every format is produced by a
+generator of byte chunks, so memory stays flat whatever the table size. The same
+generators feed a file or a StreamingHttpResponse.
+
+Exports are incremental. An export covers the rows after a watermark, up to the newest
+row when it starts, and reports that row as the next watermark. The watermark is an
+opaque token in the same form as the story list cursor.
+"""
+from datetime import datetime
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import BooleanField, ExpressionWrapper, Q
+import io
+import json
+import os
+import tarfile
+import time
+import zipfile
+
+from .downloads import STREAM_CHUNK_SIZE, base64_decoded_size, iter_base64_chunks
+from .models import StoryGeneration, StoryScene
+from .pagination import decode_cursor, encode_cursor
+
+EXPORT_FORMATS = ['jsonl', 'parquet']
+CONTENT_TYPES = {
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+    'tar': 'application/x-tar',
+    'zip': 'application/zip',
+}
+
+# Columns in a metadata export; the image data columns are left out on purpose
+EXPORT_FIELDS = [
+    'id', 'created_at', 'genre', 'story_length', 'input_type',
+    'prompt', 'audio_transcription', 'audio_duration', 'audio_file',
+    'generated_story', 'character_description', 'background_description',
+    'character_image_prompt', 'character_image_model', 'character_image_tier',
+    'background_image_prompt', 'background_image_model', 'background_image_tier',
+    'combined_scene_prompt', 'combined_scene_model', 'combined_scene_tier', 'combination_info',
+    'character_id',
+]
+# Image columns in an archive, with their file names
+MEDIA_IMAGES = [
+    ('character_image_data', 'character.png'),
+    ('background_image_data', 'background.png'),
+    ('combined_scene_data', 'scene.png'),
+]
+METADATA_CHUNK_SIZE = 500
+PARQUET_ROW_GROUP = 1000
+
+
+class ExportError(Exception):
+    """Bad export parameters or a missing optional dependency"""
+
+
+def parse_since(value):
+    """(created_at, id) to export after, from a watermark token or an ISO timestamp; None for everything"""
+    if not value:
+        return None
+    position = decode_cursor(value)
+    if position:
+        return position
+    try:
+        # A bare timestamp: every row created after it
+        return datetime.fromisoformat(value), None
+    except ValueError:
+        raise ExportError(f"Invalid watermark {value!r}")
+
+
+def export_queryset(genre=None, input_type=None, story_length=None, since=None):
+    """
+    Stories to export, oldest first, and the watermark of the newest one included.
+    Rows created after the export starts are left for the next one.
+    """
+    queryset = StoryGeneration.objects.filter_listing(genre, input_type, story_length)
+    position = parse_since(since)
+    if position:
+        created_at, story_id = position
+        if story_id is None:
+            queryset = queryset.filter(created_at__gt=created_at)
+        else:
+            queryset = queryset.filter(created_at__gte=created_at).filter(
+                Q(created_at__gt=created_at) | Q(id__gt=story_id)
+            )
+    newest = queryset.order_by('-created_at', '-id').values_list('created_at', 'id').first()
+    if newest is None:
+        return queryset.none(), since
+    queryset = queryset.filter(created_at__lte=newest[0]).exclude(created_at=newest[0], id__gt=newest[1])
+    return queryset.order_by('created_at', 'id'), encode_cursor(*newest)
+
+
+def _flag_name(column):
+    return f'has_{column.replace("_data", "")}'
+
+
+def _image_flags():
+    """has_<image> annotations; a NULL check never reads the image value itself"""
+    return {
+        _flag_name(column): ExpressionWrapper(Q(**{f'{column}__isnull': False}), output_field=BooleanField())
+        for column, _ in MEDIA_IMAGES
+    }
+
+
+def _metadata_rows(queryset):
+    flags = _image_flags()
+    return queryset.annotate(**flags).values(*EXPORT_FIELDS, *flags).iterator(chunk_size=METADATA_CHUNK_SIZE)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, non-seekable file object whose bytes are collected for a generator to drain"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_jsonl(queryset):
+    for row in _metadata_rows(queryset):
+        yield (json.dumps(row, cls=DjangoJSONEncoder) + '\n').encode()
+
+
+def _parquet_schema(pa):
+    text = pa.string()
+    types = {'id': pa.int64(), 'character_id': pa.int64(), 'created_at': pa.timestamp('us', tz='UTC'), 'audio_duration': pa.float64()}
+    fields = [pa.field(name, types.get(name, text)) for name in EXPORT_FIELDS]
+    fields += [pa.field(_flag_name(column), pa.bool_()) for column, _ in MEDIA_IMAGES]
+    return pa.schema(fields)
+
+
+def iter_parquet(queryset):
+    """Parquet written one row group at a time; pyarrow is only needed for this format"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ExportError("Parquet export needs pyarrow (pip install pyarrow)")
+    return _iter_parquet(queryset, pa, pq)
+
+
+def _iter_parquet(queryset, pa, pq):
+    schema = _parquet_schema(pa)
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+
+    def write(rows):
+        for row in rows:
+            # Nested JSON and file names are stored as text
+            row['combination_info'] = json.dumps(row['combination_info']) if row['combination_info'] else None
+            row['audio_file'] = row['audio_file'] or None
+        writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+        return sink.drain()
+
+    rows = []
+    for row in _metadata_rows(queryset):
+        rows.append(row)
+        if len(rows) >= PARQUET_ROW_GROUP:
+            yield write(rows)
+            rows = []
+    if rows:
+        yield write(rows)
+    writer.close()
+    yield sink.drain()
+
+
+class _ChunkReader(io.RawIOBase):
+    """Readable file object over an iterator of byte chunks (for tarfile.addfile)"""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._pending = b''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._pending += chunk
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+def _media_members(queryset):
+    """(archive path, size, chunk iterator factory, mtime) for every image and audio file"""
+    flags = _image_flags()
+    rows = queryset.annotate(**flags).values('id', 'created_at', 'audio_file', *flags)
+    for row in rows.iterator(chunk_size=METADATA_CHUNK_SIZE):
+        mtime = row['created_at'].timestamp()
+        for column, name in MEDIA_IMAGES:
+            if not row[_flag_name(column)]:
+                continue
+            # One image per query, so memory is bounded by the largest image rather than a chunk of rows
+            data = StoryGeneration.objects.filter(id=row['id']).values_list(column, flat=True).first()
+            if data:
+                yield (f"stories/{row['id']}/{name}", base64_decoded_size(data),
+                       lambda data=data: iter_base64_chunks(data, 0, base64_decoded_size(data)), mtime)
+        scene_ids = StoryScene.objects.filter(story_id=row['id'], image_data__isnull=False).values_list('id', 'order')
+        for scene_id, order in scene_ids:
+            data = StoryScene.objects.filter(id=scene_id).values_list('image_data', flat=True).first()
+            if data:
+                yield (f"stories/{row['id']}/scenes/{order + 1}.png", base64_decoded_size(data),
+                       lambda data=data: iter_base64_chunks(data, 0, base64_decoded_size(data)), mtime)
+        audio_name = row['audio_file']
+        if audio_name and default_storage.exists(audio_name):
+            yield (f"stories/{row['id']}/audio{os.path.splitext(audio_name)[1]}", default_storage.size(audio_name),
+                   lambda audio_name=audio_name: _iter_storage_file(audio_name), mtime)
+
+
+def _iter_storage_file(name):
+    with default_storage.open(name, 'rb') as f:
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+
+def iter_tar(queryset):
+    """Uncompressed tar stream (sizes are known up front, so members are never buffered)"""
+    sink = _ChunkSink()
+    archive = tarfile.open(fileobj=sink, mode='w|', format=tarfile.PAX_FORMAT)
+    for path, size, chunks, mtime in _media_members(queryset):
+        info = tarfile.TarInfo(path)
+        info.size = size
+        info.mtime = mtime
+        archive.addfile(info, _ChunkReader(chunks()))
+        yield sink.drain()
+    archive.close()
+    yield sink.drain()
+
+
+def iter_zip(queryset):
+    """Zip stream with data descriptors; images are already compressed, so entries are stored"""
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for path, size, chunks, mtime in _media_members(queryset):
+            info = zipfile.ZipInfo(path, date_time=time.localtime(mtime)[:6])
+            with archive.open(info, mode='w', force_zip64=size > 0x7fffffff) as member:
+                for chunk in chunks():
+                    member.write(chunk)
+                    yield sink.drain()
+    yield sink.drain()
+
+
+EXPORTERS = {'jsonl': iter_jsonl, 'parquet': iter_parquet, 'tar': iter_tar, 'zip': iter_zip}
+
+
+def iter_export(export_format, queryset):
+    if export_format not in EXPORTERS:
+        raise ExportError(f"Unknown export format {export_format!r}")
+    # Skip the empty drains between members
+    return (chunk for chunk in EXPORTERS[export_format](queryset) if chunk)
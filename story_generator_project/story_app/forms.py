@@ -1,4 +1,5 @@
 from django import forms
+from .models import Character, StoryGeneration
 
 class StoryPromptForm(forms.Form):
     prompt = forms.CharField(
@@ -66,6 +67,23 @@ class StoryPromptForm(forms.Form):
         label='Genre'
     )
     
+    # Series mode: reuse a saved character and its portrait
+    character = forms.ModelChoiceField(
+        queryset=Character.objects.for_library(),
+        widget=forms.Select(attrs={'class': 'form-control'}),
+        empty_label='New character',
+        label='Recurring Character',
+        help_text='Write a new story about a character saved in your library, with the same portrait.',
+        required=False
+    )
+    
+    def clean_character(self):
+        character = self.cleaned_data.get('character')
+        if character is not None:
+            # The choices skip the portrait column; load it now rather than lazily mid-generation
+            character.refresh_from_db(fields=['image_data', 'image_prompt'])
+        return character
+    
     def clean(self):
         cleaned_data = super().clean()
         prompt = cleaned_data.get('prompt')
@@ -87,4 +105,61 @@ class StoryPromptForm(forms.Form):
             if audio_file.size > 10 * 1024 * 1024:
                 raise forms.ValidationError("Audio file must be smaller than 10MB.")
         
-        return cleaned_data
\ No newline at end of file
+        return cleaned_data
+
+class StoryFilterForm(forms.Form):
+    genre = forms.ChoiceField(
+        choices=[('', 'All genres')] + StoryGeneration.GENRE_CHOICES,
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'}),
+        required=False
+    )
+    
+    input_type = forms.ChoiceField(
+        choices=[('', 'All inputs')] + StoryGeneration.INPUT_TYPE_CHOICES,
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'}),
+        required=False
+    )
+    
+    story_length = forms.ChoiceField(
+        choices=[('', 'All lengths')] + StoryGeneration.LENGTH_CHOICES,
+        widget=forms.Select(attrs={'class': 'form-select form-select-sm'}),
+        required=False
+    )
+    
+    cursor = forms.CharField(widget=forms.HiddenInput, required=False)
+
+
+class CharacterSaveForm(forms.Form):
+    name = forms.CharField(
+        widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Character name'}),
+        max_length=100,
+        label='Name'
+    )
+
+
+class StorySearchForm(forms.Form):
+    q = forms.CharField(
+        widget=forms.TextInput(attrs={
+            'class': 'form-control',
+            'placeholder': 'Search prompts, stories, characters and settings',
+            'type': 'search'
+        }),
+        max_length=200,
+        label='Search',
+        required=False
+    )
+
+
+class ProfilerSettingsForm(forms.Form):
+    enabled = forms.BooleanField(
+        widget=forms.CheckboxInput(attrs={'class': 'form-check-input'}),
+        label='Profile sampled requests',
+        required=False
+    )
+    sample_rate = forms.FloatField(
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'step': '0.01'}),
+        min_value=0.0,
+        max_value=1.0,
+        label='Fraction of requests to profile',
+        initial=0.0
+    )
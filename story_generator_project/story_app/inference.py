@@ -0,0 +1,274 @@
+"""
+Optional inference sidecar: one local process owns the Whisper and rembg models and
+serves every web worker over a Unix socket, instead of each worker loading its own copy.
+
+Wire format (both directions), big-endian:
+    magic b'STIF' | version u8 | op/status u8 | meta length u32 | payload length u32
+followed by the JSON meta and the raw payload bytes. Connections are persistent; a
+client sends a request frame and reads one response frame.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from PIL import Image
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'STIF'
+VERSION = 1
+HEADER = struct.Struct('!4sBBII')
+MAX_PAYLOAD = 256 * 1024 * 1024
+
+OP_PING = 1
+OP_TRANSCRIBE = 2
+OP_REMOVE_BACKGROUND = 3
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+STATUS_BUSY = 2
+
+
+class InferenceError(Exception):
+    """The sidecar could not be reached or failed to run the request"""
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("Connection closed mid-frame")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_frame(sock, code, meta=None, payload=b''):
+    meta_bytes = json.dumps(meta or {}).encode()
+    sock.sendall(HEADER.pack(MAGIC, VERSION, code, len(meta_bytes), len(payload)) + meta_bytes)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_frame(sock):
+    """Returns (code, meta, payload), or None when the peer closed the connection cleanly"""
+    first = sock.recv(HEADER.size)
+    if not first:
+        return None
+    header = first + _recv_exact(sock, HEADER.size - len(first)) if len(first) < HEADER.size else first
+    magic, version, code, meta_len, payload_len = HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ConnectionError(f"Bad frame header {magic!r} v{version}")
+    if payload_len > MAX_PAYLOAD:
+        raise ConnectionError(f"Payload of {payload_len} bytes exceeds the limit")
+    meta = json.loads(_recv_exact(sock, meta_len)) if meta_len else {}
+    payload = _recv_exact(sock, payload_len) if payload_len else b''
+    return code, meta, payload
+
+
+# --- client (web workers) ---
+
+class InferenceClient:
+    """Thread-safe client; each thread keeps its own persistent connection"""
+
+    def __init__(self, socket_path, timeout=300):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            self._local.sock = sock
+        return sock
+
+    def _drop_connection(self):
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def call(self, op, meta=None, payload=b''):
+        # One retry covers a connection the sidecar closed while idle (e.g. it restarted); that
+        # shows up as a failed send. Once a request is sent it is never repeated: the sidecar may
+        # already be running it, and a second transcription would queue behind the first.
+        for attempt in range(2):
+            sent = False
+            try:
+                sock = self._connection()
+                send_frame(sock, op, meta, payload)
+                sent = True
+                response = recv_frame(sock)
+                if response is None:
+                    raise ConnectionError("Sidecar closed the connection")
+                break
+            except (OSError, ConnectionError) as e:
+                self._drop_connection()
+                if sent or attempt == 1 or isinstance(e, socket.timeout):
+                    raise InferenceError(f"Inference sidecar unavailable at {self.socket_path}: {e}")
+
+        status, meta, payload = response
+        if status != STATUS_OK:
+            raise InferenceError(meta.get('error', f"Sidecar returned status {status}"))
+        return meta, payload
+
+    def ping(self):
+        meta, _ = self.call(OP_PING)
+        return meta
+
+    def transcribe(self, audio_bytes, suffix='.wav'):
+        """Whisper transcription; returns a dict shaped like whisper's (text, language, segments)"""
+        meta, _ = self.call(OP_TRANSCRIBE, {'suffix': suffix}, audio_bytes)
+        return meta
+
+    def remove_background(self, image):
+        """rembg cut-out of a PIL image; raw RGBA pixels travel both ways, no PNG round trip"""
+        image = image.convert('RGBA')
+        meta, payload = self.call(
+            OP_REMOVE_BACKGROUND, {'size': list(image.size)}, image.tobytes()
+        )
+        return Image.frombytes('RGBA', tuple(meta['size']), payload)
+
+
+class SidecarWhisperModel:
+    """Stands in for a loaded whisper model: ``transcribe(path)`` runs in the sidecar"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def transcribe(self, audio_path):
+        with open(audio_path, 'rb') as f:
+            return self.client.transcribe(f.read(), os.path.splitext(audio_path)[1] or '.wav')
+
+
+_client = {'instance': None}
+_client_lock = threading.Lock()
+
+
+def get_inference_client():
+    """The configured sidecar client, or None when models should be loaded in-process"""
+    socket_path = getattr(settings, 'INFERENCE_SIDECAR', {}).get('SOCKET')
+    if not socket_path:
+        return None
+    with _client_lock:
+        if _client['instance'] is None or _client['instance'].socket_path != socket_path:
+            _client['instance'] = InferenceClient(socket_path, settings.INFERENCE_SIDECAR.get('TIMEOUT', 300))
+        return _client['instance']
+
+
+# --- server (the sidecar process) ---
+
+class InferenceSidecar:
+    """
+    Owns the models. Whisper and rembg each get their own bounded worker pool, so a burst
+    of one kind of work doesn't starve the other and the CPU split is set in one place.
+    whisper.transcribe and rembg.remove take one input per call, so requests are queued per
+    model rather than batched.
+    """
+
+    def __init__(self, whisper_model='base', threads=None, rembg_workers=2, queue_size=16):
+        import torch
+        import whisper
+        from .compositor import get_rembg_session
+
+        threads = threads or os.cpu_count()
+        torch.set_num_threads(threads)
+        self.whisper_model = whisper.load_model(whisper_model) if whisper_model else None
+        # ONNX threads are split between the rembg workers
+        try:
+            self.rembg_session = get_rembg_session(max(1, threads // rembg_workers))
+        except Exception as e:
+            logger.error(f"Could not load the rembg model; background removal requests will fail: {e}")
+            self.rembg_session = None
+
+        # The whisper model keeps per-call state, so transcriptions run one at a time
+        self.executors = {
+            OP_TRANSCRIBE: ThreadPoolExecutor(1, thread_name_prefix='whisper'),
+            OP_REMOVE_BACKGROUND: ThreadPoolExecutor(rembg_workers, thread_name_prefix='rembg'),
+        }
+        self.slots = {op: threading.BoundedSemaphore(queue_size) for op in self.executors}
+        self.info = {'whisper_model': whisper_model, 'threads': threads, 'rembg_workers': rembg_workers,
+                     'queue_size': queue_size, 'pid': os.getpid()}
+
+    def handle(self, op, meta, payload):
+        if op == OP_PING:
+            return STATUS_OK, self.info, b''
+        if op not in self.executors:
+            return STATUS_ERROR, {'error': f"Unknown op {op}"}, b''
+        if not self.slots[op].acquire(blocking=False):
+            return STATUS_BUSY, {'error': 'Inference sidecar queue is full'}, b''
+        try:
+            func = self._transcribe if op == OP_TRANSCRIBE else self._remove_background
+            result_meta, result_payload = self.executors[op].submit(func, meta, payload).result()
+            return STATUS_OK, result_meta, result_payload
+        except Exception as e:
+            logger.error(f"Inference op {op} failed: {e}")
+            return STATUS_ERROR, {'error': str(e)}, b''
+        finally:
+            self.slots[op].release()
+
+    def _transcribe(self, meta, payload):
+        if self.whisper_model is None:
+            raise InferenceError("This sidecar was started without a Whisper model")
+        with tempfile.NamedTemporaryFile(suffix=meta.get('suffix', '.wav'), delete=False) as f:
+            f.write(payload)
+            path = f.name
+        try:
+            result = self.whisper_model.transcribe(path)
+        finally:
+            os.unlink(path)
+        segments = [{'start': s['start'], 'end': s['end'], 'text': s['text']} for s in result.get('segments', [])]
+        return {'text': result['text'], 'language': result.get('language'), 'segments': segments}, b''
+
+    def _remove_background(self, meta, payload):
+        from rembg import remove
+
+        if self.rembg_session is None:
+            raise InferenceError("The rembg model is not loaded in this sidecar")
+        image = Image.frombytes('RGBA', tuple(meta['size']), payload)
+        cutout = remove(image, session=self.rembg_session).convert('RGBA')
+        return {'size': list(cutout.size)}, cutout.tobytes()
+
+
+class _SidecarRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sidecar = self.server.sidecar
+        while True:
+            try:
+                frame = recv_frame(self.request)
+            except (OSError, ConnectionError, ValueError) as e:
+                logger.warning(f"Dropping sidecar connection: {e}")
+                return
+            if frame is None:
+                return
+            status, meta, payload = sidecar.handle(*frame)
+            try:
+                send_frame(self.request, status, meta, payload)
+            except OSError:
+                return
+
+
+class SidecarServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, sidecar):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, _SidecarRequestHandler)
+        # Web workers usually run as the same user; keep other users out
+        os.chmod(socket_path, 0o660)
+        self.sidecar = sidecar
@@ -0,0 +1,85 @@
+"""
+Ollama client configuration (STORY_OLLAMA).
+
+Every OllamaLLM the pipeline uses is built here from settings. keep_alive keeps the model
+loaded between requests, so a quiet spell doesn't mean a cold load. num_ctx is sized to
+fit the story template plus the longest output. num_predict caps each call: per story
+length for the story call, and a small cap for the image-prompt calls, which only need
+a line of about 150 characters. The web entry points send one warm-up request at startup.
+"""
+from django.conf import settings
+from langchain_ollama import OllamaLLM
+import logging
+import ollama
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OLLAMA_SETTINGS = {
+    'MODEL': 'gemma:2b',
+    # How long Ollama keeps the model loaded after a request (duration string or seconds; -1 = forever)
+    'KEEP_ALIVE': '30m',
+    # The story template is ~700 tokens and a long story package up to ~2000 more; Ollama's
+    # default context would cut long stories off
+    'NUM_CTX': 4096,
+    # CPU threads for generation; None lets Ollama decide
+    'NUM_THREAD': None,
+    # Tokens per story call by length (~1.35 tokens per word, with headroom over the word targets)
+    'STORY_NUM_PREDICT': {'short': 1280, 'medium': 1600, 'long': 2048},
+    # Added to the story cap when the call also writes the image prompts (IMAGE_PROMPT_MODE='folded')
+    'FOLDED_NUM_PREDICT': 128,
+    'IMAGE_PROMPT_NUM_PREDICT': 80,
+    'WARM_UP': True,
+    # Other models for benchmark_models to compare against MODEL
+    'CANDIDATE_MODELS': [],
+}
+
+
+def ollama_settings():
+    config = dict(DEFAULT_OLLAMA_SETTINGS)
+    config.update(getattr(settings, 'STORY_OLLAMA', {}))
+    return config
+
+
+def generation_options(num_predict=None):
+    """Ollama request options shared by every call; unset ones are left to the server"""
+    config = ollama_settings()
+    options = {'num_ctx': config['NUM_CTX'], 'num_thread': config['NUM_THREAD'], 'num_predict': num_predict}
+    return {key: value for key, value in options.items() if value is not None}
+
+
+def build_llm(num_predict=None, timeout=None, model=None):
+    """An OllamaLLM with the configured model and options; ``timeout`` bounds the HTTP client"""
+    config = ollama_settings()
+    return OllamaLLM(
+        model=model or config['MODEL'],
+        base_url=settings.OLLAMA_BASE_URL,
+        keep_alive=config['KEEP_ALIVE'],
+        client_kwargs={'timeout': timeout} if timeout is not None else {},
+        **generation_options(num_predict),
+    )
+
+
+def story_num_predict(length, folded=False):
+    config = ollama_settings()
+    caps = config['STORY_NUM_PREDICT']
+    cap = caps.get(length, caps['medium'])
+    return cap + config['FOLDED_NUM_PREDICT'] if folded else cap
+
+
+def warm_up():
+    """Load the model in Ollama with an empty prompt (no generation) and keep it resident"""
+    config = ollama_settings()
+    try:
+        client = ollama.Client(host=settings.OLLAMA_BASE_URL, timeout=120)
+        client.generate(model=config['MODEL'], prompt='', keep_alive=config['KEEP_ALIVE'])
+        logger.info(f"Ollama model {config['MODEL']} loaded (keep_alive {config['KEEP_ALIVE']})")
+    except Exception as e:
+        logger.warning(f"Ollama warm-up failed: {e}")
+
+
+def warm_up_in_background():
+    """Start warm_up on a daemon thread so the server doesn't wait for the model to load"""
+    if not ollama_settings()['WARM_UP']:
+        return
+    threading.Thread(target=warm_up, name='ollama-warm-up', daemon=True).start()
@@ -0,0 +1,89 @@
+"""Synthetic story rows for the benchmark commands (not a command itself)."""
+import random
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from story_app.models import StoryGeneration
+
+VOCABULARY = (
+    "dragon castle forest library portal storm lantern river mountain village "
+    "knight wizard detective robot starship nebula shadow whisper mirror garden "
+    "ancient hidden broken golden silent frozen burning endless crimson hollow "
+    "journey secret promise betrayal discovery escape memory prophecy treasure "
+    "city desert ocean tower bridge temple market harbor cavern island"
+).split()
+
+FILLER = (
+    "the a of and to in she he they it was with that for on as at by from "
+    "her his their into over under through when while then"
+).split()
+
+
+def _vocabulary(rng, size=4000):
+    """Themed words mixed into pseudo-words, with Zipf-like weights so some terms are rare"""
+    syllables = ['ka', 'lo', 'mi', 'ren', 'tha', 'vor', 'el', 'dun', 'sa', 'quo', 'bri', 'ne']
+    words = list(VOCABULARY)
+    while len(words) < size:
+        words.append(''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))))
+    rng.shuffle(words)
+    weights = [1.0 / (rank + 1) for rank in range(len(words))]
+    return words, weights
+
+
+def _paragraph_pool(rng, size, words, vocabulary):
+    """Pre-build paragraphs so seeding many rows does not pay for per-row text generation"""
+    vocab_words, weights = vocabulary
+    pool = []
+    for _ in range(size):
+        content = rng.choices(vocab_words, weights=weights, k=words)
+        pool.append(' '.join(
+            content[i] if rng.random() < 0.4 else rng.choice(FILLER)
+            for i in range(words)
+        ))
+    return pool
+
+
+def seed_stories(rows, batch_size=2000, story_words=450, seed=42):
+    """
+    Insert ``rows`` synthetic stories with realistic text sizes and spread-out created_at
+    values. Uses executemany because bulk_create would stamp every row with now().
+    """
+    rng = random.Random(seed)
+    genres = [g for g, _ in StoryGeneration.GENRE_CHOICES]
+    lengths = [l for l, _ in StoryGeneration.LENGTH_CHOICES]
+    input_types = [t for t, _ in StoryGeneration.INPUT_TYPE_CHOICES]
+    vocabulary = _vocabulary(rng)
+    prompts = _paragraph_pool(rng, 2000, 15, vocabulary)
+    stories = _paragraph_pool(rng, 1000, story_words, vocabulary)
+    descriptions = _paragraph_pool(rng, 1000, 170, vocabulary)
+
+    names = ['prompt', 'audio_transcription', 'generated_story', 'character_description',
+             'background_description', 'input_type', 'genre', 'story_length', 'created_at']
+    fields = [StoryGeneration._meta.get_field(name) for name in names]
+    table = connection.ops.quote_name(StoryGeneration._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(f.column) for f in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    sql = f"INSERT INTO {table} ({columns}) VALUES ({placeholders})"
+
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        for batch_start in range(0, rows, batch_size):
+            params = []
+            for i in range(batch_start, min(rows, batch_start + batch_size)):
+                input_type = rng.choice(input_types)
+                values = [
+                    rng.choice(prompts),
+                    rng.choice(prompts) if input_type != 'text' else None,
+                    rng.choice(stories),
+                    rng.choice(descriptions),
+                    rng.choice(descriptions),
+                    input_type,
+                    rng.choice(genres),
+                    rng.choice(lengths),
+                    # Some stories share a timestamp so the id tie-breaker is exercised
+                    now - timedelta(seconds=(rows - i) // 2),
+                ]
+                params.append([f.get_db_prep_save(v, connection) for f, v in zip(fields, values)])
+            cursor.executemany(sql, params)
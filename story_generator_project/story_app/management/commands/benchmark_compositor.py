@@ -0,0 +1,183 @@
+import base64
+import json
+import logging
+import os
+import platform
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from story_app.models import StoryGeneration
+from story_app.compositor import SceneCompositor, get_rembg_session
+from story_app.standins import synthetic_png
+
+# (character size, background size) as the providers return them
+SIZE_CASES = {
+    'hf': ((512, 768), (768, 512)),
+    'stability': ((1024, 1024), (1024, 1024)),
+    'mixed': ((1024, 1024), (768, 512)),
+}
+STAGES = [
+    'decode', 'match_styles', 'prepare_character', 'prepare_background',
+    'composite', 'composite_rembg', 'post_process', 'encode',
+]
+CHARACTER_DESC = "A tall traveller in a green coat standing at the centre of the road"
+BACKGROUND_DESC = "A vast mountain valley with a towering observatory under a stormy sky"
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmarks', 'compositor_baseline.json')
+
+
+class _ErrorCounter(logging.Handler):
+    """Counts errors the compositor swallows, so timings of fallback paths are flagged"""
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+        self.count = 0
+
+    def emit(self, record):
+        self.count += 1
+
+
+class Command(BaseCommand):
+    requires_system_checks = []
+    help = (
+        "Time each compositor stage on synthetic images at provider sizes for every genre, "
+        "and compare against a stored baseline (exits non-zero on regressions)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per stage (median is reported)')
+        parser.add_argument('--case', choices=sorted(SIZE_CASES), action='append', dest='cases')
+        parser.add_argument('--genre', action='append', dest='genres')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='Baseline JSON file')
+        parser.add_argument('--save-baseline', action='store_true', help='Write these results as the new baseline')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed slowdown over the baseline as a fraction (0.25 = 25%%)')
+        parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                            help='Ignore slowdowns smaller than this, to keep sub-millisecond noise out')
+        parser.add_argument('--no-rembg', action='store_true', help='Skip the rembg composite stage')
+
+    def handle(self, *args, **options):
+        baseline = self._load_baseline(options['baseline'])
+        if baseline is None and not options['save_baseline']:
+            # Fail before the runs: a check with nothing to compare against must not pass
+            raise CommandError(f"No baseline at {options['baseline']}; run with --save-baseline to create one.")
+
+        compositor = SceneCompositor()
+        cases = options['cases'] or list(SIZE_CASES)
+        genres = options['genres'] or [genre for genre, _ in StoryGeneration.GENRE_CHOICES]
+        stages = [s for s in STAGES if not (s == 'composite_rembg' and (options['no_rembg'] or not self._rembg_ready()))]
+
+        errors = _ErrorCounter()
+        logging.getLogger('story_app.compositor').addHandler(errors)
+        results = {}
+        flagged = set()
+        try:
+            for case in cases:
+                for genre in genres:
+                    for stage, ms, had_errors in self._run_case(compositor, case, genre, stages, options['repeat'], errors):
+                        key = f"{case}/{genre}/{stage}"
+                        results[key] = ms
+                        if had_errors:
+                            flagged.add(key)
+        finally:
+            logging.getLogger('story_app.compositor').removeHandler(errors)
+
+        self._print_table(results, flagged, baseline)
+
+        if options['save_baseline']:
+            self._save_baseline(options['baseline'], results, options['repeat'])
+            self.stdout.write(self.style.SUCCESS(f"\nBaseline written to {options['baseline']}"))
+            return
+
+        regressions = [
+            (key, baseline[key], ms) for key, ms in results.items()
+            if key in baseline
+            and ms > baseline[key] * (1 + options['tolerance'])
+            and ms - baseline[key] > options['min_delta_ms']
+        ]
+        if regressions:
+            lines = '\n'.join(f"  {key}: {old:.1f}ms -> {new:.1f}ms (+{(new / old - 1):.0%})"
+                              for key, old, new in regressions)
+            raise CommandError(f"{len(regressions)} compositor stage(s) regressed beyond "
+                               f"{options['tolerance']:.0%}:\n{lines}")
+        self.stdout.write(self.style.SUCCESS(f"\nNo regressions against the baseline (tolerance {options['tolerance']:.0%})."))
+
+    def _run_case(self, compositor, case, genre, stages, repeat, errors):
+        """Yield (stage, median ms, whether the stage hit an error fallback)"""
+        char_size, bg_size = SIZE_CASES[case]
+        character_b64 = base64.b64encode(synthetic_png(*char_size, variant=1)).decode()
+        background_b64 = base64.b64encode(synthetic_png(*bg_size, variant=2)).decode()
+
+        # Inputs for each stage are the outputs of the previous one, computed once up front
+        char_img = compositor._decode_base64_image(character_b64)
+        bg_img = compositor._decode_base64_image(background_b64)
+        matched_char, matched_bg = compositor._match_image_styles(char_img, bg_img, genre)
+        position_info = compositor._analyze_positioning(CHARACTER_DESC, BACKGROUND_DESC)
+        prepared_char = compositor._prepare_character_for_composition(matched_char, position_info)
+        prepared_bg = compositor._prepare_background_for_composition(matched_bg, position_info)
+        composite = compositor._composite_final_scene(prepared_char, prepared_bg, position_info, remove_background=False)
+        final = compositor._apply_scene_post_processing(composite, genre)
+
+        calls = {
+            'decode': lambda: (compositor._decode_base64_image(character_b64), compositor._decode_base64_image(background_b64)),
+            'match_styles': lambda: compositor._match_image_styles(char_img.copy(), bg_img.copy(), genre),
+            'prepare_character': lambda: compositor._prepare_character_for_composition(matched_char.copy(), position_info),
+            'prepare_background': lambda: compositor._prepare_background_for_composition(matched_bg.copy(), position_info),
+            'composite': lambda: compositor._composite_final_scene(prepared_char, prepared_bg, position_info, remove_background=False),
+            'composite_rembg': lambda: compositor._composite_final_scene(prepared_char, prepared_bg, position_info),
+            'post_process': lambda: compositor._apply_scene_post_processing(composite.copy(), genre),
+            'encode': lambda: compositor._encode_image_to_base64(final),
+        }
+        for stage in stages:
+            func = calls[stage]
+            func()  # warm-up
+            errors_before = errors.count
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                func()
+                timings.append((time.perf_counter() - started) * 1000)
+            yield stage, statistics.median(timings), errors.count > errors_before
+
+    def _rembg_ready(self):
+        """rembg downloads its model on first use; skip its stage when that isn't possible"""
+        try:
+            get_rembg_session()
+            return True
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f"Skipping composite_rembg: rembg unavailable ({e.__class__.__name__})"))
+            return False
+
+    def _print_table(self, results, flagged, baseline):
+        header = f"{'case/genre/stage':<42} {'ms':>9} {'baseline':>9} {'change':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for key, ms in results.items():
+            old = (baseline or {}).get(key)
+            change = f"{ms / old - 1:+.0%}" if old else ''
+            note = '  (error fallback)' if key in flagged else ''
+            old_text = f"{old:.2f}" if old else '-'
+            self.stdout.write(f"{key:<42} {ms:>9.2f} {old_text:>9} {change:>8}{note}")
+
+    def _load_baseline(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)['results']
+
+    def _save_baseline(self, path, results, repeat):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump({
+                'meta': {
+                    'python': platform.python_version(),
+                    'machine': platform.machine(),
+                    'processor': platform.processor(),
+                    'cpu_count': os.cpu_count(),
+                    'repeat': repeat,
+                    'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                },
+                'results': results,
+            }, f, indent=2, sort_keys=True)
@@ -0,0 +1,94 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from story_app.management.commands.loadtest_generate import PROMPTS
+from story_app.metrics import STORY_PARSE, percentile, start_stage_log
+from story_app.services import IMAGE_PROMPT_MODES, StoryGeneratorService
+
+
+class Command(BaseCommand):
+    requires_system_checks = []
+    help = (
+        "Compare the image-prompt modes (sequential, concurrent, folded) against the configured "
+        "Ollama: LLM time per story up to both image prompts being ready, calls made, and how "
+        "often the story (and, folded, the image prompt) sections parse."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', choices=IMAGE_PROMPT_MODES, action='append', dest='modes')
+        parser.add_argument('--runs', type=int, default=10, help='Stories per mode')
+        parser.add_argument('--warmup', type=int, default=1, help='Untimed stories first (Ollama loads the model)')
+        parser.add_argument('--genre', default='fantasy')
+        parser.add_argument('--length', default='short', choices=['short', 'medium', 'long'])
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError("--runs must be at least 1")
+        service = StoryGeneratorService()
+        if service.llm is None:
+            raise CommandError("Ollama client could not be created; check OLLAMA_BASE_URL")
+        visual_style = service._get_visual_style_for_genre(options['genre'])
+
+        self.stdout.write(f"Benchmarking image prompts against {settings.OLLAMA_BASE_URL} "
+                          f"({options['runs']} {options['length']} {options['genre']} stories per mode)\n")
+        header = (f"{'mode':<12} {'wall p50':>9} {'wall p90':>9} {'llm sum p50':>12} {'calls':>6} "
+                  f"{'sections':>9} {'prompts':>8}")
+        rows = []
+        for mode in options['modes'] or IMAGE_PROMPT_MODES:
+            service.image_prompt_mode = mode
+            for i in range(options['warmup']):
+                self._run(service, PROMPTS[i % len(PROMPTS)], options, visual_style)
+
+            parse_before = self._parse_counts()
+            walls, llm_sums, calls = [], [], []
+            for i in range(options['runs']):
+                wall, llm_ms, llm_calls = self._run(service, PROMPTS[i % len(PROMPTS)], options, visual_style)
+                walls.append(wall)
+                llm_sums.append(llm_ms / 1000)
+                calls.append(llm_calls)
+            parsed = {key: count - parse_before[key] for key, count in self._parse_counts().items()}
+            rows.append((mode, walls, llm_sums, calls, parsed))
+
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for mode, walls, llm_sums, calls, parsed in rows:
+            sections = self._rate(parsed['sections', 'parsed'], parsed['sections', 'fallback'])
+            prompts = (self._rate(parsed['image_prompts', 'parsed'], parsed['image_prompts', 'missing'])
+                       if mode == 'folded' else '-')
+            self.stdout.write(
+                f"{mode:<12} {percentile(walls, 50):>8.2f}s {percentile(walls, 90):>8.2f}s "
+                f"{statistics.median(llm_sums):>11.2f}s {statistics.mean(calls):>6.1f} {sections:>9} {prompts:>8}"
+            )
+        self.stdout.write(
+            "\nwall: story call until both image prompts are ready. llm sum: time inside LLM calls, "
+            "which exceeds wall when calls overlap\n(concurrent only overlaps with OLLAMA_NUM_PARALLEL > 1). "
+            "sections/prompts: share of story responses whose sections parsed."
+        )
+
+    def _run(self, service, prompt, options, visual_style):
+        """One story through the prompt stage; returns (wall seconds, ms inside LLM calls, LLM calls)"""
+        log = start_stage_log()
+        started = time.perf_counter()
+        story_package = service.generate_complete_story(prompt, options['length'], options['genre'])
+        character_prompt, background_prompt = service.prepare_image_prompts(story_package, visual_style, options['genre'])
+        # What generate_*_image would do next for prompts the mode didn't provide
+        if character_prompt is None:
+            service.generate_character_image_prompt(story_package['character_description'], visual_style, options['genre'])
+        if background_prompt is None:
+            service.generate_background_image_prompt(story_package['background_description'], visual_style, options['genre'])
+        wall = time.perf_counter() - started
+        llm_entries = [entry for entry in log if entry['stage'].startswith('llm.')]
+        return wall, sum(entry['ms'] for entry in llm_entries), len(llm_entries)
+
+    def _parse_counts(self):
+        return {
+            (part, outcome): STORY_PARSE.value(part=part, outcome=outcome)
+            for part, outcome in (('sections', 'parsed'), ('sections', 'fallback'),
+                                  ('image_prompts', 'parsed'), ('image_prompts', 'missing'))
+        }
+
+    def _rate(self, ok, failed):
+        return f"{ok / (ok + failed):.0%}" if ok + failed else '-'
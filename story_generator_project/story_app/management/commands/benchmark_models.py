@@ -0,0 +1,171 @@
+import json
+import re
+import statistics
+import time
+
+import ollama
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from story_app.llm import generation_options, ollama_settings, story_num_predict
+from story_app.management.commands.loadtest_generate import PROMPTS
+from story_app.metrics import STORY_PARSE, percentile
+from story_app.services import LENGTH_INSTRUCTIONS, STORY_TEMPLATE, StoryGeneratorService
+
+SECTIONS = ('story', 'character_description', 'background_description')
+
+
+def word_targets():
+    """(low, high) words per section and length, read from the prompts the model is given"""
+    character = re.search(r'\*\*\[CHARACTER\]\*\*.*?\((\d+)-(\d+) words\)', STORY_TEMPLATE.template, re.DOTALL)
+    background = re.search(r'\*\*\[BACKGROUND\]\*\*.*?\((\d+)-(\d+) words\)', STORY_TEMPLATE.template, re.DOTALL)
+    targets = {}
+    for length, instruction in LENGTH_INSTRUCTIONS.items():
+        story = re.search(r'(\d+)-(\d+) words', instruction)
+        targets[length] = {
+            'story': tuple(map(int, story.groups())),
+            'character_description': tuple(map(int, character.groups())),
+            'background_description': tuple(map(int, background.groups())),
+        }
+    return targets
+
+
+class Command(BaseCommand):
+    requires_system_checks = []
+    help = (
+        "Run a fixed set of prompts through the story template and parser for each Ollama model "
+        "and compare time to first token, tokens/s, latency, parse success and section lengths. "
+        "Point OLLAMA_BASE_URL at run_standins to exercise it in CI."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', dest='models',
+                            help='Model to compare (repeatable; default: OLLAMA_MODEL plus OLLAMA_CANDIDATE_MODELS)')
+        parser.add_argument('--length', action='append', dest='lengths', choices=list(LENGTH_INSTRUCTIONS))
+        parser.add_argument('--prompts', type=int, default=len(PROMPTS), help='How many of the fixed prompts to use')
+        parser.add_argument('--genre', default='fantasy')
+        parser.add_argument('--min-parse-rate', type=float, default=0.9,
+                            help='Parse success a model needs to meet the format contract')
+        parser.add_argument('--json', dest='json_path', help='Also write the raw results to this file')
+
+    def handle(self, *args, **options):
+        config = ollama_settings()
+        models = options['models'] or list(dict.fromkeys([config['MODEL'], *config['CANDIDATE_MODELS']]))
+        lengths = options['lengths'] or list(LENGTH_INSTRUCTIONS)
+        prompts = PROMPTS[:max(1, options['prompts'])]
+        client = ollama.Client(host=settings.OLLAMA_BASE_URL)
+        # Only its parser is used, with the plain three-section template
+        service = StoryGeneratorService()
+        service.image_prompt_mode = 'sequential'
+        targets = word_targets()
+
+        self.stdout.write(f"Benchmarking {', '.join(models)} on {settings.OLLAMA_BASE_URL}: "
+                          f"{len(prompts)} prompts x {', '.join(lengths)}\n")
+        results = {}
+        for model in models:
+            try:
+                # Load the model first so the first timed run doesn't include it
+                client.generate(model=model, prompt='', keep_alive=config['KEEP_ALIVE'])
+            except Exception as e:
+                raise CommandError(f"Could not load {model}: {e}")
+            runs = []
+            for length in lengths:
+                for prompt in prompts:
+                    runs.append(self._run(client, service, model, prompt, length, options['genre'], targets[length]))
+                    self.stdout.write('.', ending='')
+                    self.stdout.flush()
+            results[model] = runs
+        self.stdout.write('\n')
+
+        summaries = {model: self._summarize(runs) for model, runs in results.items()}
+        self._print_table(summaries, lengths, options['min_parse_rate'])
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump({'results': results, 'summaries': summaries}, f, indent=2)
+            self.stdout.write(f"\nRaw results written to {options['json_path']}")
+
+    def _run(self, client, service, model, prompt, length, genre, targets):
+        """One streamed story call with the pipeline's template and options, parsed like the pipeline does"""
+        text = STORY_TEMPLATE.format(prompt=prompt, genre=genre, length_instruction=LENGTH_INSTRUCTIONS[length])
+        started = time.perf_counter()
+        first_token = None
+        chunks = []
+        final = None
+        for chunk in client.generate(model=model, prompt=text, stream=True, keep_alive=ollama_settings()['KEEP_ALIVE'],
+                                     options=generation_options(story_num_predict(length))):
+            if chunk.response and first_token is None:
+                first_token = time.perf_counter() - started
+            chunks.append(chunk.response)
+            if chunk.done:
+                final = chunk
+        latency = time.perf_counter() - started
+
+        parsed_before = STORY_PARSE.value(part='sections', outcome='parsed')
+        package = service._parse_response(''.join(chunks))
+        parsed = STORY_PARSE.value(part='sections', outcome='parsed') > parsed_before
+
+        tokens = final.eval_count or 0
+        generating = (final.eval_duration or 0) / 1e9 or max(latency - (first_token or 0), 1e-6)
+        words = {section: len(package[section].split()) for section in SECTIONS}
+        return {
+            'length': length,
+            'ttft': first_token or latency,
+            'latency': latency,
+            'tokens': tokens,
+            'tokens_per_s': tokens / generating,
+            'truncated': final.done_reason == 'length',
+            'parsed': parsed,
+            'words': words,
+            # Within the template's range, allowing 20% either way (models count words loosely)
+            'in_range': {section: parsed and 0.8 * low <= words[section] <= 1.2 * high
+                         for section, (low, high) in targets.items()},
+        }
+
+    def _summarize(self, runs):
+        latencies = [run['latency'] for run in runs]
+        return {
+            'ttft_p50': percentile([run['ttft'] for run in runs], 50),
+            'latency_p50': percentile(latencies, 50),
+            'latency_p90': percentile(latencies, 90),
+            'tokens_per_s': statistics.median(run['tokens_per_s'] for run in runs),
+            'parse_rate': sum(run['parsed'] for run in runs) / len(runs),
+            'truncated_rate': sum(run['truncated'] for run in runs) / len(runs),
+            'in_range': {section: sum(run['in_range'][section] for run in runs) / len(runs) for section in SECTIONS},
+            'story_words': {
+                length: statistics.median(run['words']['story'] for run in runs if run['length'] == length)
+                for length in dict.fromkeys(run['length'] for run in runs)
+            },
+        }
+
+    def _print_table(self, summaries, lengths, min_parse_rate):
+        header = (f"{'model':<22} {'ttft':>6} {'p50':>7} {'p90':>7} {'tok/s':>7} {'parsed':>7} {'cut':>5} "
+                  f"{'story':>6} {'char':>6} {'bg':>6}")
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for model, s in summaries.items():
+            self.stdout.write(
+                f"{model:<22} {s['ttft_p50']:>5.2f}s {s['latency_p50']:>6.1f}s {s['latency_p90']:>6.1f}s "
+                f"{s['tokens_per_s']:>7.1f} {s['parse_rate']:>7.0%} {s['truncated_rate']:>5.0%} "
+                f"{s['in_range']['story']:>6.0%} {s['in_range']['character_description']:>6.0%} "
+                f"{s['in_range']['background_description']:>6.0%}"
+            )
+        self.stdout.write(
+            "\nparsed: responses with all three sections (no _fallback_parse). cut: stopped by the "
+            "token cap.\nstory/char/bg: share of runs whose section length is within the prompt's word range (+-20%)."
+        )
+
+        targets = word_targets()
+        self.stdout.write(f"\n{'median story words':<22} " + ' '.join(
+            f"{f'{length} ({low}-{high})':>18}" for length in lengths for low, high in [targets[length]['story']]
+        ))
+        for model, s in summaries.items():
+            self.stdout.write(f"{model:<22} " + ' '.join(f"{s['story_words'][length]:>18.0f}" for length in lengths))
+
+        passing = [model for model, s in summaries.items() if s['parse_rate'] >= min_parse_rate]
+        if passing:
+            best = min(passing, key=lambda model: summaries[model]['latency_p50'])
+            self.stdout.write(self.style.SUCCESS(
+                f"\nFastest model meeting the format contract (parse rate >= {min_parse_rate:.0%}): {best}"
+            ))
+        else:
+            self.stdout.write(self.style.WARNING(f"\nNo model reached a {min_parse_rate:.0%} parse rate."))
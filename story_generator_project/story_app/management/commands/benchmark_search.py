@@ -0,0 +1,78 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from story_app.models import StoryGeneration
+from story_app.search import fts5_available, like_search_filter, search_story_ids
+
+from ._synthetic import seed_stories
+
+DEFAULT_QUERIES = [
+    'dragon',
+    'golden prophecy',
+    'frozen harbor betrayal',
+    'whisp',
+    'nonexistentword',
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark FTS5 story search against the LIKE (icontains) path on a throwaway "
+        "test database seeded with synthetic stories. Your real database is not touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20000, help='Number of synthetic stories to insert')
+        parser.add_argument('--limit', type=int, default=20, help='Results per query, as on the search page')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per measurement (median is reported)')
+        parser.add_argument('--query', action='append', dest='queries', help='Query to run (repeatable)')
+
+    def handle(self, *args, **options):
+        if not fts5_available():
+            raise CommandError("The configured database does not support SQLite FTS5.")
+
+        rows = options['rows']
+        limit = options['limit']
+        repeat = options['repeat']
+        queries = options['queries'] or DEFAULT_QUERIES
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write(f"Seeding {rows} stories (index kept in sync by triggers)...")
+            started = time.perf_counter()
+            seed_stories(rows)
+            self.stdout.write(f"Seeded in {time.perf_counter() - started:.1f}s\n")
+
+            header = f"{'query':<26} {'fts ms':>9} {'like ms':>9} {'speedup':>8} {'fts hits':>9} {'like hits':>10}"
+            self.stdout.write(header)
+            self.stdout.write('-' * len(header))
+
+            for query in queries:
+                like_queryset = StoryGeneration.objects.filter(like_search_filter(query)).values_list('id', flat=True)
+
+                fts_ms = self._time(lambda: search_story_ids(query, limit=limit), repeat)
+                like_ms = self._time(lambda: list(like_queryset[:limit]), repeat)
+                fts_hits = len(search_story_ids(query, limit=rows))
+                like_hits = like_queryset.count()
+                speedup = like_ms / fts_ms if fts_ms else 0
+
+                self.stdout.write(
+                    f"{query[:26]:<26} {fts_ms:>9.2f} {like_ms:>9.2f} {speedup:>7.1f}x {fts_hits:>9} {like_hits:>10}"
+                )
+
+            self.stdout.write(
+                "\nHit counts differ where FTS stems words (porter) and LIKE matches substrings."
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _time(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,89 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from story_app.models import StoryGeneration
+from story_app.pagination import decode_cursor, encode_cursor, keyset_page
+
+from ._synthetic import seed_stories
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark story_list pagination (keyset vs OFFSET) on a throwaway test database "
+        "seeded with synthetic stories. Your real database is not touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Number of synthetic stories to insert')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per measurement (median is reported)')
+        parser.add_argument('--explain', action='store_true', help='Print the query plan of a deep keyset page')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        page_size = options['page_size']
+        repeat = options['repeat']
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stdout.write(f"Seeding {rows} stories...")
+            started = time.perf_counter()
+            seed_stories(rows)
+            self.stdout.write(f"Seeded in {time.perf_counter() - started:.1f}s\n")
+
+            scenarios = [
+                ('all stories', {}),
+                ('genre=horror', {'genre': 'horror'}),
+                ('input_type=audio', {'input_type': 'audio'}),
+            ]
+
+            header = f"{'filter':<18} {'page':>8} {'keyset ms':>10} {'offset ms':>10}"
+            self.stdout.write(header)
+            self.stdout.write('-' * len(header))
+
+            for label, filters in scenarios:
+                queryset = StoryGeneration.objects.for_listing().filter_listing(**filters)
+                total = queryset.count()
+                last_page = max(1, (total + page_size - 1) // page_size)
+                depths = sorted({1, 10, 100, 1000, last_page} & set(range(1, last_page + 1)))
+
+                for page in depths:
+                    offset = (page - 1) * page_size
+                    cursor = self._cursor_before(queryset, offset)
+
+                    keyset_ms = self._time(lambda: keyset_page(queryset, cursor, page_size), repeat)
+                    offset_ms = self._time(
+                        lambda: list(queryset.order_by('-created_at', '-id')[offset:offset + page_size]),
+                        repeat
+                    )
+                    self.stdout.write(f"{label:<18} {page:>8} {keyset_ms:>10.2f} {offset_ms:>10.2f}")
+
+                if options['explain']:
+                    cursor = self._cursor_before(queryset, (last_page - 1) * page_size)
+                    position = queryset.order_by('-created_at', '-id')
+                    if cursor:
+                        position = position.after_cursor(*decode_cursor(cursor))
+                    self.stdout.write(position[:page_size + 1].explain())
+
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _cursor_before(self, queryset, offset):
+        """Cursor of the row just before ``offset`` (setup only, not timed)"""
+        if offset == 0:
+            return None
+        created_at, story_id = queryset.order_by('-created_at', '-id').values_list(
+            'created_at', 'id'
+        )[offset - 1]
+        return encode_cursor(created_at, story_id)
+
+    def _time(self, func, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
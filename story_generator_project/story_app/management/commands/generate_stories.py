@@ -0,0 +1,291 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+import json
+import os
+import threading
+import time
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from story_app.cache import bump_generation
+from story_app.characters import record_character_use
+from story_app.metrics import percentile
+from story_app.models import Character, StoryGeneration, StoryScene
+from story_app.quality import IMAGE_TIERS
+from story_app.refinement import needs_refinement, queue_refinement
+from story_app.services import LENGTH_INSTRUCTIONS, StoryGeneratorService
+
+GENRES = [genre for genre, _ in StoryGeneration.GENRE_CHOICES]
+IMAGE_KINDS = ('character_image', 'background_image', 'combined_scene')
+
+
+class Checkpoint:
+    """Input line numbers already handled, rewritten atomically after every flush"""
+
+    def __init__(self, path):
+        self.path = path
+        self.done, self.failed = set(), set()
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.done, self.failed = set(data['done']), set(data['failed'])
+
+    def save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump({'done': sorted(self.done), 'failed': sorted(self.failed)}, f)
+        os.replace(temp_path, self.path)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate stories in bulk from a JSONL file of {\"prompt\", \"genre\", \"length\", \"audio\", "
+        "\"character\"} objects (audio is an optional file path, character the name of a library "
+        "character to write about). Stories run through the StoryGeneratorService "
+        "pipeline with bounded concurrency; results go to a JSONL file and/or StoryGeneration rows "
+        "in batches. A checkpoint file records finished lines, so rerunning after a crash resumes "
+        "where it stopped. Saved stories with draft images are refined in the background, as in the "
+        "views, and the command waits for those refinements before it exits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='JSONL file, one story request per line')
+        parser.add_argument('--output', help='Append results to this JSONL file')
+        parser.add_argument('--save', action='store_true', help='Insert StoryGeneration rows')
+        parser.add_argument('--include-images', action='store_true',
+                            help='Put the base64 image data in the JSONL output too')
+        parser.add_argument('--concurrency', type=int, default=4, help='Stories generated at once')
+        parser.add_argument('--batch-size', type=int, default=20,
+                            help='Results buffered before they are written, inserted and checkpointed')
+        parser.add_argument('--checkpoint', help='Progress file (default: <input>.checkpoint)')
+        parser.add_argument('--retry-failed', action='store_true', help='Run lines that failed last time again')
+        parser.add_argument('--image-tier', choices=list(IMAGE_TIERS), help='Image quality tier for this batch')
+        parser.add_argument('--limit', type=int, default=None, help='Stop after this many stories')
+
+    def handle(self, *args, **options):
+        if not (options['output'] or options['save']):
+            raise CommandError("Nothing to write: pass --output and/or --save")
+        if options['concurrency'] < 1 or options['batch_size'] < 1:
+            raise CommandError("--concurrency and --batch-size must be at least 1")
+
+        checkpoint = Checkpoint(options['checkpoint'] or f"{options['input']}.checkpoint")
+        skip = checkpoint.done if options['retry_failed'] else checkpoint.done | checkpoint.failed
+        if skip:
+            self.stdout.write(f"Resuming: {len(checkpoint.done)} lines done, {len(checkpoint.failed)} failed")
+
+        self.options = options
+        self.local = threading.local()
+        self.output = open(options['output'], 'a') if options['output'] else None
+        self.latencies = []
+        self.characters = {}
+        self.refinements = []
+        self.counts = {'success': 0, 'failed': 0}
+        buffer = []
+        started = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=options['concurrency'], thread_name_prefix='generate') as executor:
+                pending = set()
+                for line_no, request in self._requests(options['input'], skip, options['limit']):
+                    # Keep a bounded window in flight so a large input isn't read into memory at once
+                    if len(pending) >= options['concurrency'] * 2:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        buffer.extend(future.result() for future in finished)
+                        buffer = self._maybe_flush(buffer, checkpoint, started)
+                    pending.add(executor.submit(self._generate, line_no, request, self._character(request)))
+                for future in as_completed(pending):
+                    buffer.append(future.result())
+                    buffer = self._maybe_flush(buffer, checkpoint, started)
+            self._flush(buffer, checkpoint, started)
+        finally:
+            if self.output:
+                self.output.close()
+        if self.refinements:
+            self.stdout.write(f"Waiting for {len(self.refinements)} image refinements")
+            wait(self.refinements)
+
+        elapsed = time.monotonic() - started
+        total = sum(self.counts.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"\n{total} stories in {elapsed:.1f}s ({total / elapsed * 60 if elapsed else 0:.1f} stories/min): "
+            f"{self.counts['success']} succeeded, {self.counts['failed']} failed. Per story p50 "
+            f"{percentile(self.latencies, 50):.1f}s, p90 {percentile(self.latencies, 90):.1f}s"
+        ))
+
+    def _requests(self, path, skip, limit):
+        """(line number, request) for the lines still to do; malformed lines become failed results"""
+        taken = 0
+        with open(path) as f:
+            for line_no, line in enumerate(f, start=1):
+                if line_no in skip or not line.strip():
+                    continue
+                if limit is not None and taken >= limit:
+                    return
+                taken += 1
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError as e:
+                    request = {'error': f"Invalid JSON: {e}"}
+                if not isinstance(request, dict):
+                    request = {'error': "Expected a JSON object"}
+                yield line_no, request
+
+    def _character(self, request):
+        """Library character named by the request, looked up once per name on the main thread"""
+        name = request.get('character')
+        if not name:
+            return None
+        if name not in self.characters:
+            self.characters[name] = Character.objects.lookup(name)
+        return self.characters[name]
+
+    def _service(self):
+        # One service per worker thread, as each request gets its own in the views
+        if not hasattr(self.local, 'service'):
+            self.local.service = StoryGeneratorService()
+            if self.options['image_tier']:
+                self.local.service.image_tier = self.options['image_tier']
+        return self.local.service
+
+    def _generate(self, line_no, request, character=None):
+        """Run one request through the pipeline; returns a result dict, never raises"""
+        started = time.monotonic()
+        result = {'line': line_no, 'request': request}
+        try:
+            if 'error' in request:
+                raise ValueError(request['error'])
+            prompt = (request.get('prompt') or '').strip()
+            genre = request.get('genre', 'fantasy')
+            length = request.get('length', 'medium')
+            audio_path = request.get('audio')
+            if genre not in GENRES:
+                raise ValueError(f"Unknown genre {genre!r}")
+            if length not in LENGTH_INSTRUCTIONS:
+                raise ValueError(f"Unknown length {length!r}")
+            if not (prompt or audio_path):
+                raise ValueError("Needs a prompt or an audio path")
+            if request.get('character') and character is None:
+                raise ValueError(f"No library character named {request['character']!r}")
+
+            service = self._service()
+            if audio_path:
+                with open(audio_path, 'rb') as f:
+                    audio_file = File(f, name=os.path.basename(audio_path))
+                    validation = service.validate_audio_file(audio_file)
+                    if not validation['valid']:
+                        raise ValueError(validation['error'])
+                    if prompt:
+                        story = service.generate_story_from_mixed_input(prompt, audio_file, length, genre, character)
+                    else:
+                        story = service.generate_story_from_audio(audio_file, length, genre, character)
+            else:
+                story = service.generate_complete_story_with_images(prompt, length, genre, character)
+                story['input_type'] = 'text'
+            if not story.get('success', True):
+                raise ValueError(story.get('error', 'Story generation failed'))
+            result.update({'story': story, 'prompt': prompt, 'genre': genre, 'length': length, 'audio': audio_path})
+        except Exception as e:
+            result['error'] = str(e)
+        result['seconds'] = time.monotonic() - started
+        return result
+
+    def _maybe_flush(self, buffer, checkpoint, started):
+        if len(buffer) < self.options['batch_size']:
+            return buffer
+        self._flush(buffer, checkpoint, started)
+        return []
+
+    def _flush(self, buffer, checkpoint, started):
+        """Insert, write and checkpoint a batch, in that order (a crash in between repeats the batch)"""
+        if not buffer:
+            return
+        succeeded = [result for result in buffer if 'error' not in result]
+        if self.options['save'] and succeeded:
+            rows = [self._story_row(result) for result in succeeded]
+            scenes = []
+            for result, row in zip(succeeded, StoryGeneration.objects.bulk_create(rows)):
+                result['story_id'] = row.id
+                if row.refinement_status == 'pending':
+                    self.refinements.append(queue_refinement(row.id))
+                scenes.extend(StoryScene.from_scene_result(row, scene) for scene in result['story'].get('scenes', []))
+            if scenes:
+                StoryScene.objects.bulk_create(scenes)
+            record_character_use(result['story'].get('character_id') for result in succeeded)
+            # bulk_create sends no post_save signals
+            bump_generation()
+        if self.output:
+            for result in buffer:
+                self.output.write(json.dumps(self._output_record(result)) + '\n')
+            self.output.flush()
+            os.fsync(self.output.fileno())
+
+        for result in buffer:
+            outcome = 'failed' if 'error' in result else 'success'
+            self.counts[outcome] += 1
+            self.latencies.append(result['seconds'])
+            if outcome == 'failed':
+                checkpoint.failed.add(result['line'])
+                self.stderr.write(f"line {result['line']}: {result['error']}")
+            else:
+                checkpoint.done.add(result['line'])
+                checkpoint.failed.discard(result['line'])
+        checkpoint.save()
+
+        total = sum(self.counts.values())
+        elapsed = time.monotonic() - started
+        self.stdout.write(f"{total} stories ({self.counts['failed']} failed), {total / elapsed * 60:.1f} stories/min")
+
+    def _story_row(self, result):
+        audio_saved = None
+        if result['audio']:
+            with open(result['audio'], 'rb') as f:
+                audio_saved = default_storage.save(f"audio_prompts/{os.path.basename(result['audio'])}", File(f))
+        row = StoryGeneration.from_story_package(
+            result['story'], result['prompt'], audio_saved, result['genre'], result['length']
+        )
+        # Marked on insert; the refinements are queued once the batch has ids
+        if needs_refinement(row):
+            row.refinement_status = 'pending'
+        return row
+
+    def _output_record(self, result):
+        record = {'line': result['line'], 'seconds': round(result['seconds'], 2)}
+        if 'error' in result:
+            return {**record, 'request': result['request'], 'error': result['error']}
+        story = result['story']
+        record.update({
+            'story_id': result.get('story_id'),
+            'prompt': result['prompt'],
+            'genre': result['genre'],
+            'length': result['length'],
+            'input_type': story.get('input_type', 'text'),
+            'character': story.get('character_name'),
+            'audio_transcription': story.get('audio_transcription'),
+            'story': story['story'],
+            'character_description': story['character_description'],
+            'background_description': story['background_description'],
+        })
+        for kind in IMAGE_KINDS:
+            image = story.get(kind) or {}
+            record[kind] = {
+                'success': image.get('success', False),
+                'model': image.get('model_used'),
+                'tier': image.get('tier'),
+                'prompt': image.get('prompt'),
+            }
+            if self.options['include_images']:
+                record[kind]['image_data'] = image.get('image_data')
+        if story.get('scenes'):
+            record['scenes'] = [
+                {
+                    'order': scene['order'],
+                    'text': scene['text'],
+                    'success': scene['success'],
+                    'background_model': scene['background_model'],
+                    'tier': scene['tier'],
+                    'prompt': scene['image_prompt'],
+                    **({'image_data': scene['image_data']} if self.options['include_images'] else {}),
+                }
+                for scene in story['scenes']
+            ]
+        return record
@@ -0,0 +1,135 @@
+import base64
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.test.utils import override_settings
+
+from story_app.models import StoryGeneration
+
+MODES = {
+    # What SQLite does out of the box: rollback journal, readers and the writer exclude each other
+    'rollback': {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 5000},
+    # Production settings from settings.SQLITE_PRAGMAS
+    'wal': {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'busy_timeout': 10000},
+}
+
+
+class Command(BaseCommand):
+    # Skip the URL checks: they import the ML stack, which does not mix well with fork()
+    requires_system_checks = []
+    help = (
+        "Concurrent read/write load test comparing SQLite rollback-journal mode with WAL. "
+        "Writers insert stories with multi-megabyte image columns while readers load list "
+        "and detail pages. Runs against a temporary database file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per mode')
+        parser.add_argument('--image-kb', type=int, default=1500, help='Size of each synthetic image column')
+        parser.add_argument('--mode', choices=sorted(MODES), action='append', dest='modes')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("loadtest_database compares SQLite journal modes; DB_ENGINE must be sqlite.")
+
+        image_data = base64.b64encode(os.urandom(options['image_kb'] * 1024 * 3 // 4)).decode()
+        results = []
+        for mode in options['modes'] or ['rollback', 'wal']:
+            self.stdout.write(f"Running {mode} for {options['duration']:.0f}s...")
+            results.append((mode, self._run_mode(mode, image_data, options)))
+
+        header = (f"{'mode':<10} {'writes/s':>9} {'reads/s':>9} {'read p50 ms':>12} "
+                  f"{'read p95 ms':>12} {'write p95 ms':>13} {'locked':>7}")
+        self.stdout.write('\n' + header)
+        self.stdout.write('-' * len(header))
+        for mode, r in results:
+            self.stdout.write(
+                f"{mode:<10} {r['writes_per_s']:>9.1f} {r['reads_per_s']:>9.1f} {r['read_p50']:>12.1f} "
+                f"{r['read_p95']:>12.1f} {r['write_p95']:>13.1f} {r['locked']:>7}"
+            )
+
+    def _run_mode(self, mode, image_data, options):
+        db_dir = tempfile.mkdtemp(prefix='story-loadtest-')
+        db_path = os.path.join(db_dir, 'loadtest.sqlite3')
+        connection.settings_dict.setdefault('TEST', {})['NAME'] = db_path
+
+        with override_settings(SQLITE_PRAGMAS=MODES[mode]):
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                StoryGeneration.objects.create(prompt='seed', generated_story='seed story', combined_scene_data=image_data)
+                connections.close_all()
+                return self._drive(image_data, options)
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def _drive(self, image_data, options):
+        """Run writers and readers as separate processes, like independent WSGI workers"""
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        stop_at = time.time() + options['duration']
+
+        workers = [context.Process(target=_worker, args=('write', stop_at, image_data, results))
+                   for _ in range(options['writers'])]
+        workers += [context.Process(target=_worker, args=('read', stop_at, image_data, results))
+                    for _ in range(options['readers'])]
+        started = time.monotonic()
+        for worker in workers:
+            worker.start()
+        stats = {'write_ms': [], 'read_ms': [], 'locked': 0}
+        for _ in workers:
+            kind, timings, locked = results.get()
+            stats[f'{kind}_ms'].extend(timings)
+            stats['locked'] += locked
+        for worker in workers:
+            worker.join()
+        elapsed = time.monotonic() - started
+
+        def percentile(values, pct):
+            if not values:
+                return 0.0
+            values = sorted(values)
+            return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+        return {
+            'writes_per_s': len(stats['write_ms']) / elapsed,
+            'reads_per_s': len(stats['read_ms']) / elapsed,
+            'read_p50': statistics.median(stats['read_ms']) if stats['read_ms'] else 0.0,
+            'read_p95': percentile(stats['read_ms'], 95),
+            'write_p95': percentile(stats['write_ms'], 95),
+            'locked': stats['locked'],
+        }
+
+
+def _worker(kind, stop_at, image_data, results):
+    """Body of one load-test process; reports (kind, latencies_ms, locked_errors)"""
+    # The parent closed its connections before forking, so each worker opens its own
+    timings = []
+    locked = 0
+    try:
+        while time.time() < stop_at:
+            started = time.perf_counter()
+            try:
+                if kind == 'write':
+                    StoryGeneration.objects.create(
+                        prompt='load test', generated_story='A story ' * 200,
+                        character_image_data=image_data, background_image_data=image_data,
+                        combined_scene_data=image_data,
+                    )
+                else:
+                    stories = list(StoryGeneration.objects.for_listing()[:20])
+                    if stories:
+                        StoryGeneration.objects.get(id=stories[0].id).combined_scene_data
+                timings.append((time.perf_counter() - started) * 1000)
+            except OperationalError:
+                locked += 1
+    finally:
+        connections.close_all()
+        results.put((kind, timings, locked))
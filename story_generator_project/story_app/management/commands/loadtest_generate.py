@@ -0,0 +1,129 @@
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import random
+import re
+import threading
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from story_app.metrics import percentile
+
+PROMPTS = [
+    'A lighthouse keeper finds a map drawn in their own handwriting',
+    'Two rival inventors are snowed in at the same mountain inn',
+    'A detective robot investigates a theft at the museum of lost sounds',
+    'The last dragon applies for a job at the village library',
+    'A starship crew wakes up one year earlier than planned',
+]
+CSRF_INPUT_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+
+class Command(BaseCommand):
+    requires_system_checks = []
+    help = (
+        "Drive story generation on a running server at a target request rate and report "
+        "throughput, latency percentiles and error rates. Pair with run_standins to test offline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help='Base URL of the running app')
+        parser.add_argument('--path', default='/generate/',
+                            help='Generation endpoint (/generate/async/ for the async view under ASGI)')
+        parser.add_argument('--rps', type=float, default=0.5, help='Target request rate (requests per second)')
+        parser.add_argument('--duration', type=float, default=60.0, help='Seconds to keep issuing requests')
+        parser.add_argument('--concurrency', type=int, default=32, help='Maximum requests in flight')
+        parser.add_argument('--timeout', type=float, default=300.0, help='Client timeout per request')
+        parser.add_argument('--genre', default='fantasy')
+        parser.add_argument('--length', default='short', choices=['short', 'medium', 'long'])
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['rps'] <= 0:
+            raise CommandError("--rps must be positive")
+
+        base_url = options['url'].rstrip('/')
+        rng = random.Random(options['seed'])
+        local = threading.local()
+        results = []
+        results_lock = threading.Lock()
+
+        def session():
+            # One session (cookies + CSRF token) per worker thread
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+                page = local.session.get(f"{base_url}/", timeout=options['timeout'])
+                match = CSRF_INPUT_RE.search(page.text)
+                local.token = match.group(1) if match else local.session.cookies.get('csrftoken', '')
+            return local.session, local.token
+
+        def fire(scheduled_at, prompt):
+            outcome = 'error'
+            try:
+                http, token = session()
+                response = http.post(
+                    f"{base_url}{options['path']}",
+                    data={
+                        'csrfmiddlewaretoken': token,
+                        'prompt': prompt,
+                        'input_type': 'text',
+                        'genre': options['genre'],
+                        'story_length': options['length'],
+                    },
+                    headers={'Referer': f"{base_url}/"},
+                    timeout=options['timeout'],
+                    allow_redirects=False,
+                )
+                if response.status_code == 200:
+                    outcome = 'success'
+                elif response.status_code in (301, 302):
+                    # generate_story redirects back to the index when generation fails
+                    outcome = 'failed'
+                else:
+                    outcome = f"http_{response.status_code}"
+            except requests.Timeout:
+                outcome = 'timeout'
+            except requests.RequestException as e:
+                outcome = f"error:{type(e).__name__}"
+            # Measured from the scheduled start, so queueing behind slow requests counts
+            latency = time.monotonic() - scheduled_at
+            with results_lock:
+                results.append((outcome, latency))
+
+        interval = 1.0 / options['rps']
+        total = int(options['duration'] * options['rps'])
+        self.stdout.write(f"Sending {total} requests at {options['rps']} rps to {base_url}{options['path']} ...")
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            for i in range(total):
+                scheduled_at = started + i * interval
+                delay = scheduled_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(fire, scheduled_at, rng.choice(PROMPTS))
+        elapsed = time.monotonic() - started
+
+        self._report(results, elapsed)
+
+    def _report(self, results, elapsed):
+        outcomes = Counter(outcome for outcome, _ in results)
+        all_latencies = [latency for _, latency in results]
+        ok_latencies = [latency for outcome, latency in results if outcome == 'success']
+
+        self.stdout.write(f"\nCompleted {len(results)} requests in {elapsed:.1f}s")
+        self.stdout.write(f"Throughput: {outcomes['success'] / elapsed:.3f} successful stories/s "
+                          f"({len(results) / elapsed:.3f} responses/s)")
+        header = f"{'latency (s)':<14} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}"
+        self.stdout.write('\n' + header)
+        self.stdout.write('-' * len(header))
+        for label, values in (('all', all_latencies), ('successful', ok_latencies)):
+            self.stdout.write(
+                f"{label:<14} {percentile(values, 50):>8.2f} {percentile(values, 95):>8.2f} "
+                f"{percentile(values, 99):>8.2f} {max(values, default=0.0):>8.2f}"
+            )
+
+        self.stdout.write('\nOutcomes:')
+        for outcome, count in outcomes.most_common():
+            self.stdout.write(f"  {outcome:<24} {count:>6}  {count / len(results):>7.1%}")
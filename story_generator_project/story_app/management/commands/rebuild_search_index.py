@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from story_app.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-index every story in the full-text search table. The triggers keep the index "
+        "in sync on their own; this repairs it after writes that bypassed them."
+    )
+
+    def handle(self, *args, **options):
+        if not rebuild_search_index():
+            raise CommandError(
+                "There is no search index to rebuild: the database is not SQLite with FTS5, "
+                "or migrations have not been applied."
+            )
+        self.stdout.write("Rebuilt the story search index.")
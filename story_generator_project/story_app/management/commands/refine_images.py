@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from story_app.models import StoryGeneration
+from story_app.quality import IMAGE_TIERS, TIER_ORDER, quality_settings
+from story_app.refinement import refine_story
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-render story images at the refine tier (STORY_IMAGE_QUALITY['REFINE_TIER']) and store "
+        "them on the same stories. By default only stories whose background refinement never "
+        "finished ('pending', e.g. the server restarted); --all takes every story with an image below the tier."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Every story with an image below the refine tier')
+        parser.add_argument('--tier', choices=list(IMAGE_TIERS), help='Refine to this tier instead of REFINE_TIER')
+        parser.add_argument('--limit', type=int, default=None)
+
+    def handle(self, *args, **options):
+        target = options['tier'] or quality_settings()['REFINE_TIER']
+        if options['all']:
+            lower = TIER_ORDER[:TIER_ORDER.index(target)]
+            stories = StoryGeneration.objects.filter(
+                Q(character_image_tier__in=lower) | Q(background_image_tier__in=lower)
+            )
+        else:
+            stories = StoryGeneration.objects.filter(refinement_status='pending')
+        story_ids = list(stories.values_list('id', flat=True)[:options['limit']])
+
+        self.stdout.write(f"Refining {len(story_ids)} stories to the {target} tier")
+        refined = 0
+        for story_id in story_ids:
+            updates = refine_story(story_id, target)
+            refined += bool(updates)
+            self.stdout.write(f"  story {story_id}: {', '.join(updates) if updates else 'not refined'}")
+        self.stdout.write(self.style.SUCCESS(f"{refined}/{len(story_ids)} stories refined"))
+
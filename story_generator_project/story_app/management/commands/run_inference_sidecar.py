@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from story_app.inference import InferenceSidecar, SidecarServer
+
+
+class Command(BaseCommand):
+    requires_system_checks = []
+    help = (
+        "Run the inference sidecar: one process that loads Whisper and rembg once and serves "
+        "transcription and background removal to every web worker over a Unix socket."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.INFERENCE_SIDECAR['SOCKET'],
+                            help='Unix socket path (defaults to INFERENCE_SOCKET)')
+        parser.add_argument('--whisper-model', default=settings.WHISPER_MODEL,
+                            help="Whisper model to load ('' to serve background removal only)")
+        parser.add_argument('--threads', type=int, default=None, help='CPU threads for inference (default: all cores)')
+        parser.add_argument('--rembg-workers', type=int, default=2, help='Concurrent background removals')
+        parser.add_argument('--queue-size', type=int, default=16,
+                            help='Requests per model allowed to wait before the sidecar answers busy')
+
+    def handle(self, *args, **options):
+        if not options['socket']:
+            raise CommandError("Pass --socket or set INFERENCE_SOCKET.")
+
+        self.stdout.write("Loading models...")
+        sidecar = InferenceSidecar(
+            whisper_model=options['whisper_model'],
+            threads=options['threads'],
+            rembg_workers=options['rembg_workers'],
+            queue_size=options['queue_size'],
+        )
+        server = SidecarServer(options['socket'], sidecar)
+        self.stdout.write(f"Inference sidecar listening on {options['socket']} ({sidecar.info})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
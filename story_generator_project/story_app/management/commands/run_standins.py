@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from story_app.standins import LatencyDistribution, StandinConfig, StandinServer
+
+
+class Command(BaseCommand):
+    # The stand-ins don't need the app's URL checks (which import the ML stack)
+    requires_system_checks = []
+    help = (
+        "Serve local stand-ins for the Ollama, Hugging Face and Stability APIs with "
+        "configurable latency and failure rates, so the pipeline can be load-tested offline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--ollama-latency', default='lognormal:4:0.4',
+                            help="Total generation time per LLM call: fixed:S, uniform:A:B, normal:M:SD or lognormal:MEDIAN:SIGMA")
+        parser.add_argument('--hf-latency', default='lognormal:6:0.5', help='Per Hugging Face image at 25 steps (scaled by the requested steps)')
+        parser.add_argument('--stability-latency', default='lognormal:8:0.3', help='Per Stability image')
+        parser.add_argument('--hf-loading-rate', type=float, default=0.1, help='Share of HF calls answered 503 "model loading"')
+        parser.add_argument('--hf-timeout-rate', type=float, default=0.02, help='Share of HF calls that hang past the client timeout')
+        parser.add_argument('--hf-error-rate', type=float, default=0.0, help='Share of HF calls answered 500')
+        parser.add_argument('--stability-error-rate', type=float, default=0.0)
+        parser.add_argument('--hang-seconds', type=float, default=45.0, help='How long a "timeout" call hangs')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            config = StandinConfig(
+                ollama_latency=options['ollama_latency'],
+                hf_latency=options['hf_latency'],
+                stability_latency=options['stability_latency'],
+                hf_loading_rate=options['hf_loading_rate'],
+                hf_timeout_rate=options['hf_timeout_rate'],
+                hf_error_rate=options['hf_error_rate'],
+                stability_error_rate=options['stability_error_rate'],
+                hang_seconds=options['hang_seconds'],
+                seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        server = StandinServer((options['host'], options['port']), config)
+        base_url = f"http://{options['host']}:{server.server_address[1]}"
+        self.stdout.write(f"Stand-in APIs listening on {base_url}")
+        self.stdout.write("Start the app with:")
+        self.stdout.write(f"  OLLAMA_BASE_URL={base_url} HF_INFERENCE_URL={base_url} STABILITY_API_URL={base_url}")
+        self.stdout.write(
+            f"Latency: ollama {config.ollama_latency}, hf {config.hf_latency}, stability {config.stability_latency}; "
+            f"HF loading {config.hf_loading_rate:.0%}, timeouts {config.hf_timeout_rate:.0%}"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            self.stdout.write(f"\nRequest counts: {server.stats_snapshot()}")
+        finally:
+            server.server_close()
@@ -0,0 +1,134 @@
+"""
+Opt-in allocation accounting for the generation pipeline (STORY_MEMORY_TRACKING).
+
+While a request is tracked, every timed_stage also records how far traced memory
+rose above its starting point (peak) and how much of that was still allocated when
+the stage ended (retained). tracemalloc is process-wide, so figures are exact with
+one request per worker process and approximate when threads share a worker.
+"""
+from contextvars import ContextVar
+from django.conf import settings
+import logging
+import threading
+import tracemalloc
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMORY_SETTINGS = {
+    'ENABLED': False,
+    'BUDGET_MB': 512,
+    # Allocation sites listed in the over-budget warning (0 skips the snapshots)
+    'TOP_ALLOCATIONS': 5,
+    'TRACEBACK_FRAMES': 1,
+}
+
+# Open stage frames of the request being tracked; None when tracking is off
+_frames = ContextVar('story_memory_frames', default=None)
+_state = {'active_requests': 0, 'started_tracing': False}
+_state_lock = threading.Lock()
+
+
+def memory_settings():
+    config = dict(DEFAULT_MEMORY_SETTINGS)
+    config.update(getattr(settings, 'STORY_MEMORY_TRACKING', {}))
+    return config
+
+
+class _Frame:
+    __slots__ = ('start', 'peak', 'snapshot')
+
+    def __init__(self, start, snapshot=None):
+        self.start = start
+        self.peak = start
+        self.snapshot = snapshot
+
+
+def start_request_tracking():
+    """Begin accounting for the current request if STORY_MEMORY_TRACKING is enabled"""
+    config = memory_settings()
+    if not config['ENABLED'] or _frames.get() is not None:
+        return False
+
+    with _state_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(config['TRACEBACK_FRAMES'])
+            _state['started_tracing'] = True
+        _state['active_requests'] += 1
+
+    snapshot = tracemalloc.take_snapshot() if config['TOP_ALLOCATIONS'] else None
+    tracemalloc.reset_peak()
+    _frames.set([_Frame(tracemalloc.get_traced_memory()[0], snapshot)])
+    return True
+
+
+def enter_stage():
+    """Open a stage frame; returns None when the request is not being tracked"""
+    frames = _frames.get()
+    if frames is None:
+        return None
+    current, peak = tracemalloc.get_traced_memory()
+    # reset_peak() below would lose the enclosing stage's peak so far; keep it on its frame
+    frames[-1].peak = max(frames[-1].peak, peak)
+    tracemalloc.reset_peak()
+    frame = _Frame(current)
+    frames.append(frame)
+    return frame
+
+
+def exit_stage(frame):
+    """Close a stage frame; returns its peak and retained kilobytes"""
+    frames = _frames.get()
+    current, peak = tracemalloc.get_traced_memory()
+    frame.peak = max(frame.peak, peak)
+    if frames and frames[-1] is frame:
+        frames.pop()
+        if frames:
+            frames[-1].peak = max(frames[-1].peak, frame.peak)
+    return {
+        'peak_kb': round((frame.peak - frame.start) / 1024),
+        'retained_kb': round((current - frame.start) / 1024),
+    }
+
+
+def finish_request_tracking(label='', stage_log=None):
+    """
+    Stop accounting for the current request. Returns the request's peak/retained figures
+    (or None if it was not tracked) and logs a warning when the peak exceeds the budget.
+    """
+    frames = _frames.get()
+    if frames is None:
+        return None
+    _frames.set(None)
+
+    config = memory_settings()
+    root = frames[0]
+    current, peak = tracemalloc.get_traced_memory()
+    root.peak = max([root.peak, peak] + [frame.peak for frame in frames[1:]])
+    budget_kb = config['BUDGET_MB'] * 1024
+    summary = {
+        'peak_kb': round((root.peak - root.start) / 1024),
+        'retained_kb': round((current - root.start) / 1024),
+        'budget_kb': budget_kb,
+    }
+    summary['over_budget'] = summary['peak_kb'] > budget_kb
+
+    if summary['over_budget']:
+        message = (f"Memory budget exceeded{f' for {label}' if label else ''}: "
+                   f"peak {summary['peak_kb'] / 1024:.1f} MB, budget {config['BUDGET_MB']} MB, "
+                   f"retained {summary['retained_kb'] / 1024:.1f} MB")
+        stages = sorted((entry for entry in stage_log or [] if 'peak_kb' in entry),
+                        key=lambda entry: entry['peak_kb'], reverse=True)[:5]
+        if stages:
+            message += '; largest stages: ' + ', '.join(
+                f"{entry['stage']} {entry['peak_kb'] / 1024:.1f} MB" for entry in stages)
+        if root.snapshot is not None:
+            top = tracemalloc.take_snapshot().compare_to(root.snapshot, 'lineno')[:config['TOP_ALLOCATIONS']]
+            message += ''.join(f"\n  {stat}" for stat in top)
+        logger.warning(message)
+
+    with _state_lock:
+        _state['active_requests'] -= 1
+        if _state['active_requests'] == 0 and _state['started_tracing']:
+            tracemalloc.stop()
+            _state['started_tracing'] = False
+    return summary
@@ -0,0 +1,251 @@
+"""
+Stage timing instrumentation for the generation pipeline.
+
+Metrics live in a per-process registry and are rendered in the Prometheus text
+format by the /metrics view. Each worker process reports its own series, so
+scrape every worker (or label them by instance) when running several.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import bisect
+import threading
+import time
+
+from .memory import enter_stage, exit_stage
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+MEMORY_BUCKETS = tuple(mb * 1024 * 1024 for mb in (1, 4, 16, 32, 64, 128, 256, 512, 1024))
+
+# Timings collected for the story currently being generated (per request / task)
+_stage_log = ContextVar('story_stage_log', default=None)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_items, extra=None):
+    items = list(label_items) + (list(extra.items()) if extra else [])
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in items) + '}'
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def collect(self):
+        lines = super().collect()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['counts'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), series['counts']):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(float(bound))
+                    lines.append(f"{self.name}_bucket{_format_labels(key, {'le': le})} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+STAGE_DURATION = register(Histogram(
+    'story_stage_duration_seconds', 'Time spent in each generation pipeline stage'))
+STAGE_MEMORY_PEAK = register(Histogram(
+    'story_stage_memory_peak_bytes', 'Traced allocation peak above the stage start (memory tracking only)',
+    buckets=MEMORY_BUCKETS))
+STAGE_ERRORS = register(Counter(
+    'story_stage_errors_total', 'Pipeline stages that raised an exception'))
+IMAGE_ATTEMPTS = register(Counter(
+    'story_image_attempts_total', 'Image provider calls by provider and outcome'))
+IMAGE_FALLBACKS = register(Counter(
+    'story_image_fallbacks_total', 'Image generations that fell back to another provider or a placeholder'))
+STORIES_GENERATED = register(Counter(
+    'story_generations_total', 'Completed generate_story requests by input type and outcome'))
+COMPOSITOR_TASK_SECONDS = register(Histogram(
+    'story_compositor_task_seconds', 'Compositor pool task latency by phase (queue_wait, run, total)'))
+COMPOSITOR_TASKS = register(Counter(
+    'story_compositor_tasks_total', 'Compositor pool tasks by outcome'))
+COMPOSITOR_INFLIGHT = register(Gauge(
+    'story_compositor_inflight', 'Compositor pool tasks queued or running in this process'))
+COMPOSITOR_POOL_SIZE = register(Gauge(
+    'story_compositor_pool_size', 'Configured compositor pool workers and queue depth'))
+ADMISSION_QUEUE_DEPTH = register(Gauge(
+    'story_admission_queue_depth', 'Generation requests waiting for capacity in this process'))
+ADMISSION_IN_USE = register(Gauge(
+    'story_admission_in_use', 'Cost units of generation running in this process'))
+ADMISSION_WAIT_SECONDS = register(Histogram(
+    'story_admission_wait_seconds', 'Queue wait of admitted generation requests by request class'))
+ADMISSION_DECISIONS = register(Counter(
+    'story_admission_decisions_total', 'Admission outcomes (admitted, rate_limited, queue_full, queue_timeout)'))
+SPECULATIVE_BACKGROUND = register(Counter(
+    'story_speculative_background_total', 'Speculative background images by outcome (hit, miss, failed)'))
+SPECULATIVE_SAVED_SECONDS = register(Histogram(
+    'story_speculative_saved_seconds', 'Background latency taken off the critical path by a speculative hit'))
+STORY_PARSE = register(Counter(
+    'story_llm_parse_total', 'Story responses by parsed part (sections, image_prompts) and outcome'))
+DEADLINE_FALLBACKS = register(Counter(
+    'story_deadline_fallbacks_total', 'Stages that switched to a local fallback because the request budget ran low'))
+IMAGE_REFINEMENTS = register(Counter(
+    'story_image_refinements_total', 'Background image refinements by outcome (refined, failed)'))
+IMAGE_REFINEMENT_SECONDS = register(Histogram(
+    'story_image_refinement_seconds', 'Time to re-render and store a story\'s images at the refine tier'))
+LIBRARY_CHARACTER_USES = register(Counter(
+    'story_library_character_uses_total', 'Stories generated with a saved library character'))
+SCENE_IMAGES = register(Counter(
+    'story_scene_images_total', 'Multi-scene story scene images by outcome (success, failed)'))
+SCENE_RATE_WAIT_SECONDS = register(Histogram(
+    'story_scene_rate_wait_seconds', 'Time scene backgrounds waited for the shared provider rate limit'))
+SINGLE_FLIGHT = register(Counter(
+    'story_single_flight_total', 'Generation requests by single-flight role (leader, follower, independent, stale_takeover)'))
+
+
+def render_prometheus(extra_lines=None):
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    if extra_lines:
+        lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
+
+
+def start_stage_log():
+    """Begin collecting a per-story stage breakdown in the current context"""
+    log = []
+    _stage_log.set(log)
+    return log
+
+
+def current_stage_log():
+    return _stage_log.get()
+
+
+def record_stage(stage, seconds, **details):
+    """Record a finished stage in the histogram and in the current story's breakdown"""
+    STAGE_DURATION.observe(seconds, stage=stage)
+    log = _stage_log.get()
+    if log is not None:
+        entry = {'stage': stage, 'ms': round(seconds * 1000, 1)}
+        entry.update(details)
+        log.append(entry)
+
+
+@contextmanager
+def timed_stage(stage, **details):
+    """
+    Time a block as a pipeline stage. ``details`` (model name, attempt, ...) go into the
+    per-story breakdown only, keeping histogram label cardinality low.
+    The yielded dict can be filled with more details inside the block.
+    """
+    memory_frame = enter_stage()
+    started = time.perf_counter()
+    try:
+        yield details
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        details['error'] = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        if memory_frame is not None:
+            details.update(exit_stage(memory_frame))
+            STAGE_MEMORY_PEAK.observe(details['peak_kb'] * 1024, stage=stage)
+        record_stage(stage, elapsed, **details)
+
+
+def merge_stage_entries(entries):
+    """Record stage entries timed in another process (e.g. a compositor pool worker)"""
+    log = _stage_log.get()
+    for entry in entries:
+        STAGE_DURATION.observe(entry['ms'] / 1000, stage=entry['stage'])
+        if log is not None:
+            log.append(entry)
+
+
+def summarize_stage_log(log, memory=None):
+    """
+    Stored form of a breakdown: the ordered stages plus per-stage totals, and with
+    memory tracking the largest peak per stage and the request's overall figures
+    """
+    totals = {}
+    peaks = {}
+    for entry in log:
+        totals[entry['stage']] = round(totals.get(entry['stage'], 0) + entry['ms'], 1)
+        if 'peak_kb' in entry:
+            peaks[entry['stage']] = max(peaks.get(entry['stage'], 0), entry['peak_kb'])
+    summary = {'stages': log, 'totals_ms': totals}
+    if memory is not None:
+        summary['peak_kb'] = peaks
+        summary['memory'] = memory
+    return summary
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of raw samples, for the benchmark and load-test reports"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
@@ -0,0 +1,83 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+from .metrics import current_stage_log, start_stage_log, summarize_stage_log
+from .profiling import StackSampler, profiler_settings, save_profile
+import logging
+import random
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ProfilingMiddleware:
+    """
+    Profile a fraction of requests (STORY_PROFILER SAMPLE_RATE, adjustable at runtime from
+    the profiles page) or any request carrying the profile header. The header is honoured
+    for staff users, or for anyone sending the configured HEADER_TOKEN.
+
+    Under ASGI the sampled thread is the event loop's, so an async request's profile
+    also shows whatever other requests the loop ran in the meantime.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        config = profiler_settings()
+        if not self._should_profile(request, config):
+            return self.get_response(request)
+
+        # Fresh log so a view that records no stages doesn't report an earlier request's
+        start_stage_log()
+        sampler = StackSampler(threading.get_ident(), config['INTERVAL']).start()
+        try:
+            response = self.get_response(request)
+        finally:
+            sampler.stop()
+        return self._finish(sampler, request, response)
+
+    async def __acall__(self, request):
+        config = profiler_settings()
+        if request.headers.get(config['HEADER']):
+            # The staff check resolves request.user, which queries the database
+            should_profile = await sync_to_async(self._should_profile)(request, config)
+        else:
+            should_profile = self._should_profile(request, config)
+        if not should_profile:
+            return await self.get_response(request)
+
+        start_stage_log()
+        sampler = StackSampler(threading.get_ident(), config['INTERVAL']).start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            sampler.stop()
+        return await sync_to_async(self._finish)(sampler, request, response)
+
+    def _finish(self, sampler, request, response):
+        try:
+            stage_log = current_stage_log()
+            stage_timings = summarize_stage_log(stage_log) if stage_log else None
+            name = save_profile(sampler, request, response, stage_timings)
+            response['X-Story-Profile-Id'] = name
+        except Exception as e:
+            logger.error(f"Failed to save request profile: {e}")
+        return response
+
+    def _should_profile(self, request, config):
+        header_value = request.headers.get(config['HEADER'])
+        if header_value:
+            token = config['HEADER_TOKEN']
+            if (token and header_value == token) or getattr(getattr(request, 'user', None), 'is_staff', False):
+                return True
+
+        if not config['ENABLED']:
+            return False
+        return random.random() < config['SAMPLE_RATE']
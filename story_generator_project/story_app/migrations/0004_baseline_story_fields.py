@@ -0,0 +1,118 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story_app', '0003_alter_storygeneration_options_storygeneration_genre_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='storygeneration',
+            options={'ordering': ['-created_at']},
+        ),
+        migrations.RemoveField(
+            model_name='storygeneration',
+            name='updated_at',
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='audio_duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='audio_file',
+            field=models.FileField(blank=True, null=True, upload_to='audio_prompts/'),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='audio_transcription',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='background_image_data',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='background_image_model',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='background_image_prompt',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='character_image_data',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='character_image_model',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='character_image_prompt',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='combination_info',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='combined_scene_data',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='combined_scene_model',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='combined_scene_prompt',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='input_type',
+            field=models.CharField(choices=[('text', 'Text Only'), ('audio', 'Audio Only'), ('both', 'Text + Audio')], default='text', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='storygeneration',
+            name='background_description',
+            field=models.TextField(blank=True, default=''),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='storygeneration',
+            name='character_description',
+            field=models.TextField(blank=True, default=''),
+            preserve_default=False,
+        ),
+        migrations.AlterField(
+            model_name='storygeneration',
+            name='genre',
+            field=models.CharField(choices=[('fantasy', 'Fantasy'), ('sci-fi', 'Science Fiction'), ('mystery', 'Mystery'), ('romance', 'Romance'), ('adventure', 'Adventure'), ('horror', 'Horror'), ('drama', 'Drama'), ('comedy', 'Comedy')], default='fantasy', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='storygeneration',
+            name='prompt',
+            field=models.TextField(blank=True, max_length=1000),
+        ),
+        migrations.AlterField(
+            model_name='storygeneration',
+            name='story_length',
+            field=models.CharField(choices=[('short', 'Short (50-100 words)'), ('medium', 'Medium (100-200 words)'), ('long', 'Long (200-250 words)')], default='medium', max_length=10),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story_app', '0004_baseline_story_fields'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='storygeneration',
+            options={'ordering': ['-created_at', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='storygeneration',
+            index=models.Index(fields=['-created_at', '-id'], name='story_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storygeneration',
+            index=models.Index(fields=['genre', '-created_at', '-id'], name='story_genre_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storygeneration',
+            index=models.Index(fields=['input_type', '-created_at', '-id'], name='story_input_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='storygeneration',
+            index=models.Index(fields=['story_length', '-created_at', '-id'], name='story_length_created_idx'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+from django.db import migrations
+
+from story_app.search import fts5_available
+
+FTS_TABLE = 'story_app_storysearch'
+STORY_TABLE = 'story_app_storygeneration'
+COLUMNS = 'prompt, audio_transcription, generated_story, character_description, background_description'
+NEW_VALUES = 'new.prompt, new.audio_transcription, new.generated_story, new.character_description, new.background_description'
+OLD_VALUES = 'old.prompt, old.audio_transcription, old.generated_story, old.character_description, old.background_description'
+
+CREATE_INDEX = [
+    # External content: the text is stored once, in the story table
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        {COLUMNS},
+        content='{STORY_TABLE}', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2'
+    )""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON {STORY_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {COLUMNS}) VALUES (new.id, {NEW_VALUES});
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON {STORY_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {COLUMNS}) VALUES ('delete', old.id, {OLD_VALUES});
+    END""",
+    f"""CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF {COLUMNS} ON {STORY_TABLE} BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {COLUMNS}) VALUES ('delete', old.id, {OLD_VALUES});
+        INSERT INTO {FTS_TABLE}(rowid, {COLUMNS}) VALUES (new.id, {NEW_VALUES});
+    END""",
+    # Index the stories written before this migration
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+DROP_INDEX = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+class SQLiteRunSQL(migrations.RunSQL):
+    """RunSQL that only runs on SQLite with FTS5; elsewhere story search uses icontains filters"""
+
+    def _applies(self, connection):
+        return connection.vendor == 'sqlite' and fts5_available(connection)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if self._applies(schema_editor.connection):
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if self._applies(schema_editor.connection):
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story_app', '0005_story_list_indexes'),
+    ]
+
+    operations = [
+        SQLiteRunSQL(CREATE_INDEX, reverse_sql=DROP_INDEX),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story_app', '0006_story_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storygeneration',
+            name='stage_timings',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
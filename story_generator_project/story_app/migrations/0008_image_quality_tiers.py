@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story_app', '0007_stage_timings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storygeneration',
+            name='background_image_tier',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='character_image_tier',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='combined_scene_tier',
+            field=models.CharField(blank=True, max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='refined_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='refinement_status',
+            field=models.CharField(blank=True, max_length=10, null=True),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story_app', '0008_image_quality_tiers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoryScene',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order', models.PositiveSmallIntegerField()),
+                ('text', models.TextField()),
+                ('image_prompt', models.TextField(blank=True, null=True)),
+                ('background_model', models.CharField(blank=True, max_length=100, null=True)),
+                ('image_data', models.TextField(blank=True, null=True)),
+                ('image_model', models.CharField(blank=True, max_length=100, null=True)),
+                ('image_tier', models.CharField(blank=True, max_length=20, null=True)),
+                ('composition_info', models.JSONField(blank=True, null=True)),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scenes', to='story_app.storygeneration')),
+            ],
+            options={
+                'ordering': ['story', 'order'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='storyscene',
+            constraint=models.UniqueConstraint(fields=('story', 'order'), name='story_scene_order_unique'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story_app', '0009_storyscene'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Character',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('name_key', models.CharField(editable=False, max_length=100, unique=True)),
+                ('genre', models.CharField(choices=[('fantasy', 'Fantasy'), ('sci-fi', 'Science Fiction'), ('mystery', 'Mystery'), ('romance', 'Romance'), ('adventure', 'Adventure'), ('horror', 'Horror'), ('drama', 'Drama'), ('comedy', 'Comedy')], default='fantasy', max_length=20)),
+                ('description', models.TextField()),
+                ('image_data', models.TextField()),
+                ('image_prompt', models.TextField(blank=True, null=True)),
+                ('image_model', models.CharField(blank=True, max_length=100, null=True)),
+                ('image_tier', models.CharField(blank=True, max_length=20, null=True)),
+                ('usage_count', models.PositiveIntegerField(default=0)),
+                ('last_used_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('source_story', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='story_app.storygeneration')),
+            ],
+            options={
+                'ordering': ['-usage_count', 'name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='storygeneration',
+            name='character',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stories', to='story_app.character'),
+        ),
+        migrations.AddIndex(
+            model_name='character',
+            index=models.Index(fields=['-usage_count', 'name'], name='character_usage_idx'),
+        ),
+    ]
@@ -1,4 +1,63 @@
 from django.db import models
+from django.urls import reverse
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from .deadline import PLACEHOLDER_MODEL, placeholder_gradient
+from .downloads import guess_content_type
+
+# Large columns that list pages never need to load
+LISTING_DEFERRED_FIELDS = [
+    'character_description', 'background_description',
+    'character_image_data', 'character_image_prompt',
+    'background_image_data', 'background_image_prompt',
+    'combined_scene_data', 'combined_scene_prompt', 'combination_info',
+    'stage_timings',
+]
+
+# Image columns by the name used in image URLs
+IMAGE_DATA_FIELDS = {
+    'character': 'character_image_data',
+    'background': 'background_image_data',
+    'scene': 'combined_scene_data',
+}
+
+def _stored(field):
+    """SQL flag for a non-empty text column, computed without reading the value"""
+    return ExpressionWrapper(Q(**{f'{field}__isnull': False}) & ~Q(**{field: ''}), output_field=BooleanField())
+
+class StoryGenerationQuerySet(models.QuerySet):
+    def for_listing(self):
+        """Skip the image/description columns and flag scene availability in SQL instead"""
+        # A NULL check reads only the record header, never the multi-megabyte value
+        return self.defer(*LISTING_DEFERRED_FIELDS).annotate(
+            has_scene=ExpressionWrapper(
+                Q(combined_scene_data__isnull=False),
+                output_field=BooleanField()
+            )
+        )
+    
+    def for_detail(self):
+        """Everything but the image data; images are served by URL (see the story_image view)"""
+        return self.defer(*IMAGE_DATA_FIELDS.values()).annotate(
+            **{f'{kind}_image_stored': _stored(field) for kind, field in IMAGE_DATA_FIELDS.items()}
+        )
+    
+    def filter_listing(self, genre=None, input_type=None, story_length=None):
+        """Apply the optional story list filters"""
+        filters = {}
+        if genre:
+            filters['genre'] = genre
+        if input_type:
+            filters['input_type'] = input_type
+        if story_length:
+            filters['story_length'] = story_length
+        return self.filter(**filters)
+    
+    def after_cursor(self, created_at, story_id):
+        """Keyset condition for rows strictly after (created_at, id) in newest-first order"""
+        # The plain created_at bound lets the database seek the index instead of scanning the OR
+        return self.filter(created_at__lte=created_at).filter(
+            Q(created_at__lt=created_at) | Q(id__lt=story_id)
+        )
 
 class StoryGeneration(models.Model):
     GENRE_CHOICES = [
@@ -50,12 +109,78 @@ class StoryGeneration(models.Model):
     combined_scene_model = models.CharField(max_length=100, blank=True, null=True)
     combination_info = models.JSONField(blank=True, null=True)
     
+    # Quality tier each image was rendered at (see quality.py); empty for placeholders
+    character_image_tier = models.CharField(max_length=20, blank=True, null=True)
+    background_image_tier = models.CharField(max_length=20, blank=True, null=True)
+    combined_scene_tier = models.CharField(max_length=20, blank=True, null=True)
+    # Background re-render at a higher tier: 'pending', 'done' or 'failed'; empty when not queued
+    refinement_status = models.CharField(max_length=10, blank=True, null=True)
+    refined_at = models.DateTimeField(blank=True, null=True)
+    
+    # Library character the story was written about (series mode); its portrait was reused
+    character = models.ForeignKey(
+        'Character', on_delete=models.SET_NULL, blank=True, null=True, related_name='stories'
+    )
+    
+    # Per-stage timing breakdown of the request that generated this story
+    stage_timings = models.JSONField(blank=True, null=True)
+    
     genre = models.CharField(max_length=20, choices=GENRE_CHOICES, default='fantasy')
     story_length = models.CharField(max_length=10, choices=LENGTH_CHOICES, default='medium')
     created_at = models.DateTimeField(auto_now_add=True)
     
+    objects = StoryGenerationQuerySet.as_manager()
+    
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='story_created_idx'),
+            models.Index(fields=['genre', '-created_at', '-id'], name='story_genre_created_idx'),
+            models.Index(fields=['input_type', '-created_at', '-id'], name='story_input_created_idx'),
+            models.Index(fields=['story_length', '-created_at', '-id'], name='story_length_created_idx'),
+        ]
+    
+    @classmethod
+    def from_story_package(cls, complete_story, text_prompt, audio_file_saved, genre, length):
+        """Unsaved story from a generate_* result dict and its inputs"""
+        character_image = complete_story.get('character_image', {})
+        background_image = complete_story.get('background_image', {})
+        combined_scene = complete_story.get('combined_scene', {})
+        return cls(
+            prompt=text_prompt or "",
+            generated_story=complete_story['story'],
+            character_description=complete_story['character_description'],
+            background_description=complete_story['background_description'],
+            
+            # Audio-related fields
+            audio_file=audio_file_saved,
+            audio_transcription=complete_story.get('audio_transcription'),
+            audio_duration=complete_story.get('audio_duration', 0),
+            input_type=complete_story.get('input_type', 'text'),
+            
+            # Image data; a missing image is NULL, never '' (list pages test IS NOT NULL)
+            character_image_data=character_image.get('image_data') or None,
+            character_image_prompt=character_image.get('prompt'),
+            character_image_model=character_image.get('model_used'),
+            character_image_tier=character_image.get('tier'),
+            
+            # Background image data
+            background_image_data=background_image.get('image_data') or None,
+            background_image_prompt=background_image.get('prompt'),
+            background_image_model=background_image.get('model_used'),
+            background_image_tier=background_image.get('tier'),
+            
+            # Combined scene data
+            combined_scene_data=combined_scene.get('image_data') or None,
+            combined_scene_prompt=combined_scene.get('prompt'),
+            combined_scene_model=combined_scene.get('model_used'),
+            combination_info=combined_scene.get('composition_info'),
+            combined_scene_tier=combined_scene.get('tier'),
+            
+            character_id=complete_story.get('character_id'),
+            genre=genre,
+            story_length=length
+        )
     
     def __str__(self):
         if self.input_type == 'audio' and self.audio_transcription:
@@ -82,6 +207,15 @@ class StoryGeneration(models.Model):
         else:
             return self.prompt or "No prompt available"
     
+    @property
+    def content_updated_at(self):
+        """When the page content last changed: creation, or a finished image refinement"""
+        return self.refined_at or self.created_at
+    
+    @property
+    def is_refining(self):
+        return self.refinement_status == 'pending'
+    
     @property
     def has_audio(self):
         """Check if story was generated from audio input"""
@@ -94,6 +228,13 @@ class StoryGeneration(models.Model):
             return self.audio_file.url
         return None
     
+    @property
+    def audio_content_type(self):
+        """Return the MIME type of the stored audio file"""
+        if self.audio_file:
+            return guess_content_type(self.audio_file.name)
+        return None
+    
     @property
     def input_type_display(self):
         return dict(self.INPUT_TYPE_CHOICES).get(self.input_type, 'Unknown')
@@ -102,39 +243,62 @@ class StoryGeneration(models.Model):
     def genre_display(self):
         return dict(self.GENRE_CHOICES).get(self.genre, 'Unknown')
     
+    def _has_image(self, kind):
+        # for_detail() rows carry the flag from SQL and never load the image itself
+        stored = self.__dict__.get(f'{kind}_image_stored')
+        if stored is not None:
+            return stored
+        return bool(getattr(self, IMAGE_DATA_FIELDS[kind]))
+    
+    def _image_url(self, kind):
+        if not self._has_image(kind):
+            return None
+        # The version changes with the image, so cached pages never show a stale one
+        url = reverse('story_image', args=[self.id, kind])
+        return f"{url}?v={int(self.content_updated_at.timestamp())}"
+    
     @property
     def has_character_image(self):
-        return bool(self.character_image_data)
+        return self._has_image('character')
     
     @property
     def has_background_image(self):
-        return bool(self.background_image_data)
+        return self._has_image('background')
     
     @property
     def has_combined_scene(self):
         """Check if combined scene image exists"""
-        return bool(self.combined_scene_data)
+        return self._has_image('scene')
     
     @property
     def character_image_url(self):
-        """Return data URL for displaying character image"""
-        if self.character_image_data:
-            return f"data:image/png;base64,{self.character_image_data}"
-        return None
+        return self._image_url('character')
     
     @property
     def background_image_url(self):
-        """Return data URL for displaying background image"""
-        if self.background_image_data:
-            return f"data:image/png;base64,{self.background_image_data}"
-        return None
+        return self._image_url('background')
     
     @property
     def combined_scene_url(self):
-        """Return data URL for displaying combined scene image"""
-        if self.combined_scene_data:
-            return f"data:image/png;base64,{self.combined_scene_data}"
-        return None
+        return self._image_url('scene')
+    
+    @property
+    def scene_list(self):
+        """The story's scenes in order, without their image data"""
+        return self.scenes.defer('image_data').annotate(image_stored=_stored('image_data'))
+    
+    @property
+    def character_image_placeholder(self):
+        """The time budget ran out before the character image; the page draws placeholder_css"""
+        return self.character_image_model == PLACEHOLDER_MODEL
+    
+    @property
+    def background_image_placeholder(self):
+        return self.background_image_model == PLACEHOLDER_MODEL
+    
+    @property
+    def placeholder_css(self):
+        return placeholder_gradient(self.genre)
     
     @property
     def has_complete_image_set(self):
@@ -167,4 +331,107 @@ class StoryGeneration(models.Model):
             
             size_desc = "small" if size < 0.5 else "large" if size > 0.7 else "medium"
             return f"Character positioned {position}, {size_desc} size, {interaction} pose"
-        return "No composition data available"
\ No newline at end of file
+        return "No composition data available"
+
+
+def character_name_key(name):
+    """Case- and whitespace-insensitive form of a character name, used for lookups"""
+    return ' '.join((name or '').split()).casefold()
+
+class CharacterQuerySet(models.QuerySet):
+    def lookup(self, name):
+        """The saved character called ``name`` (any case or spacing), or None"""
+        return self.filter(name_key=character_name_key(name)).first()
+    
+    def for_library(self):
+        """Library listing; portraits are served separately, so their column is skipped"""
+        return self.defer('image_data', 'image_prompt')
+
+class Character(models.Model):
+    """A saved protagonist (description, portrait, image prompt) that stories can reuse"""
+    name = models.CharField(max_length=100)
+    name_key = models.CharField(max_length=100, unique=True, editable=False)
+    genre = models.CharField(max_length=20, choices=StoryGeneration.GENRE_CHOICES, default='fantasy')
+    description = models.TextField()
+    # Base64 PNG, as on stories
+    image_data = models.TextField()
+    image_prompt = models.TextField(blank=True, null=True)
+    image_model = models.CharField(max_length=100, blank=True, null=True)
+    image_tier = models.CharField(max_length=20, blank=True, null=True)
+    source_story = models.ForeignKey(
+        StoryGeneration, on_delete=models.SET_NULL, blank=True, null=True, related_name='+'
+    )
+    
+    # Usage counters, bumped with an UPDATE whenever a story using the character is saved
+    usage_count = models.PositiveIntegerField(default=0)
+    last_used_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Last save, e.g. a new portrait under the same name; the portrait endpoint's ETag uses it
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    objects = CharacterQuerySet.as_manager()
+    
+    class Meta:
+        ordering = ['-usage_count', 'name']
+        indexes = [
+            models.Index(fields=['-usage_count', 'name'], name='character_usage_idx'),
+        ]
+    
+    def __str__(self):
+        return self.name
+    
+    def save(self, *args, **kwargs):
+        self.name_key = character_name_key(self.name)
+        super().save(*args, **kwargs)
+    
+    @property
+    def genre_display(self):
+        return dict(StoryGeneration.GENRE_CHOICES).get(self.genre, 'Unknown')
+
+class StoryScene(models.Model):
+    """One illustrated key scene of a multi-scene story (see scenes.py), in story order"""
+    story = models.ForeignKey(StoryGeneration, on_delete=models.CASCADE, related_name='scenes')
+    order = models.PositiveSmallIntegerField()
+    text = models.TextField()
+    image_prompt = models.TextField(blank=True, null=True)
+    background_model = models.CharField(max_length=100, blank=True, null=True)
+    image_data = models.TextField(blank=True, null=True)
+    image_model = models.CharField(max_length=100, blank=True, null=True)
+    image_tier = models.CharField(max_length=20, blank=True, null=True)
+    composition_info = models.JSONField(blank=True, null=True)
+    
+    class Meta:
+        ordering = ['story', 'order']
+        constraints = [
+            models.UniqueConstraint(fields=['story', 'order'], name='story_scene_order_unique'),
+        ]
+    
+    def __str__(self):
+        return f"Scene {self.order + 1} of story {self.story_id}"
+    
+    @classmethod
+    def from_scene_result(cls, story, scene):
+        """Unsaved scene from one entry of a story package's 'scenes' list"""
+        return cls(
+            story=story,
+            order=scene['order'],
+            text=scene['text'],
+            image_prompt=scene.get('image_prompt'),
+            background_model=scene.get('background_model'),
+            image_data=scene.get('image_data') or None,
+            image_model=scene.get('model_used'),
+            image_tier=scene.get('tier'),
+            composition_info=scene.get('composition_info'),
+        )
+    
+    @property
+    def image_url(self):
+        stored = self.__dict__.get('image_stored')
+        if stored if stored is not None else self.image_data:
+            return reverse('story_scene_image', args=[self.story_id, self.order])
+        return None
+    
+    @property
+    def is_placeholder(self):
+        """The time budget ran out before this scene's background"""
+        return self.background_model == PLACEHOLDER_MODEL
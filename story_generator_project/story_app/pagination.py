@@ -0,0 +1,44 @@
+import base64
+import binascii
+from datetime import datetime
+
+CURSOR_SEPARATOR = '|'
+
+
+def encode_cursor(created_at, story_id):
+    """Opaque, URL-safe cursor pointing at the last story of a page"""
+    raw = f"{created_at.isoformat()}{CURSOR_SEPARATOR}{story_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (created_at, story_id) for a cursor, or None if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        created_str, id_str = raw.rsplit(CURSOR_SEPARATOR, 1)
+        return datetime.fromisoformat(created_str), int(id_str)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+
+
+def keyset_page(queryset, cursor, page_size):
+    """
+    Fetch one newest-first page using (created_at, id) keyset pagination.
+    Cost depends only on the page size, not on how deep the page is.
+    Returns (stories, next_cursor).
+    """
+    position = decode_cursor(cursor)
+    if position:
+        queryset = queryset.after_cursor(*position)
+
+    stories = list(queryset.order_by('-created_at', '-id')[:page_size + 1])
+    next_cursor = None
+    if len(stories) > page_size:
+        stories = stories[:page_size]
+        last = stories[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+
+    return stories, next_cursor
@@ -0,0 +1,222 @@
+"""
+On-demand sampling profiler for slow requests.
+
+A background thread samples the request thread's stack every few milliseconds
+(sys._current_frames), so the profiled code runs unmodified and the overhead is
+one short stack walk per interval. Each profiled request is written to
+STORY_PROFILER['DIRECTORY'] as a collapsed-stack file (flamegraph.pl, speedscope,
+inferno) and/or a speedscope JSON file, next to a small JSON summary.
+"""
+from collections import Counter
+from datetime import datetime
+from django.conf import settings
+from django.core.cache import cache
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RUNTIME_CONFIG_KEY = 'story_profiler:runtime'
+PROFILE_NAME_RE = re.compile(r'^[\w.-]+$')
+
+DEFAULT_PROFILER_SETTINGS = {
+    'ENABLED': False,
+    'SAMPLE_RATE': 0.0,
+    'HEADER': 'X-Story-Profile',
+    'HEADER_TOKEN': '',
+    'INTERVAL': 0.005,
+    'DIRECTORY': os.path.join(settings.BASE_DIR, 'profiles'),
+    'FORMATS': ['collapsed', 'speedscope'],
+    'MAX_PROFILES': 200,
+}
+
+# Runtime overrides are re-read from the cache at most this often per process
+_RUNTIME_REFRESH_SECONDS = 5
+_runtime = {'checked_at': 0.0, 'values': {}}
+
+
+def profiler_settings():
+    """Static settings merged with the runtime overrides stored in the cache"""
+    config = dict(DEFAULT_PROFILER_SETTINGS)
+    config.update(getattr(settings, 'STORY_PROFILER', {}))
+
+    now = time.monotonic()
+    if now - _runtime['checked_at'] > _RUNTIME_REFRESH_SECONDS:
+        _runtime['values'] = cache.get(RUNTIME_CONFIG_KEY) or {}
+        _runtime['checked_at'] = now
+    config.update(_runtime['values'])
+    return config
+
+
+def set_runtime_config(enabled, sample_rate):
+    """Turn profiling on or off for every worker sharing the cache, without a redeploy"""
+    values = {'ENABLED': bool(enabled), 'SAMPLE_RATE': max(0.0, min(1.0, float(sample_rate)))}
+    cache.set(RUNTIME_CONFIG_KEY, values, None)
+    _runtime.update(checked_at=time.monotonic(), values=values)
+    return values
+
+
+def _frame_name(code):
+    filename = code.co_filename.replace(os.sep, '/')
+    short = '/'.join(filename.split('/')[-2:])
+    return f"{code.co_name} ({short}:{code.co_firstlineno})".replace(';', ':')
+
+
+class StackSampler:
+    """Samples one thread's call stack on an interval until stopped"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='story-profiler', daemon=True)
+        self._own_file = __file__
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                if frame.f_code.co_filename != self._own_file:
+                    stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            # Root first, as collapsed-stack tools expect
+            self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def collapsed(self):
+        """Brendan Gregg's folded format: one 'frame;frame;frame count' line per stack"""
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def speedscope(self, name):
+        """Sampled profile in the speedscope file format, weights in milliseconds"""
+        frames = []
+        frame_index = {}
+        samples = []
+        weights = []
+        for stack, count in self.stacks.items():
+            indexes = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({'name': frame})
+                indexes.append(frame_index[frame])
+            samples.append(indexes)
+            weights.append(round(count * self.interval * 1000, 3))
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'milliseconds',
+                'startValue': 0,
+                'endValue': round(sum(weights), 3),
+                'samples': samples,
+                'weights': weights,
+            }],
+            'name': name,
+            'exporter': 'story_app.profiling',
+        }
+
+
+def save_profile(sampler, request, response, stage_timings=None):
+    """Write the profile files plus a summary; returns the profile's base name"""
+    config = profiler_settings()
+    directory = config['DIRECTORY']
+    os.makedirs(directory, exist_ok=True)
+
+    view_name = getattr(getattr(request, 'resolver_match', None), 'url_name', None) or 'unknown'
+    base_name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{view_name}"
+    files = []
+
+    if 'collapsed' in config['FORMATS']:
+        with open(os.path.join(directory, f"{base_name}.folded"), 'w') as f:
+            f.write(sampler.collapsed())
+        files.append(f"{base_name}.folded")
+
+    if 'speedscope' in config['FORMATS']:
+        with open(os.path.join(directory, f"{base_name}.speedscope.json"), 'w') as f:
+            json.dump(sampler.speedscope(f"{request.method} {request.path}"), f)
+        files.append(f"{base_name}.speedscope.json")
+
+    summary = {
+        'name': base_name,
+        'method': request.method,
+        'path': request.path,
+        'view': view_name,
+        'status': getattr(response, 'status_code', None),
+        'duration_ms': round(sampler.duration * 1000, 1),
+        'samples': sampler.samples,
+        'interval_ms': config['INTERVAL'] * 1000,
+        'captured_at': datetime.now().isoformat(timespec='seconds'),
+        'files': files,
+        'stage_timings': stage_timings,
+    }
+    with open(os.path.join(directory, f"{base_name}.meta.json"), 'w') as f:
+        json.dump(summary, f)
+
+    _prune_profiles(directory, config['MAX_PROFILES'])
+    logger.info(f"Saved profile {base_name} ({sampler.samples} samples, {summary['duration_ms']}ms)")
+    return base_name
+
+
+def _prune_profiles(directory, keep):
+    """Delete the oldest captures beyond ``keep``"""
+    metas = sorted(name for name in os.listdir(directory) if name.endswith('.meta.json'))
+    for meta_name in metas[:-keep] if keep else []:
+        base_name = meta_name[:-len('.meta.json')]
+        for name in os.listdir(directory):
+            if name.startswith(base_name):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+
+def list_profiles(limit=100):
+    """Summaries of captured profiles, newest first"""
+    directory = profiler_settings()['DIRECTORY']
+    if not os.path.isdir(directory):
+        return []
+
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if not name.endswith('.meta.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Skipping unreadable profile summary {name}: {e}")
+        if len(profiles) >= limit:
+            break
+    return profiles
+
+
+def profile_path(file_name):
+    """Absolute path of a captured profile file, or None for unknown/unsafe names"""
+    if not PROFILE_NAME_RE.match(file_name):
+        return None
+    path = os.path.join(profiler_settings()['DIRECTORY'], file_name)
+    return path if os.path.isfile(path) else None
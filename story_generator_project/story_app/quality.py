@@ -0,0 +1,93 @@
+"""
+Image quality tiers (STORY_IMAGE_QUALITY).
+
+A tier fixes what each image request asks the providers for: which Hugging Face models
+to try, inference steps, resolution and retries, and the Stability fallback's steps and
+size. 'standard' is what the pipeline always used. 'draft' is a single FLUX.1-schnell
+call at 4 steps and a smaller size, for answering quickly; with REFINE on, the story is
+then re-rendered at REFINE_TIER in the background (refinement.py) and the images on the
+same StoryGeneration are swapped in place. Each stored image records its tier.
+"""
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+HF_IMAGE_MODELS = [
+    "black-forest-labs/FLUX.1-schnell",
+    "stabilityai/stable-diffusion-xl-base-1.0",
+    "runwayml/stable-diffusion-v1-5",
+    "CompVis/stable-diffusion-v1-4"
+]
+
+# Sizes are (width, height). Stability's SDXL engine only accepts its listed dimensions.
+IMAGE_TIERS = {
+    'draft': {
+        'hf_models': ["black-forest-labs/FLUX.1-schnell"],
+        'steps': 4,
+        'portrait': (384, 576),
+        'landscape': (576, 384),
+        # schnell is guidance-distilled; it ignores the scale, other models would not
+        'guidance': {'portrait': 0.0, 'landscape': 0.0},
+        # No 15s waits for a loading model: a draft that isn't quick is no use
+        'retries': 1,
+        'stability_steps': 10,
+        'stability_portrait': (1024, 1024),
+        'stability_landscape': (1024, 1024),
+    },
+    'standard': {
+        'hf_models': HF_IMAGE_MODELS,
+        'steps': 25,
+        'portrait': (512, 768),
+        'landscape': (768, 512),
+        'guidance': {'portrait': 8.0, 'landscape': 7.0},
+        'retries': 3,
+        'stability_steps': None,
+        'stability_portrait': (1024, 1024),
+        'stability_landscape': (1024, 1024),
+    },
+    'high': {
+        'hf_models': ["stabilityai/stable-diffusion-xl-base-1.0", "black-forest-labs/FLUX.1-schnell"],
+        'steps': 40,
+        'portrait': (832, 1216),
+        'landscape': (1216, 832),
+        'guidance': {'portrait': 8.0, 'landscape': 7.0},
+        'retries': 3,
+        'stability_steps': 40,
+        'stability_portrait': (832, 1216),
+        'stability_landscape': (1216, 832),
+    },
+}
+# Lowest to highest
+TIER_ORDER = ['draft', 'standard', 'high']
+
+DEFAULT_QUALITY_SETTINGS = {
+    # Tier images are generated at during the request
+    'TIER': 'standard',
+    # Re-render lower-tier images at REFINE_TIER after the response is sent
+    'REFINE': False,
+    'REFINE_TIER': 'high',
+    # Refinements running at once in each process
+    'REFINE_WORKERS': 1,
+}
+
+
+def quality_settings():
+    config = dict(DEFAULT_QUALITY_SETTINGS)
+    config.update(getattr(settings, 'STORY_IMAGE_QUALITY', {}))
+    return config
+
+
+def image_tier(name):
+    """The tier called ``name``; unknown names fall back to 'standard'"""
+    if name not in IMAGE_TIERS:
+        logger.warning(f"Unknown image quality tier {name!r}, using 'standard'")
+        return IMAGE_TIERS['standard']
+    return IMAGE_TIERS[name]
+
+
+def is_below(tier, target):
+    """Whether an image rendered at ``tier`` would improve by re-rendering at ``target``"""
+    if tier not in TIER_ORDER or target not in TIER_ORDER:
+        return False
+    return TIER_ORDER.index(tier) < TIER_ORDER.index(target)
@@ -0,0 +1,159 @@
+"""
+Background refinement of draft images (STORY_IMAGE_QUALITY['REFINE']).
+
+After a story is saved with images below REFINE_TIER, it is marked 'pending' and queued
+on a small in-process thread pool. The refinement re-renders those images at REFINE_TIER
+from their stored prompts, recomposes the scene and updates the same StoryGeneration
+row, then drops its cached fragments. The detail page's ETag and cache key include
+refined_at, so browsers and the fragment cache pick up the new images.
+
+A library character's portrait (series mode) is never re-rendered, so it stays the same
+in every story; only the background is refined and recomposed with it.
+
+A refinement queued in a process that exits is lost; ``manage.py refine_images`` picks
+up stories still marked 'pending'.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.db import close_old_connections
+from django.utils import timezone
+import logging
+import threading
+import time
+
+from .cache import invalidate_story
+from .metrics import IMAGE_REFINEMENTS, IMAGE_REFINEMENT_SECONDS
+from .models import StoryGeneration
+from .quality import TIER_ORDER, is_below, quality_settings
+from .services import StoryGeneratorService
+
+logger = logging.getLogger(__name__)
+
+IMAGE_KINDS = ('character', 'background')
+
+_executor = None
+_executor_lock = threading.Lock()
+_local = threading.local()
+
+
+def _refinable_kinds(story):
+    return ('background',) if story.character_id else IMAGE_KINDS
+
+
+def needs_refinement(story, config=None):
+    config = config or quality_settings()
+    if not config['REFINE']:
+        return False
+    return any(
+        is_below(getattr(story, f'{kind}_image_tier'), config['REFINE_TIER']) for kind in _refinable_kinds(story)
+    )
+
+
+def _service():
+    # One service per refinement thread: building one loads the Whisper model
+    if not hasattr(_local, 'service'):
+        _local.service = StoryGeneratorService()
+    return _local.service
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=quality_settings()['REFINE_WORKERS'], thread_name_prefix='image-refine'
+            )
+        return _executor
+
+
+def schedule_refinement(story):
+    """Mark ``story`` pending and queue its refinement, if enabled and any image is below REFINE_TIER"""
+    config = quality_settings()
+    if not needs_refinement(story, config):
+        return False
+    story.refinement_status = 'pending'
+    StoryGeneration.objects.filter(id=story.id).update(refinement_status='pending')
+    queue_refinement(story.id)
+    return True
+
+
+def queue_refinement(story_id):
+    """Queue the refinement of a story already saved as 'pending'; returns its future"""
+    return _get_executor().submit(_run_refinement, story_id)
+
+
+def _run_refinement(story_id):
+    try:
+        refine_story(story_id)
+    except Exception as e:
+        logger.error(f"Refinement of story {story_id} failed: {e!r}")
+    finally:
+        # Executor threads outlive requests, so nothing else closes their connection
+        close_old_connections()
+
+
+def refine_story(story_id, tier=None):
+    """Re-render the story's images below ``tier`` (default REFINE_TIER) and store them on the same row"""
+    story = StoryGeneration.objects.filter(id=story_id).first()
+    if story is None:
+        return None
+    target = tier or quality_settings()['REFINE_TIER']
+    started = time.monotonic()
+
+    service = _service()
+    service.image_tier = target
+    updates = {}
+    images, tiers = {}, {}
+    try:
+        for kind in IMAGE_KINDS:
+            images[kind] = getattr(story, f'{kind}_image_data')
+            tiers[kind] = getattr(story, f'{kind}_image_tier')
+            prompt = getattr(story, f'{kind}_image_prompt')
+            if not (prompt and is_below(tiers[kind], target)) or kind not in _refinable_kinds(story):
+                continue
+            result = service.render_image(prompt, kind, story.genre)
+            if not result.get('success'):
+                logger.warning(f"Story {story_id}: {kind} image not refined ({result.get('model_used')})")
+                continue
+            images[kind], tiers[kind] = result['image_data'], result['tier']
+            updates.update({
+                f'{kind}_image_data': result['image_data'],
+                f'{kind}_image_model': result['model_used'],
+                f'{kind}_image_tier': result['tier'],
+            })
+
+        # Placeholders have no tier and are never composed
+        if updates and all(images.values()) and all(tiers.values()):
+            scene = service.combine_images_into_scene(
+                images['character'], images['background'],
+                story.character_description, story.background_description, story.genre
+            )
+            if scene.get('success'):
+                updates.update({
+                    'combined_scene_data': scene['image_data'],
+                    'combined_scene_prompt': scene['prompt'],
+                    'combined_scene_model': scene['model_used'],
+                    'combination_info': scene['composition_info'],
+                    # A scene is only as good as its weaker layer
+                    'combined_scene_tier': min(tiers.values(), key=TIER_ORDER.index),
+                })
+    except Exception:
+        _finish(story, {}, 'failed', started)
+        raise
+
+    _finish(story, updates, 'done' if updates else 'failed', started)
+    return updates
+
+
+def _finish(story, updates, status, started):
+    if updates:
+        StoryGeneration.objects.filter(id=story.id).update(
+            refinement_status=status, refined_at=timezone.now(), **updates
+        )
+        invalidate_story(story)
+    else:
+        # Nothing changed on the page, so its ETag and cached fragments stay valid
+        StoryGeneration.objects.filter(id=story.id).update(refinement_status=status)
+    outcome = 'refined' if updates else 'failed'
+    IMAGE_REFINEMENTS.inc(outcome=outcome)
+    IMAGE_REFINEMENT_SECONDS.observe(time.monotonic() - started)
+    logger.info(f"Story {story.id} refinement {outcome}: {', '.join(updates) or 'no images replaced'}")
@@ -0,0 +1,214 @@
+"""
+Multi-scene illustrated stories (STORY_SCENES).
+
+With COUNT > 0, the generated story is split into COUNT key scenes after the usual
+images are made. Each scene is a contiguous stretch of the story with about the same
+number of words. Its key moment is the sentence naming the most setting terms. Each
+scene gets its own background image, built from that moment and the genre's visual
+style. The compositor then places the story's character portrait on it, so the
+protagonist looks the same in every scene.
+
+The scene backgrounds are the remote calls. Each story runs at most CONCURRENCY of them
+at once. Every story also draws from one provider token bucket
+(PROVIDER_RATE_PER_MINUTE), shared through the cache like the admission buckets, so
+several multi-scene stories don't flood the image API together.
+"""
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+import asyncio
+import contextvars
+import logging
+import re
+import time
+
+from .admission import take_tokens
+from .deadline import budget_fallback, can_afford, deadline_settings
+from .metrics import SCENE_IMAGES, SCENE_RATE_WAIT_SECONDS
+from .speculative import GENRE_SETTINGS, setting_terms
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCENE_SETTINGS = {
+    # Scenes per story; 0 keeps the single combined scene
+    'COUNT': 0,
+    'MAX_COUNT': 6,
+    # Scene backgrounds rendered at once for one story
+    'CONCURRENCY': 2,
+    # Scene background renders per minute across all stories (0 = unlimited)
+    'PROVIDER_RATE_PER_MINUTE': 30,
+    'PROVIDER_BURST': 4,
+}
+
+PROVIDER_BUCKET = 'image_provider'
+SENTENCE_RE = re.compile(r'(?<=[.!?])\s+')
+MOMENT_WORDS = 25
+
+
+def scene_settings():
+    config = dict(DEFAULT_SCENE_SETTINGS)
+    config.update(getattr(settings, 'STORY_SCENES', {}))
+    return config
+
+
+def split_scenes(story_text, count):
+    """Up to ``count`` scenes of about equal length, in story order, each with its key moment"""
+    sentences = [sentence.strip() for sentence in SENTENCE_RE.split((story_text or '').strip()) if sentence.strip()]
+    if not sentences or count < 1:
+        return []
+    count = min(count, len(sentences))
+    total_words = sum(len(sentence.split()) for sentence in sentences)
+
+    groups, current, words_seen = [], [], 0
+    for index, sentence in enumerate(sentences):
+        current.append(sentence)
+        words_seen += len(sentence.split())
+        sentences_left = len(sentences) - index - 1
+        groups_left = count - len(groups) - 1
+        # Close the group at its share of the words, keeping a sentence for every later group
+        if groups_left and (words_seen >= total_words * (len(groups) + 1) / count or sentences_left == groups_left):
+            groups.append(current)
+            current = []
+    if current:
+        groups.append(current)
+
+    scenes = []
+    for order, group in enumerate(groups):
+        moment = max(group, key=lambda sentence: len(setting_terms(sentence)))
+        scenes.append({
+            'order': order,
+            'text': ' '.join(group),
+            'moment': ' '.join(moment.split()[:MOMENT_WORDS]),
+            'setting': list(dict.fromkeys(setting_terms(' '.join(group))))[:3],
+        })
+    return scenes
+
+
+def scene_image_prompt(service, scene, background_description, visual_style, genre):
+    """Background prompt for one scene: where it happens (falling back to the story's setting) and its moment"""
+    setting = scene['setting'] or list(dict.fromkeys(setting_terms(background_description)))[:3]
+    place = ', '.join(setting) if setting else GENRE_SETTINGS.get(genre, 'landscape')
+    image_prompt = service._finish_background_prompt(f"{place}, {scene['moment']}", visual_style)
+    return service._background_full_prompt(image_prompt)
+
+
+def wait_for_provider(config):
+    """Block until the shared provider bucket has a token; False if the request budget can't cover the wait"""
+    if config['PROVIDER_RATE_PER_MINUTE'] <= 0:
+        return True
+    bucket = {'RATE_PER_MINUTE': config['PROVIDER_RATE_PER_MINUTE'], 'BURST': config['PROVIDER_BURST']}
+    started = time.monotonic()
+    while True:
+        wait = take_tokens(PROVIDER_BUCKET, 1, bucket)
+        if not wait:
+            SCENE_RATE_WAIT_SECONDS.observe(time.monotonic() - started)
+            return True
+        if not can_afford(wait + deadline_settings()['MIN_IMAGE_CALL']):
+            return False
+        time.sleep(wait)
+
+
+async def await_provider(config):
+    """wait_for_provider for async renders; the bucket is read off the event loop"""
+    if config['PROVIDER_RATE_PER_MINUTE'] <= 0:
+        return True
+    bucket = {'RATE_PER_MINUTE': config['PROVIDER_RATE_PER_MINUTE'], 'BURST': config['PROVIDER_BURST']}
+    started = time.monotonic()
+    while True:
+        wait = await sync_to_async(take_tokens)(PROVIDER_BUCKET, 1, bucket)
+        if not wait:
+            SCENE_RATE_WAIT_SECONDS.observe(time.monotonic() - started)
+            return True
+        if not can_afford(wait + deadline_settings()['MIN_IMAGE_CALL']):
+            return False
+        await asyncio.sleep(wait)
+
+
+def _scene_result(scene, image_prompt, background, composite=None):
+    result = {
+        'order': scene['order'],
+        'text': scene['text'],
+        'image_prompt': image_prompt,
+        'background_model': background.get('model_used'),
+        'tier': background.get('tier'),
+        'image_data': None,
+        'model_used': None,
+        'composition_info': None,
+        'success': False,
+    }
+    if composite and composite.get('success'):
+        result.update({
+            'image_data': composite['image_data'],
+            'model_used': composite['model_used'],
+            'composition_info': composite.get('composition_info'),
+            'success': True,
+        })
+    SCENE_IMAGES.inc(outcome='success' if result['success'] else 'failed')
+    return result
+
+
+def _plan(story_package):
+    """(config, scenes) when multi-scene mode applies to this story, else (config, [])"""
+    config = scene_settings()
+    count = min(config['COUNT'], config['MAX_COUNT'])
+    character = story_package.get('character_image') or {}
+    if count < 1 or not character.get('success'):
+        # Every scene reuses the portrait, so there is nothing to compose without one
+        return config, []
+    return config, split_scenes(story_package.get('story'), count)
+
+
+def generate_scenes(service, story_package, genre, visual_style):
+    """Scene images for a story package whose character image succeeded; [] when the mode is off"""
+    config, scenes = _plan(story_package)
+    if not scenes:
+        return []
+    character_b64 = story_package['character_image']['image_data']
+
+    def render(scene):
+        image_prompt = scene_image_prompt(
+            service, scene, story_package['background_description'], visual_style, genre
+        )
+        if not wait_for_provider(config):
+            budget_fallback('image.scene')
+            return _scene_result(scene, image_prompt, {})
+        background = service.render_image(image_prompt, 'background', genre)
+        if not background.get('success'):
+            return _scene_result(scene, image_prompt, background)
+        composite = service.combine_images_into_scene(
+            character_b64, background['image_data'], story_package['character_description'], scene['text'], genre
+        )
+        return _scene_result(scene, image_prompt, background, composite)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(config['CONCURRENCY'], len(scenes))),
+                            thread_name_prefix='story-scene') as executor:
+        # Each scene gets its own copy of the request context (stage log, deadline)
+        futures = [executor.submit(contextvars.copy_context().run, render, scene) for scene in scenes]
+        return [future.result() for future in futures]
+
+
+async def agenerate_scenes(service, story_package, genre, visual_style):
+    """generate_scenes for the async service, with a semaphore in place of the thread pool"""
+    config, scenes = _plan(story_package)
+    if not scenes:
+        return []
+    character_b64 = story_package['character_image']['image_data']
+    semaphore = asyncio.Semaphore(max(1, config['CONCURRENCY']))
+
+    async def render(scene):
+        image_prompt = scene_image_prompt(
+            service, scene, story_package['background_description'], visual_style, genre
+        )
+        async with semaphore:
+            if not await await_provider(config):
+                budget_fallback('image.scene')
+                return _scene_result(scene, image_prompt, {})
+            background = await service.arender_image(image_prompt, 'background', genre)
+        if not background.get('success'):
+            return _scene_result(scene, image_prompt, background)
+        composite = await service.acombine_images_into_scene(
+            character_b64, background['image_data'], story_package['character_description'], scene['text'], genre
+        )
+        return _scene_result(scene, image_prompt, background, composite)
+
+    return list(await asyncio.gather(*(render(scene) for scene in scenes)))
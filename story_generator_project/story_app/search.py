@@ -0,0 +1,144 @@
+from django.db import connection as default_connection
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+import logging
+import re
+from .models import StoryGeneration
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'story_app_storysearch'
+STORY_TABLE = 'story_app_storygeneration'
+
+# Indexed columns, in FTS column order, with their bm25 weights
+SEARCH_COLUMNS = [
+    ('prompt', 3.0),
+    ('audio_transcription', 3.0),
+    ('generated_story', 1.0),
+    ('character_description', 0.5),
+    ('background_description', 0.5),
+]
+
+# Control characters used as snippet markers so the text can be escaped before highlighting
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+_fts5_available = {}
+
+
+def fts5_available(connection=default_connection):
+    """True when the database is SQLite compiled with FTS5"""
+    if connection.vendor != 'sqlite':
+        return False
+    alias = connection.alias
+    if alias not in _fts5_available:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+                compiled = bool(cursor.fetchone()[0])
+                if not compiled:
+                    # Some builds load FTS5 without advertising the compile option
+                    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.story_fts5_probe USING fts5(x)")
+                    cursor.execute("DROP TABLE IF EXISTS temp.story_fts5_probe")
+                    compiled = True
+            _fts5_available[alias] = compiled
+        except Exception as e:
+            logger.warning(f"FTS5 not available, story search falls back to LIKE: {e}")
+            _fts5_available[alias] = False
+    return _fts5_available[alias]
+
+
+def search_index_exists(connection=default_connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def rebuild_search_index(connection=default_connection):
+    """
+    Re-index every story from the story table. Migration 0006 creates the FTS5 table and
+    the triggers that keep it in sync; a rebuild repairs drift, e.g. after rows were
+    written with the triggers missing. Returns False when there is no index to rebuild.
+    """
+    if not (fts5_available(connection) and search_index_exists(connection)):
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+def build_match_query(text):
+    """
+    Turn free text into a safe FTS5 query: every word is quoted (so FTS syntax
+    in user input is inert) and the last word matches as a prefix.
+    """
+    tokens = TOKEN_RE.findall(text or '')
+    if not tokens:
+        return None
+    quoted = [f'"{token}"' for token in tokens]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _highlight(snippet):
+    """Escape snippet text, then turn the markers into <mark> tags"""
+    html = escape(snippet).replace(MARK_START, '<mark>').replace(MARK_END, '</mark>')
+    return mark_safe(html)
+
+
+def search_story_ids(text, limit=20, offset=0, connection=default_connection):
+    """
+    Ranked FTS5 search.
+    Returns a list of (story_id, rank, snippet_html); best matches first.
+    """
+    match = build_match_query(text)
+    if not match:
+        return []
+
+    weights = ', '.join(str(weight) for _, weight in SEARCH_COLUMNS)
+    sql = f"""
+        SELECT rowid, bm25({FTS_TABLE}, {weights}) AS rank,
+               snippet({FTS_TABLE}, -1, %s, %s, '…', 16)
+        FROM {FTS_TABLE}
+        WHERE {FTS_TABLE} MATCH %s
+        ORDER BY rank
+        LIMIT %s OFFSET %s
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [MARK_START, MARK_END, match, limit, offset])
+        rows = cursor.fetchall()
+
+    return [(story_id, rank, _highlight(snippet)) for story_id, rank, snippet in rows]
+
+
+def search_stories(text, limit=20, offset=0):
+    """
+    Search stories and return a list of (story, snippet_html) in rank order.
+    Uses FTS5 when available and falls back to icontains filters otherwise.
+    """
+    if fts5_available() and search_index_exists():
+        hits = search_story_ids(text, limit=limit, offset=offset)
+        stories = StoryGeneration.objects.for_listing().in_bulk([story_id for story_id, _, _ in hits])
+        return [(stories[story_id], snippet) for story_id, _, snippet in hits if story_id in stories]
+
+    stories = StoryGeneration.objects.for_listing().filter(like_search_filter(text))[offset:offset + limit]
+    return [(story, None) for story in stories]
+
+
+def like_search_filter(text):
+    """The pre-FTS search: every word must appear in one of the text columns"""
+    condition = Q()
+    for token in TOKEN_RE.findall(text or ''):
+        token_condition = Q()
+        for column, _ in SEARCH_COLUMNS:
+            token_condition |= Q(**{f'{column}__icontains': token})
+        condition &= token_condition
+    return condition
+
+
+def matching_ids_sql(text):
+    """SQL fragment and params selecting the ids of stories matching ``text``"""
+    return f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [build_match_query(text)]
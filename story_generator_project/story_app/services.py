@@ -1,6 +1,6 @@
-from langchain_ollama import OllamaLLM
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from django.conf import settings
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from dotenv import load_dotenv
@@ -9,33 +9,176 @@ import re
 import requests
 import base64
 from io import BytesIO
-from PIL import Image, ImageFilter, ImageEnhance, ImageDraw
-import cv2
-import numpy as np
+from PIL import Image
 import time
 import os
-from rembg import remove
 import whisper
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 from pydub import AudioSegment
+from .characters import apply_character, series_prompt
+from .compositor_pool import composite_scene
+from .deadline import PLACEHOLDER_MODEL, budget_fallback, can_afford, deadline_settings, fit_timeout, remaining
+from .inference import SidecarWhisperModel, get_inference_client
+from .llm import build_llm, ollama_settings, story_num_predict
+from .metrics import IMAGE_ATTEMPTS, IMAGE_FALLBACKS, STORY_PARSE, timed_stage
+from .quality import image_tier, quality_settings
+from .scenes import generate_scenes
+from .speculative import start_speculative_background
 
 logger = logging.getLogger(__name__)
 load_dotenv()
 
+LENGTH_INSTRUCTIONS = {
+    'short': 'Write a complete short story of 200-300 words with clear beginning, middle, and end.',
+    'medium': 'Write a complete medium-length story of 300-500 words with developed plot and character arc.',
+    'long': 'Write a complete longer story of 500-750 words with rich detail and compelling narrative.'
+}
+
+STORY_TEMPLATE = PromptTemplate(
+    input_variables=["prompt", "genre", "length_instruction"],
+    template="""
+    You are a professional storyteller and world-builder. Create a complete story package with three DISTINCT sections:
+
+    STORY REQUIREMENTS:
+    {length_instruction}
+    Genre: {genre}
+    User Prompt: {prompt}
+
+    SECTION 1: **[STORY]**
+    Write a complete, engaging story based on the prompt above. Focus ONLY on the narrative:
+    - Clear beginning, middle, and end
+    - Vivid storytelling with natural dialogue
+    - Immersive scenes and plot development
+    - DO NOT include character descriptions or world-building details here
+    - Focus purely on the story events and narrative flow
+
+    SECTION 2: **[CHARACTER]**
+    Create a detailed character profile for the main protagonist (150-200 words):
+    - PHYSICAL: Age, height, build, hair color/style, eye color, facial features, clothing style
+    - PERSONALITY: Core traits, strengths, flaws, mannerisms, speaking style
+    - BACKGROUND: Family history, education, past experiences, formative events
+    - MOTIVATION: Primary goals, fears, desires, what drives them
+    - SKILLS: Talents, abilities, expertise, weaknesses
+    - Keep this SEPARATE from the story - focus only on character details
+
+    SECTION 3: **[BACKGROUND]**
+    Develop the world and setting (180-220 words):
+    - PHYSICAL SETTING: Geography, climate, architecture, landscapes
+    - TIME/ERA: Historical period, technology level, cultural context
+    - SOCIETY: Social structure, customs, languages, beliefs, politics
+    - ATMOSPHERE: Mood, tone, environmental details, ambiance
+    - UNIQUE ELEMENTS: Special features, magic systems, technologies, mysteries
+    - Keep this SEPARATE from both story and character - focus only on world details
+
+    FORMATTING RULES:
+    - Use EXACTLY these headers: **[STORY]**, **[CHARACTER]**, **[BACKGROUND]**
+    - Keep each section completely distinct and focused
+    - Ensure all sections are consistent within the same fictional universe
+    - Write in a {genre} style throughout all sections
+    """
+)
+
+# Extra sections for IMAGE_PROMPT_MODE='folded': the story call also writes both image
+# prompts, replacing the two extraction calls
+IMAGE_PROMPT_SECTIONS = """
+    SECTION 4: **[CHARACTER_PROMPT]**
+    One line: a comma-separated portrait prompt for the protagonist, under 150 characters.
+    Only age, build, hair, eye color, clothing and distinctive marks, e.g.
+    portrait of [age] [build] [gender], [hair details], [eye color], [clothing style]
+
+    SECTION 5: **[BACKGROUND_PROMPT]**
+    One line: a comma-separated environment prompt for the setting, under 150 characters, no people, e.g.
+    [environment type], [architectural style], [lighting/time], [weather/atmosphere], landscape
+
+"""
+FOLDED_STORY_TEMPLATE = PromptTemplate(
+    input_variables=STORY_TEMPLATE.input_variables,
+    template=STORY_TEMPLATE.template.replace(
+        "    FORMATTING RULES:", IMAGE_PROMPT_SECTIONS + "    FORMATTING RULES:"
+    ).replace(
+        "**[STORY]**, **[CHARACTER]**, **[BACKGROUND]**",
+        "**[STORY]**, **[CHARACTER]**, **[BACKGROUND]**, **[CHARACTER_PROMPT]**, **[BACKGROUND_PROMPT]**"
+    )
+)
+IMAGE_PROMPT_MODES = ('sequential', 'concurrent', 'folded')
+
+# Seconds to wait before retrying a Hugging Face model that is loading / after a timeout
+HF_LOADING_BACKOFF = 15
+HF_TIMEOUT_BACKOFF = 8
+
+CHARACTER_IMAGE_PROMPT_TEMPLATE = PromptTemplate(
+    input_variables=["character_description", "visual_style", "genre"],
+    template="""
+    Extract ONLY the visual/physical details from this character description:
+    {character_description}
+
+    Create a focused image prompt for a {genre} character portrait with these requirements:
+    
+    EXTRACT ONLY:
+    - Age and physical build
+    - Hair color, style, and length
+    - Eye color and facial features
+    - Clothing and accessories
+    - Any distinctive physical marks or features
+    
+    IGNORE:
+    - Personality traits
+    - Background history
+    - Skills and abilities
+    - Motivations and goals
+    - Story context
+    
+    FORMAT: Create a single comma-separated prompt under 150 characters:
+    "portrait of [age] [build] [gender], [hair details], [eye color], [clothing style], {visual_style}, high quality, detailed"
+    
+    Visual Image Prompt:
+    """
+)
+
+BACKGROUND_IMAGE_PROMPT_TEMPLATE = PromptTemplate(
+    input_variables=["background_description", "visual_style", "genre"],
+    template="""
+    Extract ONLY the visual/environmental details from this background description:
+    {background_description}
+
+    Create a focused environment image prompt for a {genre} setting with these requirements:
+    
+    EXTRACT ONLY:
+    - Geographic features (mountains, forests, cities, etc.)
+    - Architecture and structures
+    - Climate and weather
+    - Time of day/lighting
+    - Physical atmosphere and mood
+    - Landscape elements
+    
+    IGNORE:
+    - Characters or people
+    - Story events
+    - Social/political details
+    - Historical context
+    - Cultural information
+    
+    FORMAT: Create a single comma-separated prompt under 150 characters:
+    "[environment type], [architectural style], [lighting/time], [weather/atmosphere], {visual_style}, no people, landscape"
+    
+    Environment Image Prompt:
+    """
+)
+
+
 class StoryGeneratorService:
     def __init__(self):
         try:
-            self.llm = OllamaLLM(model="gemma:2b")
+            self.llm = build_llm()
         except Exception as e:
             logger.error(f"Failed to initialize Ollama: {e}")
             self.llm = None
-        
-        self.hf_image_models = [
-            "black-forest-labs/FLUX.1-schnell",
-            "stabilityai/stable-diffusion-xl-base-1.0",
-            "runwayml/stable-diffusion-v1-5",
-            "CompVis/stable-diffusion-v1-4"
-        ]
+        self._capped_llms = {}
+        self.image_prompt_mode = getattr(settings, 'IMAGE_PROMPT_MODE', 'sequential')
+        # Quality tier the images are generated at (see quality.py)
+        self.image_tier = quality_settings()['TIER']
         
         hf_token = os.getenv('HUGGINGFACE_TOKEN', 'abc')
         self.hf_headers = {
@@ -44,21 +187,28 @@ class StoryGeneratorService:
 
         self.stability_api_key = os.getenv('STABILITY_API_KEY', '')
         self.stability_headers = {
-            "Authorization": f"Bearer {self.stability_api_key}",
             "Accept": "application/json",
             "Content-Type": "application/json"
         }
+        # httpx (the async service) rejects a bare "Bearer " header
+        if self.stability_api_key:
+            self.stability_headers["Authorization"] = f"Bearer {self.stability_api_key}"
         self.stability_url_map = {
-            "portrait": "https://api.stability.ai/v1/generation/stable-diffusion-xl-1024-v1-0/text-to-image",
-            "landscape": "https://api.stability.ai/v1/generation/stable-diffusion-xl-1024-v1-0/text-to-image"
+            "portrait": f"{settings.STABILITY_API_URL}/v1/generation/stable-diffusion-xl-1024-v1-0/text-to-image",
+            "landscape": f"{settings.STABILITY_API_URL}/v1/generation/stable-diffusion-xl-1024-v1-0/text-to-image"
         }
 
-        try:
-            self.whisper_model = whisper.load_model("base") 
-            logger.info("Whisper model loaded successfully")
-        except Exception as e:
-            logger.error(f"Failed to load Whisper model: {e}")
-            self.whisper_model = None
+        inference_client = get_inference_client()
+        if inference_client is not None:
+            # The sidecar owns the model; transcription requests go over its socket
+            self.whisper_model = SidecarWhisperModel(inference_client)
+        else:
+            try:
+                self.whisper_model = whisper.load_model("base") 
+                logger.info("Whisper model loaded successfully")
+            except Exception as e:
+                logger.error(f"Failed to load Whisper model: {e}")
+                self.whisper_model = None
     
     def transcribe_audio(self, audio_file):
         """
@@ -85,13 +235,14 @@ class StoryGeneratorService:
             
             try:
                 try:
-                    audio = AudioSegment.from_file(temp_file_path)
-                    duration = len(audio) / 1000.0
-                    
-                    if not temp_file_path.endswith('.wav'):
-                        wav_path = temp_file_path.replace(temp_file_path.split('.')[-1], 'wav')
-                        audio.export(wav_path, format="wav")
-                        temp_file_path = wav_path
+                    with timed_stage('audio.decode'):
+                        audio = AudioSegment.from_file(temp_file_path)
+                        duration = len(audio) / 1000.0
+                        
+                        if not temp_file_path.endswith('.wav'):
+                            wav_path = temp_file_path.replace(temp_file_path.split('.')[-1], 'wav')
+                            audio.export(wav_path, format="wav")
+                            temp_file_path = wav_path
                     
                 except Exception as e:
                     logger.warning(f"Audio conversion failed, trying direct transcription: {e}")
@@ -99,7 +250,8 @@ class StoryGeneratorService:
                 
                 # Transcribe using Whisper
                 logger.info(f"Transcribing audio file: {temp_file_path}")
-                result = self.whisper_model.transcribe(temp_file_path)
+                with timed_stage('audio.transcribe', duration_s=round(duration, 1)):
+                    result = self.whisper_model.transcribe(temp_file_path)
                 transcription = result["text"].strip()
                 
                 logger.info(f"Audio transcription successful: {transcription[:100]}...")
@@ -128,7 +280,7 @@ class StoryGeneratorService:
                 'success': False,
                 'error': str(e)
             }
-    def generate_story_from_audio(self, audio_file, length='medium', genre='fantasy'):
+    def generate_story_from_audio(self, audio_file, length='medium', genre='fantasy', character=None):
         """
         Complete pipeline: transcribe audio -> generate story with images
         """
@@ -136,114 +288,117 @@ class StoryGeneratorService:
             # Step 1: Transcribe audio
             logger.info("Starting audio transcription...")
             transcription_result = self.transcribe_audio(audio_file)
-            
-            if not transcription_result['success']:
-                return {
-                    'success': False,
-                    'error': transcription_result.get('error', 'Audio transcription failed'),
-                    'transcription_result': transcription_result
-                }
-            
-            transcription = transcription_result['transcription']
-            
-            if not transcription or len(transcription.strip()) < 10:
-                return {
-                    'success': False,
-                    'error': 'Audio transcription too short or empty',
-                    'transcription_result': transcription_result
-                }
-            
-            logger.info(f"Audio transcribed successfully: {len(transcription)} characters")
+            error = self._transcription_error(transcription_result)
+            if error:
+                return error
             
             # Step 2: Generate story using transcription as prompt
             logger.info("Generating story from transcription...")
             story_package = self.generate_complete_story_with_images(
-                prompt=transcription,
+                prompt=transcription_result['transcription'],
                 length=length,
-                genre=genre
+                genre=genre,
+                character=character
             )
             
             # Add transcription metadata to the package
-            story_package.update({
-                'transcription_result': transcription_result,
-                'audio_transcription': transcription,
-                'audio_duration': transcription_result['duration'],
-                'input_type': 'audio',
-                'success': True
-            })
-            
+            story_package.update(self._audio_story_metadata(transcription_result))
             return story_package
             
         except Exception as e:
             logger.error(f"Error in audio story generation pipeline: {e}")
-            return {
-                'success': False,
-                'error': str(e),
-                'transcription_result': None
-            }
+            return self._input_error(str(e))
     
-    def generate_story_from_mixed_input(self, text_prompt=None, audio_file=None, length='medium', genre='fantasy'):
+    def generate_story_from_mixed_input(self, text_prompt=None, audio_file=None, length='medium', genre='fantasy',
+                                        character=None):
         """
         Generate story from both text and audio inputs
         """
+        transcription_result = None
         try:
-            combined_prompt_parts = []
-            transcription_result = None
-            audio_duration = 0
-            
-            if text_prompt and text_prompt.strip():
-                combined_prompt_parts.append(f"Text prompt: {text_prompt}")
-            
             if audio_file:
                 logger.info("Transcribing audio for mixed input...")
                 transcription_result = self.transcribe_audio(audio_file)
-                
-                if transcription_result['success']:
-                    audio_duration = transcription_result['duration']
-                    combined_prompt_parts.append(f"Audio description: {transcription_result['transcription']}")
-                else:
-                    logger.warning(f"Audio transcription failed: {transcription_result.get('error')}")
-            
-            if not combined_prompt_parts:
-                return {
-                    'success': False,
-                    'error': 'No valid input provided (text or audio)',
-                    'transcription_result': transcription_result
-                }
             
             # Combine all inputs into a single prompt
-            combined_prompt = " | ".join(combined_prompt_parts)
+            combined_prompt = self._mixed_prompt(text_prompt, transcription_result)
+            if not combined_prompt:
+                return self._input_error('No valid input provided (text or audio)', transcription_result)
             
             # Generate story using combined prompt
             logger.info("Generating story from mixed input...")
             story_package = self.generate_complete_story_with_images(
                 prompt=combined_prompt,
                 length=length,
-                genre=genre
+                genre=genre,
+                character=character
             )
             
             # Add metadata
-            story_package.update({
-                'transcription_result': transcription_result,
-                'audio_transcription': transcription_result['transcription'] if transcription_result and transcription_result['success'] else None,
-                'audio_duration': audio_duration,
-                'input_type': 'both',
-                'combined_prompt': combined_prompt,
-                'success': True
-            })
-            
+            story_package.update(self._mixed_story_metadata(transcription_result, combined_prompt))
             return story_package
             
         except Exception as e:
             logger.error(f"Error in mixed input story generation: {e}")
-            return {
-                'success': False,
-                'error': str(e),
-                'transcription_result': transcription_result
-            }
+            return self._input_error(str(e), transcription_result)
+
+    # Input handling shared with the async service: everything but the transcription call
+
+    def _input_error(self, error, transcription_result=None):
+        return {
+            'success': False,
+            'error': error,
+            'transcription_result': transcription_result
+        }
+
+    def _transcription_error(self, transcription_result):
+        """Failure result when a transcription can't serve as the story prompt, else None"""
+        if not transcription_result['success']:
+            return self._input_error(transcription_result.get('error', 'Audio transcription failed'), transcription_result)
+        transcription = transcription_result['transcription']
+        if not transcription or len(transcription.strip()) < 10:
+            return self._input_error('Audio transcription too short or empty', transcription_result)
+        logger.info(f"Audio transcribed successfully: {len(transcription)} characters")
+        return None
+
+    def _audio_story_metadata(self, transcription_result):
+        return {
+            'transcription_result': transcription_result,
+            'audio_transcription': transcription_result['transcription'],
+            'audio_duration': transcription_result['duration'],
+            'input_type': 'audio',
+            'success': True
+        }
+
+    def _mixed_prompt(self, text_prompt, transcription_result):
+        """The text prompt and the transcription joined into one story prompt ('' when both are missing)"""
+        combined_prompt_parts = []
+        if text_prompt and text_prompt.strip():
+            combined_prompt_parts.append(f"Text prompt: {text_prompt}")
+        if transcription_result is not None:
+            if transcription_result['success']:
+                combined_prompt_parts.append(f"Audio description: {transcription_result['transcription']}")
+            else:
+                logger.warning(f"Audio transcription failed: {transcription_result.get('error')}")
+        return " | ".join(combined_prompt_parts)
+
+    def _mixed_story_metadata(self, transcription_result, combined_prompt):
+        transcribed = transcription_result is not None and transcription_result['success']
+        return {
+            'transcription_result': transcription_result,
+            'audio_transcription': transcription_result['transcription'] if transcribed else None,
+            'audio_duration': transcription_result['duration'] if transcribed else 0,
+            'input_type': 'both',
+            'combined_prompt': combined_prompt,
+            'success': True
+        }
 
     def validate_audio_file(self, audio_file):
         """Validate uploaded audio file"""
+        with timed_stage('audio.validate'):
+            return self._validate_audio_file(audio_file)
+    
+    def _validate_audio_file(self, audio_file):
         allowed_formats = ['.mp3', '.wav', '.m4a', '.ogg', '.flac', '.aac']
         max_size = 10 * 1024 * 1024 
         max_duration = 300
@@ -301,664 +456,356 @@ class StoryGeneratorService:
             }
         
 
-    def generate_complete_story_with_images(self, prompt, length='medium', genre='fantasy'):
-        """Generate story, character description, background description, character image, and background image"""
-        
-        # First generate the complete story package
-        story_package = self.generate_complete_story(prompt, length, genre)
-        
+    def generate_complete_story_with_images(self, prompt, length='medium', genre='fantasy', character=None):
+        """
+        Generate story, character description, background description, character image, and background image.
+        With a library ``character`` the story is a sequel about it and its saved portrait is used as is.
+        """
+
         # Extract visual style consistency parameters from genre
         visual_style = self._get_visual_style_for_genre(genre)
 
-        # Generate character and background images separately
-        character_image_result = None
-        background_image_result = None
-        
+        # Speculative mode starts the background image from the user prompt right away
+        speculation = start_speculative_background(self, prompt, genre, visual_style)
+
+        # First generate the complete story package
+        story_package = self.generate_complete_story(self._story_prompt(prompt, character), length, genre)
+        speculative_hit = self._settle_speculation(speculation, story_package)
+
+        # Series mode: no character prompt call or portrait render
+        library_image = apply_character(story_package, character) if character is not None else None
+        character_prompt, background_prompt = self.prepare_image_prompts(
+            story_package, visual_style, genre, skip_background=speculative_hit, skip_character=character is not None
+        )
+
         # Then generate character image based on character description
-        if story_package['character_description']:
-            try:
-                logger.info("Generating character image...")
-                character_image_result = self.generate_character_image(
-                    story_package['character_description'], 
-                    visual_style=visual_style,
-                    genre=genre
-                )
-                story_package['character_image'] = character_image_result
-            except Exception as e:
-                logger.error(f"Failed to generate character image: {e}")
-                story_package['character_image'] = self._generate_placeholder_image("character")
-        else:
-            story_package['character_image'] = self._generate_placeholder_image("character")
-        
+        if library_image is not None:
+            logger.info(f"Using library character {character.name!r}")
+        elif self._has_description(story_package, 'character'):
+            logger.info("Generating character image...")
+            story_package['character_image'] = self.generate_character_image(
+                story_package['character_description'],
+                visual_style=visual_style,
+                genre=genre,
+                image_prompt=character_prompt
+            )
+
         # Generate background image based on background description
-        if story_package['background_description']:
-            try:
+        if self._has_description(story_package, 'background'):
+            background_image_result = speculation.result() if speculative_hit else None
+            if background_image_result is None:
                 logger.info("Generating background image...")
                 background_image_result = self.generate_background_image(
                     story_package['background_description'],
-                    story_package['story'],
                     visual_style=visual_style,
-                    genre=genre
+                    genre=genre,
+                    image_prompt=background_prompt
                 )
-                story_package['background_image'] = background_image_result
-            except Exception as e:
-                logger.error(f"Failed to generate background image: {e}")
-                story_package['background_image'] = self._generate_placeholder_image("background")
-        else:
-            story_package['background_image'] = self._generate_placeholder_image("background")
-        
+            story_package['background_image'] = background_image_result
+
         # Combine character and background into a cohesive scene
-        if (character_image_result and character_image_result.get('success') and 
-            background_image_result and background_image_result.get('success')):
-            try:
-                logger.info("Combining images into cohesive scene...")
-                combined_image_result = self.combine_images_into_scene(
-                    character_image_result['image_data'],
-                    background_image_result['image_data'],
-                    story_package['character_description'],
-                    story_package['background_description'],
-                    genre
-                )
-                story_package['combined_scene'] = combined_image_result
-            except Exception as e:
-                logger.error(f"Failed to combine images: {e}")
-                story_package['combined_scene'] = self._generate_placeholder_image("combined_scene")
-        else:
-            story_package['combined_scene'] = self._generate_placeholder_image("combined_scene")
-        
+        scene_inputs = self._scene_inputs(story_package, genre)
+        if scene_inputs:
+            logger.info("Combining images into cohesive scene...")
+            story_package['combined_scene'] = self.combine_images_into_scene(*scene_inputs)
+
+        # Multi-scene mode: one composed image per key scene, reusing the portrait
+        story_package['scenes'] = generate_scenes(self, story_package, genre, visual_style)
+
         return story_package
-    
+
+    # Story assembly shared with the async service
+
+    def _story_prompt(self, prompt, character):
+        return series_prompt(prompt, character) if character else prompt
+
+    def _settle_speculation(self, speculation, story_package):
+        """Whether the speculative background fits the story; a miss is discarded"""
+        speculative_hit = speculation is not None and speculation.matches(story_package['background_description'])
+        if speculation is not None and not speculative_hit:
+            speculation.discard()
+        return speculative_hit
+
+    def _has_description(self, story_package, kind):
+        """Whether the story described its ``kind`` image; without a description it becomes a placeholder"""
+        if story_package[f'{kind}_description']:
+            return True
+        story_package[f'{kind}_image'] = self._generate_placeholder_image(kind)
+        return False
+
+    def _scene_inputs(self, story_package, genre):
+        """combine_images_into_scene arguments when both images succeeded, else None (with a placeholder scene)"""
+        character_image = story_package.get('character_image') or {}
+        background_image = story_package.get('background_image') or {}
+        if character_image.get('success') and background_image.get('success'):
+            return (
+                character_image['image_data'],
+                background_image['image_data'],
+                story_package['character_description'],
+                story_package['background_description'],
+                genre
+            )
+        story_package['combined_scene'] = self._generate_placeholder_image("combined_scene")
+        return None
+
     def combine_images_into_scene(self, character_b64, background_b64, character_desc, background_desc, genre):
         """
         Combine character and background images into a coherent scene using PIL and OpenCV
         NEW METHOD - Core image combination functionality
         """
+        if not can_afford(deadline_settings()['MIN_COMPOSITE']):
+            budget_fallback('compose')
+            return self._generate_placeholder_image("combined_scene")
         try:
-            # Decode base64 images
-            char_img = self._decode_base64_image(character_b64)
-            bg_img = self._decode_base64_image(background_b64)
-            
-            if char_img is None or bg_img is None:
-                raise ValueError("Failed to decode input images")
-            
-            # Step 1: Analyze and match style/lighting
-            char_img, bg_img = self._match_image_styles(char_img, bg_img, genre)
-            
-            # Step 2: Determine optimal positioning based on descriptions
-            position_info = self._analyze_positioning(character_desc, background_desc)
-            
-            # Step 3: Prepare character (remove background, adjust size)
-            char_img_prepared = self._prepare_character_for_composition(char_img, position_info)
-            
-            # Step 4: Prepare background (adjust for character placement)
-            bg_img_prepared = self._prepare_background_for_composition(bg_img, position_info)
-            
-            # Step 5: Composite the final scene
-            combined_image = self._composite_final_scene(char_img_prepared, bg_img_prepared, position_info)
-            
-            # Step 6: Apply final post-processing
-            final_image = self._apply_scene_post_processing(combined_image, genre)
-            
-            # Convert to base64 for storage
-            combined_b64 = self._encode_image_to_base64(final_image)
-            
+            combined_b64, position_info = composite_scene(
+                character_b64, background_b64, character_desc, background_desc, genre, timeout=remaining()
+            )
+
             return {
                 'image_data': combined_b64,
                 'prompt': f"Combined scene: character in {genre} setting",
                 'model_used': 'PIL+OpenCV_compositor',
                 'success': True,
                 'type': 'combined_scene',
-                'composition_info': position_info
+                'composition_info': position_info,
+                'tier': self.image_tier
             }
-            
-        except Exception as e:
-            logger.error(f"Error combining images: {e}")
-            return self._generate_placeholder_image("combined_scene")
-    
-    def _decode_base64_image(self, base64_str):
-        """Convert base64 string to PIL Image"""
-        try:
-            img_data = base64.b64decode(base64_str)
-            img = Image.open(BytesIO(img_data)).convert('RGBA')
-            return img
-        except Exception as e:
-            logger.error(f"Failed to decode base64 image: {e}")
-            return None
-    
-    def _encode_image_to_base64(self, pil_image):
-        """Convert PIL Image to base64 string"""
-        try:
-            buffered = BytesIO()
-            pil_image.save(buffered, format="PNG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode()
-            return img_base64
-        except Exception as e:
-            logger.error(f"Failed to encode image to base64: {e}")
-            return None
-    
-    def _match_image_styles(self, char_img, bg_img, genre):
-        """
-        Match lighting, color temperature, and contrast between character and background
-        Uses PIL for color/lighting adjustments
-        """
-        try:
-            # Convert to numpy for analysis
-            char_array = np.array(char_img.convert('RGB'))
-            bg_array = np.array(bg_img.convert('RGB'))
-            
-            # Analyze color temperature and lighting
-            char_temp = self._calculate_color_temperature(char_array)
-            bg_temp = self._calculate_color_temperature(bg_array)
-            
-            # Analyze brightness and contrast
-            char_brightness = np.mean(char_array)
-            bg_brightness = np.mean(bg_array)
-            
-            # Adjust character to match background style
-            if abs(char_temp - bg_temp) > 500:  # Significant temperature difference
-                char_img = self._adjust_color_temperature(char_img, bg_temp - char_temp)
-            
-            if abs(char_brightness - bg_brightness) > 20:  # Significant brightness difference
-                brightness_factor = bg_brightness / char_brightness if char_brightness > 0 else 1.0
-                brightness_factor = max(0.5, min(2.0, brightness_factor))  # Limit adjustment
-                enhancer = ImageEnhance.Brightness(char_img)
-                char_img = enhancer.enhance(brightness_factor)
-            
-            # Match contrast levels
-            char_contrast = np.std(char_array)
-            bg_contrast = np.std(bg_array)
-            
-            if char_contrast > 0:
-                contrast_factor = bg_contrast / char_contrast
-                contrast_factor = max(0.7, min(1.5, contrast_factor))
-                enhancer = ImageEnhance.Contrast(char_img)
-                char_img = enhancer.enhance(contrast_factor)
-            
-            return char_img, bg_img
-            
-        except Exception as e:
-            logger.error(f"Error matching image styles: {e}")
-            return char_img, bg_img
-    
-    def _calculate_color_temperature(self, img_array):
-        """Estimate color temperature of an image"""
-        try:
-            r_avg = np.mean(img_array[:, :, 0])
-            g_avg = np.mean(img_array[:, :, 1])
-            b_avg = np.mean(img_array[:, :, 2])
-            
-            # Simple color temperature estimation
-            if b_avg > r_avg:
-                return 6500 + (b_avg - r_avg) * 20
-            else:
-                return 3200 + (r_avg - b_avg) * 20
-        except:
-            return 5500
-    
-    def _adjust_color_temperature(self, img, temp_shift):
-        """Adjust color temperature of an image"""
-        try:
-            img_array = np.array(img, dtype=np.float32)
-            
-            if temp_shift > 0:
-                img_array[:, :, 2] *= (1 + temp_shift / 10000)
-                img_array[:, :, 0] *= (1 - temp_shift / 20000)
-            else: 
-                img_array[:, :, 0] *= (1 - temp_shift / 10000)
-                img_array[:, :, 2] *= (1 + temp_shift / 20000)
-            
-            img_array = np.clip(img_array, 0, 255).astype(np.uint8)
-            return Image.fromarray(img_array, mode=img.mode)
-        except Exception as e:
-            logger.error(f"Error adjusting color temperature: {e}")
-            return img
-    
-    def _analyze_positioning(self, character_desc, background_desc):
-        """
-        Analyze character and background descriptions to determine optimal positioning
-        Returns positioning and sizing information
-        """
-        position_info = {
-            'char_position': 'center',
-            'char_size_factor': 0.6,
-            'char_vertical_pos': 0.7,
-            'depth_layer': 'foreground',
-            'interaction_type': 'standing'
-        }
-        
-        try:
-            # Analyze character description for positioning clues
-            char_lower = character_desc.lower()
-            bg_lower = background_desc.lower()
-            
-            # Determine horizontal position
-            if any(word in char_lower for word in ['left', 'side', 'corner']):
-                position_info['char_position'] = 'left'
-            elif any(word in char_lower for word in ['right', 'side', 'corner']):
-                position_info['char_position'] = 'right'
-            
-            # Determine size based on environment scale
-            if any(word in bg_lower for word in ['vast', 'enormous', 'massive', 'grand', 'towering']):
-                position_info['char_size_factor'] = 0.4
-            elif any(word in bg_lower for word in ['intimate', 'small', 'cozy', 'narrow']):
-                position_info['char_size_factor'] = 0.8
-            
-            # Determine vertical position
-            if any(word in char_lower for word in ['flying', 'floating', 'hovering']):
-                position_info['char_vertical_pos'] = 0.3
-            elif any(word in char_lower for word in ['sitting', 'crouching', 'kneeling']):
-                position_info['char_vertical_pos'] = 0.9
-            
-            # Determine interaction type
-            if any(word in char_lower for word in ['running', 'jumping', 'fighting', 'dancing']):
-                position_info['interaction_type'] = 'action'
-            elif any(word in char_lower for word in ['sitting', 'resting', 'reading']):
-                position_info['interaction_type'] = 'sitting'
-            
-        except Exception as e:
-            logger.error(f"Error analyzing positioning: {e}")
-        
-        return position_info
-    
-    def _prepare_character_for_composition(self, char_img, position_info):
-        """
-        Prepare character image for composition (background removal, resizing, etc.)
-        Uses OpenCV for advanced processing
-        """
-        try:
-            # Resize character based on position info
-            target_size = int(min(char_img.size) * position_info['char_size_factor'])
-            aspect_ratio = char_img.size[0] / char_img.size[1]
-
-            if aspect_ratio > 1:
-                new_size = (target_size, int(target_size / aspect_ratio))
-            else:
-                new_size = (int(target_size * aspect_ratio), target_size)
-
-            # First resize based on position info
-            char_img_resized = char_img.resize(new_size, Image.Resampling.LANCZOS)
 
-            # Additional shrink to 55%
-            scale_factor = 0.55
-            final_size = (int(char_img_resized.size[0] * scale_factor),
-                        int(char_img_resized.size[1] * scale_factor))
-            char_img_resized = char_img_resized.resize(final_size, Image.Resampling.LANCZOS)
-
-            # Apply subtle background removal/softening
-            char_cv = cv2.cvtColor(np.array(char_img_resized.convert('RGB')), cv2.COLOR_RGB2BGR)
-            
-            # Create a soft mask to isolate the character (simple approach)
-            gray = cv2.cvtColor(char_cv, cv2.COLOR_BGR2GRAY)
-            _, mask = cv2.threshold(gray, 240, 255, cv2.THRESH_BINARY_INV)
-            
-            # Apply morphological operations to refine mask
-            kernel = np.ones((3, 3), np.uint8)
-            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
-            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
-            
-            # Apply Gaussian blur to soften edges
-            mask = cv2.GaussianBlur(mask, (5, 5), 0)
-            
-            # Convert back to PIL with alpha channel
-            mask_pil = Image.fromarray(mask).convert('L')
-            char_img_resized.putalpha(mask_pil)
-            
-            return char_img_resized
-            
         except Exception as e:
-            logger.error(f"Error preparing character: {e}")
-            return char_img.resize((300, 400))
-    
-    def _prepare_background_for_composition(self, bg_img, position_info):
-        """
-        Prepare background image for character placement
-        """
-        try:
-            # Standard background size
-            target_size = (800, 600)
-            bg_prepared = bg_img.resize(target_size, Image.Resampling.LANCZOS)
-            
-            # Apply subtle depth-of-field effect if character is in foreground
-            if position_info['depth_layer'] == 'foreground':
-                bg_cv = cv2.cvtColor(np.array(bg_prepared), cv2.COLOR_RGB2BGR)
-                bg_cv = cv2.GaussianBlur(bg_cv, (3, 3), 0)
-                bg_prepared = Image.fromarray(cv2.cvtColor(bg_cv, cv2.COLOR_BGR2RGB))
-            
-            return bg_prepared
-            
-        except Exception as e:
-            logger.error(f"Error preparing background: {e}")
-            return bg_img.resize((800, 600))
-    
-    def _composite_final_scene(self, char_img, bg_img, position_info):
-        """
-        Composite character onto background using proper positioning and blending
-        """
-        try:
-            # Background removal
-            try:
-                char_img = remove(char_img)
-            except Exception as e:
-                logger.warning(f"Background removal failed: {e}")
+            logger.error(f"Error combining images: {e!r}")
+            return self._generate_placeholder_image("combined_scene")
 
-            # Create the final composition
-            final_img = bg_img.copy().convert('RGBA')
-            
-            # Calculate character position
-            bg_width, bg_height = bg_img.size
-            char_width, char_height = char_img.size
-            
-            # Horizontal positioning
-            if position_info['char_position'] == 'left':
-                x_offset = bg_width // 9
-            elif position_info['char_position'] == 'right':
-                x_offset = bg_width - char_width - (bg_width // 9)
-            else:  # center
-                x_offset = (bg_width - char_width) // 2
-            
-            # Vertical positioning
-            y_offset = int(bg_height * position_info['char_vertical_pos'] - char_height)
-            y_offset = max(0, min(y_offset, bg_height - char_height))
-            
-            # Composite character onto background
-            if char_img.mode == 'RGBA':
-                final_img.paste(char_img, (x_offset, y_offset), char_img)
-            else:
-                final_img.paste(char_img, (x_offset, y_offset))
-            
-            return final_img.convert('RGB')
-            
-        except Exception as e:
-            logger.error(f"Error compositing final scene: {e}")
-            total_width = bg_img.size[0] + char_img.size[0]
-            max_height = max(bg_img.size[1], char_img.size[1])
-            
-            combined = Image.new('RGB', (total_width, max_height), (255, 255, 255))
-            combined.paste(bg_img, (0, 0))
-            combined.paste(char_img, (bg_img.size[0], 0))
-            return combined
-    
-    def _apply_scene_post_processing(self, combined_img, genre):
-        """
-        Apply final post-processing effects based on genre
-        """
-        try:
-            # Apply genre-specific effects
-            if genre in ['horror', 'mystery']:
-                # Darken and increase contrast
-                enhancer = ImageEnhance.Brightness(combined_img)
-                combined_img = enhancer.enhance(0.8)
-                enhancer = ImageEnhance.Contrast(combined_img)
-                combined_img = enhancer.enhance(1.2)
-                
-            elif genre in ['fantasy', 'adventure']:
-                # Enhance colors and saturation
-                enhancer = ImageEnhance.Color(combined_img)
-                combined_img = enhancer.enhance(1.1)
-                
-            elif genre in ['romance', 'drama']:
-                # Soften and warm the image
-                enhancer = ImageEnhance.Contrast(combined_img)
-                combined_img = enhancer.enhance(0.9)
-                
-            elif genre == 'sci-fi':
-                # Cool the colors slightly
-                img_array = np.array(combined_img, dtype=np.float32)
-                img_array[:, :, 2] *= 1.05
-                img_array[:, :, 0] *= 0.98
-                combined_img = Image.fromarray(np.clip(img_array, 0, 255).astype(np.uint8))
-            
-            # Apply subtle sharpening
-            combined_img = combined_img.filter(ImageFilter.UnsharpMask(radius=1, percent=50, threshold=2))
-            
-            return combined_img
-            
-        except Exception as e:
-            logger.error(f"Error in post-processing: {e}")
-            return combined_img
-    
     def generate_complete_story(self, prompt, length='medium', genre='fantasy'):
         """Generate story, character description, and background description in a single chain """
-        
-        length_instructions = {
-            'short': 'Write a complete short story of 200-300 words with clear beginning, middle, and end.',
-            'medium': 'Write a complete medium-length story of 300-500 words with developed plot and character arc.',
-            'long': 'Write a complete longer story of 500-750 words with rich detail and compelling narrative.'
-        }
-        
-        unified_template = PromptTemplate(
-            input_variables=["prompt", "genre", "length_instruction"],
-            template="""
-            You are a professional storyteller and world-builder. Create a complete story package with three DISTINCT sections:
-
-            STORY REQUIREMENTS:
-            {length_instruction}
-            Genre: {genre}
-            User Prompt: {prompt}
-
-            SECTION 1: **[STORY]**
-            Write a complete, engaging story based on the prompt above. Focus ONLY on the narrative:
-            - Clear beginning, middle, and end
-            - Vivid storytelling with natural dialogue
-            - Immersive scenes and plot development
-            - DO NOT include character descriptions or world-building details here
-            - Focus purely on the story events and narrative flow
-
-            SECTION 2: **[CHARACTER]**
-            Create a detailed character profile for the main protagonist (150-200 words):
-            - PHYSICAL: Age, height, build, hair color/style, eye color, facial features, clothing style
-            - PERSONALITY: Core traits, strengths, flaws, mannerisms, speaking style
-            - BACKGROUND: Family history, education, past experiences, formative events
-            - MOTIVATION: Primary goals, fears, desires, what drives them
-            - SKILLS: Talents, abilities, expertise, weaknesses
-            - Keep this SEPARATE from the story - focus only on character details
-
-            SECTION 3: **[BACKGROUND]**
-            Develop the world and setting (180-220 words):
-            - PHYSICAL SETTING: Geography, climate, architecture, landscapes
-            - TIME/ERA: Historical period, technology level, cultural context
-            - SOCIETY: Social structure, customs, languages, beliefs, politics
-            - ATMOSPHERE: Mood, tone, environmental details, ambiance
-            - UNIQUE ELEMENTS: Special features, magic systems, technologies, mysteries
-            - Keep this SEPARATE from both story and character - focus only on world details
-
-            FORMATTING RULES:
-            - Use EXACTLY these headers: **[STORY]**, **[CHARACTER]**, **[BACKGROUND]**
-            - Keep each section completely distinct and focused
-            - Ensure all sections are consistent within the same fictional universe
-            - Write in a {genre} style throughout all sections
-            """
-        )
-        
+
         if not self.llm:
             return self._generate_mock_complete_story(prompt, genre)
-        
+
         try:
-            chain = unified_template | self.llm | StrOutputParser()
-            complete_response = chain.invoke({
-                "prompt": prompt,
-                "genre": genre,
-                "length_instruction": length_instructions[length]
-            })
-            
+            chain = self._story_chain(length)
+            with timed_stage('llm.story', length=length):
+                complete_response = chain.invoke(self._story_inputs(prompt, length, genre))
+
             return self._parse_response(complete_response)
-            
+
         except Exception as e:
             logger.error(f"Error generating complete story: {e}")
             return self._generate_mock_complete_story(prompt, genre)
-    
+
     def generate_character_image_prompt(self, character_description, visual_style, genre):
         """Generate an optimized character image prompt - IMPROVED VERSION"""
-        
-        prompt_template = PromptTemplate(
-            input_variables=["character_description", "visual_style", "genre"],
-            template="""
-            Extract ONLY the visual/physical details from this character description:
-            {character_description}
+        return self._extract_image_prompt('character', character_description, visual_style, genre)
 
-            Create a focused image prompt for a {genre} character portrait with these requirements:
-            
-            EXTRACT ONLY:
-            - Age and physical build
-            - Hair color, style, and length
-            - Eye color and facial features
-            - Clothing and accessories
-            - Any distinctive physical marks or features
-            
-            IGNORE:
-            - Personality traits
-            - Background history
-            - Skills and abilities
-            - Motivations and goals
-            - Story context
-            
-            FORMAT: Create a single comma-separated prompt under 150 characters:
-            "portrait of [age] [build] [gender], [hair details], [eye color], [clothing style], {visual_style}, high quality, detailed"
-            
-            Visual Image Prompt:
-            """
-        )
-        
-        if not self.llm:
-            return self._generate_mock_image_prompt(character_description, genre)
-        
-        try:
-            chain = prompt_template | self.llm | StrOutputParser()
-            image_prompt = chain.invoke({
-                "character_description": character_description,
-                "visual_style": visual_style,
-                "genre": genre
-            })
-            
-            cleaned_prompt = self._clean_image_prompt(image_prompt.strip())
-            return f"{cleaned_prompt}, {visual_style}"
-            
-        except Exception as e:
-            logger.error(f"Error generating character image prompt: {e}")
-            return self._generate_mock_image_prompt(character_description, genre)
-    
-    def generate_background_image_prompt(self, background_description, story_context, visual_style, genre):
+    def generate_background_image_prompt(self, background_description, visual_style, genre):
         """Generate an optimized background/environment image prompt - IMPROVED VERSION"""
-        
-        background_prompt_template = PromptTemplate(
-            input_variables=["background_description", "visual_style", "genre"],
-            template="""
-            Extract ONLY the visual/environmental details from this background description:
-            {background_description}
+        return self._extract_image_prompt('background', background_description, visual_style, genre)
+
+    def _extract_image_prompt(self, kind, description, visual_style, genre):
+        chain = self._image_prompt_chain(kind)
+        if chain is None:
+            return self._mock_image_prompt(kind, description, genre)
 
-            Create a focused environment image prompt for a {genre} setting with these requirements:
-            
-            EXTRACT ONLY:
-            - Geographic features (mountains, forests, cities, etc.)
-            - Architecture and structures
-            - Climate and weather
-            - Time of day/lighting
-            - Physical atmosphere and mood
-            - Landscape elements
-            
-            IGNORE:
-            - Characters or people
-            - Story events
-            - Social/political details
-            - Historical context
-            - Cultural information
-            
-            FORMAT: Create a single comma-separated prompt under 150 characters:
-            "[environment type], [architectural style], [lighting/time], [weather/atmosphere], {visual_style}, no people, landscape"
-            
-            Environment Image Prompt:
-            """
-        )
-        
-        if not self.llm:
-            return self._generate_mock_background_image_prompt(background_description, genre)
-        
         try:
-            chain = background_prompt_template | self.llm | StrOutputParser()
-            image_prompt = chain.invoke({
-                "background_description": background_description,
-                "visual_style": visual_style,
-                "genre": genre
-            })
-            
-            cleaned_prompt = self._clean_background_image_prompt(image_prompt.strip())
-            return f"{cleaned_prompt}, {visual_style}, no people, wide shot"
-            
+            with timed_stage(f'llm.{kind}_prompt'):
+                image_prompt = chain.invoke(self._image_prompt_inputs(kind, description, visual_style, genre))
+
+            return self._finish_image_prompt(kind, image_prompt, visual_style)
+
         except Exception as e:
-            logger.error(f"Error generating background image prompt: {e}")
-            return self._generate_mock_background_image_prompt(background_description, genre)
-    
-    def generate_character_image(self, character_description, visual_style, genre):
+            logger.error(f"Error generating {kind} image prompt: {e}")
+            return self._mock_image_prompt(kind, description, genre)
+
+    def prepare_image_prompts(self, story_package, visual_style, genre, skip_background=False, skip_character=False):
+        """
+        (character prompt, background prompt) ahead of the image calls, per image_prompt_mode:
+        'folded' takes them from the story response, 'concurrent' runs both extraction calls
+        at once. None means the image method extracts its own prompt, as in 'sequential'.
+        ``skip_background``/``skip_character`` when that image is already taken care of.
+        """
+        character_description = '' if skip_character else story_package['character_description']
+        background_description = '' if skip_background else story_package['background_description']
+        if self.image_prompt_mode == 'folded':
+            character_prompt = None if skip_character else story_package.get('character_image_prompt')
+            background_prompt = story_package.get('background_image_prompt')
+            return (
+                self._finish_character_prompt(character_prompt, visual_style) if character_prompt else None,
+                self._finish_background_prompt(background_prompt, visual_style) if background_prompt else None,
+            )
+        if self.image_prompt_mode != 'concurrent' or not (character_description and background_description):
+            return None, None
+
+        # Background extraction on a helper thread (with this request's stage log and
+        # deadline), character extraction on this one; Ollama needs OLLAMA_NUM_PARALLEL > 1
+        # to actually run them side by side
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-prompt') as executor:
+            background_future = executor.submit(
+                context.run, self.generate_background_image_prompt, background_description, visual_style, genre
+            )
+            character_prompt = self.generate_character_image_prompt(character_description, visual_style, genre)
+            return character_prompt, background_future.result()
+
+    def generate_character_image(self, character_description, visual_style, genre, image_prompt=None):
         """Generate character image using free Hugging Face models"""
-        
+
         try:
-            # First, generate optimized image prompt
-            image_prompt = self.generate_character_image_prompt(character_description, visual_style, genre)
-            
-            # Add consistent character-specific enhancers
-            full_prompt = (
-                f"{image_prompt}, portrait, character design, centered composition, "
-                f"detailed face, professional lighting, high quality, masterpiece, "
-                f"transparent background, isolated subject, PLAIN WHITE background, no scenery"
-                f"Give the character with PLAIN WHITE BACKGROUND, and give the full body shot, head to toe, character standing."
-                )
+            # First, generate optimized image prompt (unless prepare_image_prompts already did)
+            if image_prompt is None:
+                image_prompt = self.generate_character_image_prompt(character_description, visual_style, genre)
+
+            full_prompt = self._character_full_prompt(image_prompt)
+            return self.render_image(full_prompt, "character", genre)
 
-            # Try multiple models until one works
-            for model in self.hf_image_models:
-                try:
-                    image_data = self._call_huggingface_api(model, full_prompt, image_type="portrait")
-                    if image_data:
-                        return {
-                            'image_data': image_data,
-                            'prompt': full_prompt,
-                            'model_used': model,
-                            'success': True,
-                            'type': 'character'
-                        }
-                except Exception as e:
-                    logger.warning(f"Failed to generate character with {model}: {e}")
-                    continue
-            
-            # If all models fail, return placeholder
-            return self._generate_placeholder_image("character")
-            
         except Exception as e:
             logger.error(f"Error in character image generation: {e}")
             return self._generate_placeholder_image("character")
 
-    def generate_background_image(self, background_description, story_context, visual_style, genre):
+    def generate_background_image(self, background_description, visual_style, genre, image_prompt=None):
         """Generate background/environment image using free Hugging Face models"""
-        
+
         try:
-            # First, generate optimized background image prompt
-            image_prompt = self.generate_background_image_prompt(background_description, story_context, visual_style, genre)
-            
-            # Add consistent environment-specific enhancers
-            full_prompt = f"{image_prompt}, wide shot, landscape photography, environmental art, cinematic lighting, no people, high quality, detailed, masterpiece"
-            
-            # Try multiple models until one works
-            for model in self.hf_image_models:
-                try:
-                    image_data = self._call_huggingface_api(model, full_prompt, image_type="landscape")
-                    if image_data:
-                        return {
-                            'image_data': image_data,
-                            'prompt': full_prompt,
-                            'model_used': model,
-                            'success': True,
-                            'type': 'background'
-                        }
-                except Exception as e:
-                    logger.warning(f"Failed to generate background with {model}: {e}")
-                    continue
-            
-            # If all models fail, return placeholder
-            return self._generate_placeholder_image("background")
-            
+            # First, generate optimized background image prompt (unless prepare_image_prompts already did)
+            if image_prompt is None:
+                image_prompt = self.generate_background_image_prompt(background_description, visual_style, genre)
+
+            full_prompt = self._background_full_prompt(image_prompt)
+            return self.render_image(full_prompt, "background", genre)
+
         except Exception as e:
             logger.error(f"Error in background image generation: {e}")
             return self._generate_placeholder_image("background")
-    
+
+    def render_image(self, full_prompt, image_type, genre):
+        """Render a finished prompt at the service's tier, trying its models in turn"""
+        tier = image_tier(self.image_tier)
+        for model in tier['hf_models']:
+            if not self._can_afford_image_call(f"image.{image_type}"):
+                return self._budget_placeholder(image_type)
+            try:
+                image_data = self._call_huggingface_api(
+                    model, full_prompt, max_retries=tier['retries'], image_type=self._provider_image_type(image_type)
+                )
+                if image_data:
+                    return self._image_result(image_data, full_prompt, model, image_type)
+            except Exception as e:
+                logger.warning(f"Failed to generate {image_type} with {model}: {e}")
+                continue
+
+        return self._render_failed(image_type)
+
+    def _image_result(self, image_data, full_prompt, model, image_type):
+        return {
+            'image_data': image_data,
+            'prompt': full_prompt,
+            'model_used': model,
+            'success': True,
+            'type': image_type,
+            'tier': self.image_tier
+        }
+
+    def _story_template(self):
+        return FOLDED_STORY_TEMPLATE if self.image_prompt_mode == 'folded' else STORY_TEMPLATE
+
+    # LLM requests shared with the async service, which only swaps invoke for ainvoke
+
+    def _story_chain(self, length):
+        llm = self._llm_for(
+            fit_timeout(None, deadline_settings()['STORY_SHARE']),
+            story_num_predict(length, folded=self.image_prompt_mode == 'folded')
+        )
+        return self._story_template() | llm | StrOutputParser()
+
+    def _story_inputs(self, prompt, length, genre):
+        return {
+            "prompt": prompt,
+            "genre": genre,
+            "length_instruction": LENGTH_INSTRUCTIONS[length]
+        }
+
+    def _image_prompt_chain(self, kind):
+        """Chain for a ``kind`` image prompt extraction call, or None when the template prompt is used instead"""
+        if not self.llm:
+            return None
+        if not self._can_afford_prompt_call():
+            budget_fallback(f'llm.{kind}_prompt')
+            return None
+        template = CHARACTER_IMAGE_PROMPT_TEMPLATE if kind == 'character' else BACKGROUND_IMAGE_PROMPT_TEMPLATE
+        return template | self._prompt_llm() | StrOutputParser()
+
+    def _image_prompt_inputs(self, kind, description, visual_style, genre):
+        return {
+            f"{kind}_description": description,
+            "visual_style": visual_style,
+            "genre": genre
+        }
+
+    def _finish_image_prompt(self, kind, image_prompt, visual_style):
+        if kind == 'character':
+            return self._finish_character_prompt(image_prompt, visual_style)
+        return self._finish_background_prompt(image_prompt, visual_style)
+
+    def _mock_image_prompt(self, kind, description, genre):
+        if kind == 'character':
+            return self._generate_mock_image_prompt(description, genre)
+        return self._generate_mock_background_image_prompt(description, genre)
+
+    def _finish_character_prompt(self, image_prompt, visual_style):
+        return f"{self._clean_image_prompt(image_prompt.strip())}, {visual_style}"
+
+    def _finish_background_prompt(self, image_prompt, visual_style):
+        return f"{self._clean_background_image_prompt(image_prompt.strip())}, {visual_style}, no people, wide shot"
+
+    def _llm_for(self, timeout, num_predict=None):
+        """
+        A configured OllamaLLM generating at most ``num_predict`` tokens whose client gives
+        up after ``timeout`` seconds; clients without a timeout are reused
+        """
+        if timeout is not None:
+            return build_llm(num_predict, timeout)
+        if num_predict not in self._capped_llms:
+            self._capped_llms[num_predict] = build_llm(num_predict)
+        return self._capped_llms[num_predict]
+
+    def _can_afford_prompt_call(self):
+        # An image prompt is only worth asking the LLM for if an image call still fits after it
+        config = deadline_settings()
+        return can_afford(config['MIN_LLM_CALL'] + config['MIN_IMAGE_CALL'])
+
+    def _prompt_llm(self):
+        # A prompt is one short line, so the call gets a small token cap
+        num_predict = ollama_settings()['IMAGE_PROMPT_NUM_PREDICT']
+        left = remaining()
+        if left is None:
+            return self._llm_for(None, num_predict)
+        return self._llm_for(max(1.0, left - deadline_settings()['MIN_IMAGE_CALL']), num_predict)
+
+    def _budget_placeholder(self, image_type):
+        """
+        Stand-in when no time is left for an image API. Nothing is rendered or stored; the
+        placeholder model name tells the page to draw the genre gradient in the image's place.
+        """
+        return {
+            'image_data': None,
+            'prompt': f"{image_type.title()} placeholder (time budget exhausted)",
+            'model_used': PLACEHOLDER_MODEL,
+            'success': False,
+            'placeholder': True,
+            'type': image_type
+        }
+
+    def _character_full_prompt(self, image_prompt):
+        """Add consistent character-specific enhancers"""
+        return (
+            f"{image_prompt}, portrait, character design, centered composition, "
+            f"detailed face, professional lighting, high quality, masterpiece, "
+            f"transparent background, isolated subject, PLAIN WHITE background, no scenery"
+            f"Give the character with PLAIN WHITE BACKGROUND, and give the full body shot, head to toe, character standing."
+            )
+
+    def _background_full_prompt(self, image_prompt):
+        """Add consistent environment-specific enhancers"""
+        return f"{image_prompt}, wide shot, landscape photography, environmental art, cinematic lighting, no people, high quality, detailed, masterpiece"
+
     def _get_visual_style_for_genre(self, genre):
         """Return consistent visual style parameters for each genre"""
         style_mapping = {
@@ -972,89 +819,154 @@ class StoryGeneratorService:
             'comedy': 'bright art style, cheerful lighting, colorful atmosphere'
         }
         return style_mapping.get(genre, 'realistic art style, natural lighting')
-    
+
     def _call_stability_api(self, prompt, image_type="portrait"):
         """Call Stability.ai API as fallback when HF models fail."""
+        if not self._can_afford_image_call('image.stability_request'):
+            return None
         try:
-            payload = {
-                "text_prompts": [{"text": prompt}],
-                "cfg_scale": 7,
-                "width": 1024,
-                "height": 1024,
-                "samples": 1
-            }
-            url = self.stability_url_map[image_type]
-            resp = requests.post(url, headers=self.stability_headers, json=payload, timeout=40)
-            if resp.status_code != 200:
-                logger.error(f"Stability API error {resp.status_code}: {resp.text}")
-                return None
-
-            data = resp.json()
-            img_b64 = data["artifacts"][0]["base64"]
-            return img_b64
+            with timed_stage('image.stability_request', image_type=image_type) as stage:
+                resp = requests.post(self.stability_url_map[image_type], headers=self.stability_headers,
+                                     json=self._stability_payload(prompt, image_type), timeout=fit_timeout(40))
+                stage['status'] = resp.status_code
+            return self._stability_image(resp)
         except Exception as e:
-            logger.error(f"Error calling Stability API: {e}")
+            self._image_call_error('stability', e)
             return None
 
     def _call_huggingface_api(self, model, prompt, max_retries=3, image_type="portrait"):
         """Call Hugging Face Inference API, fallback to Stability.ai if fails."""
-        
-        api_url = f"https://api-inference.huggingface.co/models/{model}"
-        
-        if image_type == "landscape":
-            width, height = 768, 512
-            guidance_scale = 7.0
-        else:
-            width, height = 512, 768
-            guidance_scale = 8.0
+
+        api_url = self._huggingface_url(model)
+        payload = self._huggingface_payload(prompt, image_type)
+
+        for attempt in range(max_retries):
+            if not can_afford(deadline_settings()['MIN_IMAGE_CALL']):
+                break
+            try:
+                with timed_stage('image.hf_request', model=model, attempt=attempt + 1) as stage:
+                    response = requests.post(api_url, headers=self.hf_headers, json=payload, timeout=fit_timeout(35))
+                    stage['status'] = response.status_code
+
+                if response.status_code == 200:
+                    IMAGE_ATTEMPTS.inc(provider='huggingface', outcome='success')
+                    with timed_stage('image.transcode'):
+                        return self._transcode_image(response.content)
+
+                delay = self._huggingface_retry_delay(model, response)
+                if delay is None:
+                    break
+                with timed_stage('image.backoff_sleep', reason='model_loading'):
+                    time.sleep(delay)
+
+            except requests.exceptions.Timeout:
+                delay = self._huggingface_timeout_delay(attempt, max_retries)
+                if delay:
+                    with timed_stage('image.backoff_sleep', reason='timeout'):
+                        time.sleep(delay)
+            except Exception as e:
+                self._image_call_error('huggingface', e)
+                break
+
+        self._note_stability_fallback(image_type)
+        return self._call_stability_api(prompt, image_type=image_type)
+
+    # Image requests shared with the async service: everything but sending them and sleeping
+
+    def _provider_image_type(self, image_type):
+        return "portrait" if image_type == "character" else "landscape"
+
+    def _can_afford_image_call(self, stage):
+        """Whether an image API call still fits the deadline; records the fallback when it doesn't"""
+        if can_afford(deadline_settings()['MIN_IMAGE_CALL']):
+            return True
+        budget_fallback(stage)
+        return False
+
+    def _render_failed(self, image_type):
+        # If all models fail, return placeholder
+        IMAGE_FALLBACKS.inc(image_type=image_type, target='placeholder')
+        return self._generate_placeholder_image(image_type)
+
+    def _huggingface_url(self, model):
+        return f"{settings.HF_INFERENCE_URL}/models/{model}"
+
+    def _huggingface_retry_delay(self, model, response):
+        """
+        Seconds to wait before retrying ``model`` after a non-200 response, or None to give
+        up on it (errors, or a loading model whose wait the deadline can't cover)
+        """
+        if response.status_code == 503:
+            IMAGE_ATTEMPTS.inc(provider='huggingface', outcome='model_loading')
+            if not can_afford(HF_LOADING_BACKOFF + deadline_settings()['MIN_IMAGE_CALL']):
+                return None
+            logger.info(f"Model {model} is loading, waiting...")
+            return HF_LOADING_BACKOFF
+        IMAGE_ATTEMPTS.inc(provider='huggingface', outcome=f"http_{response.status_code}")
+        logger.error(f"HF API call failed: {response.status_code} - {response.text}")
+        return None
+
+    def _huggingface_timeout_delay(self, attempt, max_retries):
+        """Seconds to wait after a timed-out attempt before the next one (0: retry at once)"""
+        IMAGE_ATTEMPTS.inc(provider='huggingface', outcome='timeout')
+        logger.warning(f"Timeout on attempt {attempt + 1}")
+        if attempt < max_retries - 1 and can_afford(HF_TIMEOUT_BACKOFF + deadline_settings()['MIN_IMAGE_CALL']):
+            return HF_TIMEOUT_BACKOFF
+        return 0
+
+    def _stability_image(self, resp):
+        """base64 image from a Stability response, or None when it failed"""
+        if resp.status_code != 200:
+            IMAGE_ATTEMPTS.inc(provider='stability', outcome=f"http_{resp.status_code}")
+            logger.error(f"Stability API error {resp.status_code}: {resp.text}")
+            return None
+        IMAGE_ATTEMPTS.inc(provider='stability', outcome='success')
+        return resp.json()["artifacts"][0]["base64"]
+
+    def _image_call_error(self, provider, error):
+        IMAGE_ATTEMPTS.inc(provider=provider, outcome='error')
+        logger.error(f"{provider} image call error: {error!r}")
+
+    def _note_stability_fallback(self, image_type):
+        logger.info("Falling back to Stability API...")
+        IMAGE_FALLBACKS.inc(image_type=image_type, target='stability')
+    
+    def _stability_payload(self, prompt, image_type="portrait"):
+        tier = image_tier(self.image_tier)
+        width, height = tier[f"stability_{image_type}"]
+        payload = {
+            "text_prompts": [{"text": prompt}],
+            "cfg_scale": 7,
+            "width": width,
+            "height": height,
+            "samples": 1
+        }
+        if tier['stability_steps']:
+            payload["steps"] = tier['stability_steps']
+        return payload
+
+    def _huggingface_payload(self, prompt, image_type):
+        tier = image_tier(self.image_tier)
+        width, height = tier[image_type]
         
         payload = {
             "inputs": prompt,
             "parameters": {
-                "num_inference_steps": 25,
-                "guidance_scale": guidance_scale,
+                "num_inference_steps": tier['steps'],
+                "guidance_scale": tier['guidance'][image_type],
                 "width": width,
                 "height": height,
                 "negative_prompt": "blurry, low quality, distorted, watermark, text, multiple people" if image_type == "portrait" else "people, characters, figures, blurry, low quality, distorted, watermark, text"
             }
         }
-        
-        for attempt in range(max_retries):
-            try:
-                response = requests.post(api_url, headers=self.hf_headers, json=payload, timeout=35)
-                
-                if response.status_code == 200:
-                    image_bytes = response.content
-                    image = Image.open(BytesIO(image_bytes))
-                    
-                    # Convert to base64 for storage/display
-                    buffered = BytesIO()
-                    image.save(buffered, format="PNG")
-                    img_base64 = base64.b64encode(buffered.getvalue()).decode()
-                    
-                    return img_base64
-                
-                elif response.status_code == 503:
-                    logger.info(f"Model {model} is loading, waiting...")
-                    time.sleep(15)
-                    continue
-                
-                else:
-                    logger.error(f"HF API call failed: {response.status_code} - {response.text}")
-                    break
-                    
-            except requests.exceptions.Timeout:
-                logger.warning(f"Timeout on attempt {attempt + 1}")
-                if attempt < max_retries - 1:
-                    time.sleep(8)
-                continue
-            except Exception as e:
-                logger.error(f"HF API call error: {e}")
-                break
-        
-        # Stability.ai fallback
-        logger.info("Falling back to Stability API...")
-        return self._call_stability_api(prompt, image_type=image_type)
+        return payload
+
+    def _transcode_image(self, image_bytes):
+        """Provider image bytes -> base64 PNG for storage/display"""
+        image = Image.open(BytesIO(image_bytes))
+        buffered = BytesIO()
+        image.save(buffered, format="PNG")
+        return base64.b64encode(buffered.getvalue()).decode()
     
     def _clean_image_prompt(self, prompt):
         """Clean and optimize character image prompt"""
@@ -1144,7 +1056,7 @@ class StoryGeneratorService:
             # Use more precise regex to find sections
             story_match = re.search(r'\*\*\[STORY\]\*\*(.*?)(?=\*\*\[CHARACTER\]\*\*|$)', response, re.DOTALL | re.IGNORECASE)
             character_match = re.search(r'\*\*\[CHARACTER\]\*\*(.*?)(?=\*\*\[BACKGROUND\]\*\*|$)', response, re.DOTALL | re.IGNORECASE)
-            background_match = re.search(r'\*\*\[BACKGROUND\]\*\*(.*?)$', response, re.DOTALL | re.IGNORECASE)
+            background_match = re.search(r'\*\*\[BACKGROUND\]\*\*(.*?)(?=\**\[CHARACTER_PROMPT\]|$)', response, re.DOTALL | re.IGNORECASE)
             
             # Also try without asterisks
             if not story_match:
@@ -1152,7 +1064,7 @@ class StoryGeneratorService:
             if not character_match:
                 character_match = re.search(r'\[CHARACTER\](.*?)(?=\[BACKGROUND\]|$)', response, re.DOTALL | re.IGNORECASE)
             if not background_match:
-                background_match = re.search(r'\[BACKGROUND\](.*?)$', response, re.DOTALL | re.IGNORECASE)
+                background_match = re.search(r'\[BACKGROUND\](.*?)(?=\**\[CHARACTER_PROMPT\]|$)', response, re.DOTALL | re.IGNORECASE)
             
             story = story_match.group(1).strip() if story_match else ""
             character = character_match.group(1).strip() if character_match else ""
@@ -1165,26 +1077,49 @@ class StoryGeneratorService:
             
             # Fallback if sections not clearly marked
             if not all([story, character, background]):
+                STORY_PARSE.inc(part='sections', outcome='fallback')
                 return self._fallback_parse(response)
+            STORY_PARSE.inc(part='sections', outcome='parsed')
             
-            return {
+            parsed = {
                 'story': story,
                 'character_description': character,
                 'background_description': background
             }
+            if self.image_prompt_mode == 'folded':
+                image_prompts = self._parse_image_prompts(response)
+                STORY_PARSE.inc(part='image_prompts', outcome='parsed' if len(image_prompts) == 2 else 'missing')
+                parsed.update(image_prompts)
+            return parsed
             
         except Exception as e:
             logger.error(f"Error parsing response: {e}")
             return self._fallback_parse(response)
     
+    def _parse_image_prompts(self, response):
+        """The [CHARACTER_PROMPT] and [BACKGROUND_PROMPT] lines of a folded response; missing ones are left out"""
+        prompts = {}
+        for key, pattern in (
+            ('character_image_prompt', r'\**\[CHARACTER_PROMPT\]\**(.*?)(?=\**\[BACKGROUND_PROMPT\]|$)'),
+            ('background_image_prompt', r'\**\[BACKGROUND_PROMPT\]\**(.*?)$'),
+        ):
+            match = re.search(pattern, response, re.DOTALL | re.IGNORECASE)
+            section = match.group(1).strip().lstrip(':') if match else ''
+            lines = [line.strip().strip('"').strip() for line in section.splitlines()]
+            prompt = next((line for line in lines if line), '')
+            # A prompt is one short line; anything else means the model ignored the format
+            if 10 <= len(prompt) <= 300:
+                prompts[key] = prompt
+        return prompts
+
     def _clean_section_content(self, content):
         """Clean individual section content"""
         if not content:
             return ""
         
         # Remove section headers that might have leaked through
-        content = re.sub(r'\*\*\[(STORY|CHARACTER|BACKGROUND)\]\*\*', '', content, flags=re.IGNORECASE)
-        content = re.sub(r'\[(STORY|CHARACTER|BACKGROUND)\]', '', content, flags=re.IGNORECASE)
+        content = re.sub(r'\*\*\[(STORY|CHARACTER|BACKGROUND|CHARACTER_PROMPT|BACKGROUND_PROMPT)\]\*\*', '', content, flags=re.IGNORECASE)
+        content = re.sub(r'\[(STORY|CHARACTER|BACKGROUND|CHARACTER_PROMPT|BACKGROUND_PROMPT)\]', '', content, flags=re.IGNORECASE)
         
         # Clean up extra whitespace
         content = re.sub(r'\n\s*\n\s*\n', '\n\n', content)
@@ -0,0 +1,16 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .cache import invalidate_story
+from .models import StoryGeneration
+
+
+@receiver(post_save, sender=StoryGeneration)
+def story_saved(sender, instance, **kwargs):
+    """Invalidate cached fragments when a story is created or changed"""
+    invalidate_story(instance)
+
+
+@receiver(post_delete, sender=StoryGeneration)
+def story_deleted(sender, instance, **kwargs):
+    """Invalidate cached fragments when a story is removed (view or admin)"""
+    invalidate_story(instance)
@@ -0,0 +1,294 @@
+"""
+Single-flight coalescing of identical generation requests (STORY_SINGLE_FLIGHT).
+
+A double-clicked Generate button or a client retrying after a timeout submits the same
+(prompt, genre, length, input type, audio) again while the first pipeline is still
+running. The first request takes a lock file keyed on the normalized inputs and runs the
+pipeline; duplicates in any worker process on the host wait for it and are redirected to
+the story it produced. Only requests that arrived while the pipeline was running get its
+result: a submission made after it finished, such as a deliberate regeneration, always
+runs a new pipeline.
+
+Lock files are created with O_EXCL, so this works across processes without a database
+table; a lock whose owner died (or that outlived STALE_AFTER) is taken over. Coalescing
+is best effort: if the leader fails, its duplicates run the pipeline themselves. The
+time a duplicate spent waiting counts against its request deadline, and it never waits
+longer than that deadline's budget.
+"""
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.shortcuts import redirect
+from functools import wraps
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import socket
+import tempfile
+import time
+
+from .deadline import deadline_settings
+from .metrics import SINGLE_FLIGHT, record_stage
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SINGLE_FLIGHT_SETTINGS = {
+    'ENABLED': True,
+    'DIRECTORY': os.path.join(tempfile.gettempdir(), 'story_generator_inflight'),
+    # How long a duplicate waits for the running pipeline before running its own
+    'WAIT_TIMEOUT': 300,
+    'STALE_AFTER': 900,
+    'POLL_INTERVAL': 0.25,
+}
+
+
+def single_flight_settings():
+    config = dict(DEFAULT_SINGLE_FLIGHT_SETTINGS)
+    config.update(getattr(settings, 'STORY_SINGLE_FLIGHT', {}))
+    return config
+
+
+def _wait_config(config):
+    """``config`` with WAIT_TIMEOUT capped at the request budget, which the wait is charged to"""
+    deadline = deadline_settings()
+    if not deadline['ENABLED']:
+        return config
+    return {**config, 'WAIT_TIMEOUT': min(config['WAIT_TIMEOUT'], deadline['BUDGET'] - deadline['RESERVE'])}
+
+
+def record_flight_wait(request):
+    """Add a duplicate's wait for the leader to the stage breakdown (call after start_stage_log); returns the wait"""
+    waited = getattr(request, 'single_flight_waited', 0.0)
+    if waited:
+        record_stage('single_flight.wait', waited)
+    return waited
+
+
+def generation_key(request):
+    """Hash of the normalized form inputs plus the audio content, or None when there is nothing to key on"""
+    prompt = re.sub(r'\s+', ' ', request.POST.get('prompt', '')).strip().lower()
+    audio_file = request.FILES.get('audio_file')
+    if not prompt and audio_file is None:
+        return None
+
+    digest = hashlib.sha256()
+    for value in (prompt, request.POST.get('genre', ''), request.POST.get('story_length', ''),
+                  request.POST.get('input_type', '') or 'text', request.POST.get('character', '')):
+        digest.update(value.encode())
+        digest.update(b'\0')
+    if audio_file is not None:
+        for chunk in audio_file.chunks():
+            digest.update(chunk)
+        audio_file.seek(0)
+    return digest.hexdigest()
+
+
+class Flight:
+    """One request's place in a flight: the leader runs the pipeline, a follower gets ``result``"""
+
+    def __init__(self, key, config, leader, result=None):
+        self.key = key
+        self.config = config
+        self.leader = leader
+        self.result = result
+        self._lock_path = os.path.join(config['DIRECTORY'], f"{key}.lock")
+        self._result_path = os.path.join(config['DIRECTORY'], f"{key}.json")
+
+    def publish(self, result):
+        """Leader: share the outcome, then release the lock"""
+        if not self.leader:
+            return
+        try:
+            if result is not None:
+                temp_path = f"{self._result_path}.{os.getpid()}.tmp"
+                with open(temp_path, 'w') as f:
+                    json.dump({'created_at': time.time(), **result}, f)
+                os.replace(temp_path, self._result_path)
+        except OSError as e:
+            logger.warning(f"Could not publish single-flight result {self.key[:12]}: {e}")
+        finally:
+            self.release()
+
+    def release(self):
+        if self.leader:
+            self.leader = False
+            try:
+                os.unlink(self._lock_path)
+            except FileNotFoundError:
+                pass
+
+
+def _lock_owner():
+    return f"{socket.gethostname()} {os.getpid()} {time.time()}"
+
+
+def _read_result(path, since):
+    """The published result, if it was published after ``since`` (when the reader arrived)"""
+    try:
+        with open(path) as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if result.get('created_at', 0) < since:
+        return None
+    return result
+
+
+def _lock_is_stale(path, config):
+    try:
+        with open(path) as f:
+            host, pid, created = f.read().split()
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError):
+        # Half-written by an owner that died between create and write
+        return time.time() - os.path.getmtime(path) > 5
+    if time.time() - float(created) > config['STALE_AFTER']:
+        return True
+    if host == socket.gethostname():
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            pass
+    return False
+
+
+def _try_join(key, config, since):
+    """One attempt: returns a Flight, or None when someone else is running the pipeline"""
+    lock_path = os.path.join(config['DIRECTORY'], f"{key}.lock")
+    result = _read_result(os.path.join(config['DIRECTORY'], f"{key}.json"), since)
+    if result is not None:
+        return Flight(key, config, leader=False, result=result)
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+    except FileExistsError:
+        if _lock_is_stale(lock_path, config):
+            logger.warning(f"Taking over stale single-flight lock {key[:12]}")
+            SINGLE_FLIGHT.inc(role='stale_takeover')
+            try:
+                os.unlink(lock_path)
+            except FileNotFoundError:
+                pass
+        return None
+    with os.fdopen(fd, 'w') as f:
+        f.write(_lock_owner())
+    return Flight(key, config, leader=True)
+
+
+def _prune_results(config):
+    """Drop result files no waiting duplicate can still need; called by leaders so the directory stays small"""
+    cutoff = time.time() - config['WAIT_TIMEOUT']
+    try:
+        for entry in os.scandir(config['DIRECTORY']):
+            if entry.name.endswith('.json') and entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+    except OSError:
+        pass
+
+
+def join_flight(key, config):
+    """Lead the flight for ``key`` or wait for its leader; blocking"""
+    os.makedirs(config['DIRECTORY'], exist_ok=True)
+    since = time.time()
+    deadline = time.monotonic() + config['WAIT_TIMEOUT']
+    while True:
+        flight = _try_join(key, config, since)
+        if flight is not None:
+            return flight
+        if time.monotonic() >= deadline:
+            return Flight(key, config, leader=False)
+        time.sleep(config['POLL_INTERVAL'])
+
+
+async def ajoin_flight(key, config):
+    """join_flight for async views; waiting is an asyncio.sleep poll"""
+    os.makedirs(config['DIRECTORY'], exist_ok=True)
+    since = time.time()
+    deadline = time.monotonic() + config['WAIT_TIMEOUT']
+    while True:
+        flight = _try_join(key, config, since)
+        if flight is not None:
+            return flight
+        if time.monotonic() >= deadline:
+            return Flight(key, config, leader=False)
+        await asyncio.sleep(config['POLL_INTERVAL'])
+
+
+def _story_exists(story_id):
+    from .models import StoryGeneration
+    return StoryGeneration.objects.filter(id=story_id).exists()
+
+
+def _leader_result(request):
+    story_id = getattr(request, 'generated_story_id', None)
+    return {'story_id': story_id} if story_id else None
+
+
+def _follower_response(request, flight):
+    SINGLE_FLIGHT.inc(role='follower')
+    messages.info(request, 'This story was already being generated, so here is that result.')
+    return redirect('story_detail', story_id=flight.result['story_id'])
+
+
+def coalesce_identical(view):
+    """
+    Run identical concurrent submissions once. The view sets ``request.generated_story_id``
+    on success; duplicates are redirected to that story. Works on sync and async views.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            config = single_flight_settings()
+            if not config['ENABLED'] or request.method != 'POST':
+                return await view(request, *args, **kwargs)
+            key = await sync_to_async(generation_key, thread_sensitive=False)(request)
+            if key is None:
+                return await view(request, *args, **kwargs)
+
+            started = time.monotonic()
+            flight = await ajoin_flight(key, _wait_config(config))
+            if not flight.leader:
+                if flight.result and await sync_to_async(_story_exists)(flight.result['story_id']):
+                    return _follower_response(request, flight)
+                SINGLE_FLIGHT.inc(role='independent')
+                request.single_flight_waited = time.monotonic() - started
+                return await view(request, *args, **kwargs)
+
+            SINGLE_FLIGHT.inc(role='leader')
+            _prune_results(config)
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                flight.publish(_leader_result(request))
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        config = single_flight_settings()
+        if not config['ENABLED'] or request.method != 'POST':
+            return view(request, *args, **kwargs)
+        key = generation_key(request)
+        if key is None:
+            return view(request, *args, **kwargs)
+
+        started = time.monotonic()
+        flight = join_flight(key, _wait_config(config))
+        if not flight.leader:
+            if flight.result and _story_exists(flight.result['story_id']):
+                return _follower_response(request, flight)
+            SINGLE_FLIGHT.inc(role='independent')
+            request.single_flight_waited = time.monotonic() - started
+            return view(request, *args, **kwargs)
+
+        SINGLE_FLIGHT.inc(role='leader')
+        _prune_results(config)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            flight.publish(_leader_result(request))
+    return wrapper
@@ -0,0 +1,179 @@
+"""
+Speculative background images (STORY_SPECULATIVE_BACKGROUND).
+
+The background image normally waits for the story, its parsing and an image-prompt call.
+In speculative mode a provisional environment prompt is built from the user prompt and
+genre, and the background image starts right away, alongside the story LLM call. Once the
+story is parsed, the speculative image is kept if the final background description names
+the same kind of setting; otherwise it is discarded and the background is generated as
+usual. A discarded speculation still cost a provider call, which is why this is opt-in.
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+import asyncio
+import contextvars
+import logging
+import re
+import time
+
+from .metrics import SPECULATIVE_BACKGROUND, SPECULATIVE_SAVED_SECONDS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SPECULATIVE_SETTINGS = {
+    'ENABLED': False,
+    # Share of the provisional setting terms that must be among the final description's main ones
+    'MIN_OVERLAP': 0.5,
+    # How many of the final description's most frequent setting terms count as its main ones
+    'TOP_TERMS': 4,
+}
+
+SETTING_TERMS = frozenset("""
+    forest jungle swamp meadow field garden orchard grove mountain hill valley canyon cliff
+    cavern desert dune ocean sea lake river waterfall island beach coast shore harbor lighthouse
+    ship city town village street alley market castle palace fortress tower temple ruin library
+    tavern inn mansion manor cottage house school museum laboratory station factory spaceship
+    starship planet moon space nebula asteroid colony arctic glacier tundra snow volcano graveyard
+    cemetery church cathedral dungeon sewer subway train highway farm prairie bridge observatory
+""".split())
+SYNONYMS = {
+    'woods': 'forest', 'woodland': 'forest', 'port': 'harbor', 'harbour': 'harbor', 'docks': 'harbor',
+    'metropolis': 'city', 'hamlet': 'village', 'citadel': 'fortress', 'peak': 'mountain', 'cave': 'cavern',
+    'spacecraft': 'spaceship', 'lab': 'laboratory', 'crypt': 'dungeon',
+}
+# Used when the user prompt names no setting at all
+GENRE_SETTINGS = {
+    'fantasy': 'enchanted forest',
+    'sci-fi': 'futuristic city',
+    'mystery': 'foggy city street',
+    'romance': 'garden',
+    'adventure': 'mountain valley',
+    'horror': 'abandoned mansion',
+    'drama': 'town street',
+    'comedy': 'village market',
+}
+
+
+def speculative_settings():
+    config = dict(DEFAULT_SPECULATIVE_SETTINGS)
+    config.update(getattr(settings, 'STORY_SPECULATIVE_BACKGROUND', {}))
+    return config
+
+
+def setting_terms(text):
+    """Setting nouns in ``text`` in order of appearance, with synonyms and plurals folded"""
+    terms = []
+    for word in re.findall(r"[a-z]+", (text or '').lower()):
+        word = SYNONYMS.get(word, word)
+        if word not in SETTING_TERMS and word.endswith('s'):
+            word = SYNONYMS.get(word[:-1], word[:-1])
+        if word in SETTING_TERMS:
+            terms.append(word)
+    return terms
+
+
+def provisional_background_prompt(user_prompt, genre, visual_style):
+    """(environment image prompt, its setting terms) from the user's prompt alone"""
+    terms = list(dict.fromkeys(setting_terms(user_prompt)))[:3]
+    setting = ', '.join(terms) if terms else GENRE_SETTINGS.get(genre, 'landscape')
+    return f"{setting} environment, {visual_style}, no people, wide shot", set(setting_terms(setting))
+
+
+def setting_overlap(provisional_terms, background_description, config):
+    """Share of the provisional terms found among the final description's main setting terms"""
+    if not provisional_terms:
+        return 0.0
+    counts = Counter(setting_terms(background_description))
+    main_terms = {term for term, _ in counts.most_common(config['TOP_TERMS'])}
+    return len(provisional_terms & main_terms) / len(provisional_terms)
+
+
+class _Speculation:
+    def __init__(self, terms, config):
+        self.terms = terms
+        self.config = config
+        self.started = time.monotonic()
+        self.finished = None
+
+    def matches(self, background_description):
+        overlap = setting_overlap(self.terms, background_description, self.config)
+        logger.info(f"Speculative background overlap {overlap:.2f} (terms {sorted(self.terms)})")
+        return overlap >= self.config['MIN_OVERLAP']
+
+    def _record(self, image_result, waited):
+        if image_result and image_result.get('success'):
+            SPECULATIVE_BACKGROUND.inc(outcome='hit')
+            # What the background would have cost after the story, minus what we still waited for
+            SPECULATIVE_SAVED_SECONDS.observe(max(0.0, (self.finished or time.monotonic()) - self.started - waited))
+            return image_result
+        SPECULATIVE_BACKGROUND.inc(outcome='failed')
+        return None
+
+
+class SpeculativeBackground(_Speculation):
+    """A background image generated on a helper thread while the story is written"""
+
+    def __init__(self, service, user_prompt, genre, visual_style, config):
+        image_prompt, terms = provisional_background_prompt(user_prompt, genre, visual_style)
+        super().__init__(terms, config)
+        # The copied context carries the request's stage log and deadline into the thread
+        context = contextvars.copy_context()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='speculative-background')
+        self._future = self._executor.submit(context.run, self._generate, service, image_prompt, visual_style, genre)
+        self._executor.shutdown(wait=False)
+
+    def _generate(self, service, image_prompt, visual_style, genre):
+        try:
+            return service.generate_background_image('', visual_style, genre, image_prompt=image_prompt)
+        finally:
+            self.finished = time.monotonic()
+
+    def result(self):
+        """The speculative image if it succeeded (blocking), else None"""
+        started = time.monotonic()
+        return self._record(self._future.result(), time.monotonic() - started)
+
+    def discard(self):
+        SPECULATIVE_BACKGROUND.inc(outcome='miss')
+        # A request already sent to a provider can't be recalled; it finishes in the background
+        self._future.cancel()
+
+
+class AsyncSpeculativeBackground(_Speculation):
+    """SpeculativeBackground for the async service, as a task on the running loop"""
+
+    def __init__(self, service, user_prompt, genre, visual_style, config):
+        image_prompt, terms = provisional_background_prompt(user_prompt, genre, visual_style)
+        super().__init__(terms, config)
+        self._task = asyncio.create_task(self._generate(service, image_prompt, visual_style, genre))
+
+    async def _generate(self, service, image_prompt, visual_style, genre):
+        try:
+            return await service.agenerate_background_image('', visual_style, genre, image_prompt=image_prompt)
+        finally:
+            self.finished = time.monotonic()
+
+    async def result(self):
+        started = time.monotonic()
+        return self._record(await self._task, time.monotonic() - started)
+
+    def discard(self):
+        SPECULATIVE_BACKGROUND.inc(outcome='miss')
+        self._task.cancel()
+
+
+def start_speculative_background(service, user_prompt, genre, visual_style):
+    """A SpeculativeBackground when enabled and there is an LLM call to overlap with, else None"""
+    config = speculative_settings()
+    if not config['ENABLED'] or not service.llm:
+        return None
+    return SpeculativeBackground(service, user_prompt, genre, visual_style, config)
+
+
+def astart_speculative_background(service, user_prompt, genre, visual_style):
+    """start_speculative_background for the async service; call from a coroutine"""
+    config = speculative_settings()
+    if not config['ENABLED'] or not service.llm:
+        return None
+    return AsyncSpeculativeBackground(service, user_prompt, genre, visual_style, config)
@@ -0,0 +1,323 @@
+"""
+Local stand-ins for the external services the pipeline calls, for load testing offline.
+
+One HTTP server answers the three APIs the service layer talks to:
+  - Ollama:        POST /api/generate (NDJSON stream, as used by OllamaLLM), GET /api/tags
+  - Hugging Face:  POST /models/<model> (raw image bytes, 503 while "loading")
+  - Stability:     POST /v1/generation/<engine>/text-to-image (JSON with base64 artifacts)
+
+Point the app at it with OLLAMA_BASE_URL, HF_INFERENCE_URL and STABILITY_API_URL
+(see the run_standins command). GET /_standin/stats returns request counters.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from PIL import Image, ImageDraw, ImageFilter
+import base64
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANTS = 8
+
+STORY_SECTIONS = {
+    'story': (
+        "The lantern flickered as {hero} stepped past the broken gate. Nobody had crossed the "
+        "valley in years, yet fresh tracks led toward the tower. \"We turn back at dawn,\" "
+        "{hero} whispered, though the promise felt thin. Inside, the old map revealed a path "
+        "that should not exist, and by the time the storm broke the way home was gone. "
+    ),
+    'character': (
+        "{hero} is a wiry traveller in their early thirties with close-cropped dark hair, grey "
+        "eyes and a weathered green coat covered in patched pockets. Patient, stubborn and "
+        "quietly funny, {hero} grew up mending clocks in a river town and still counts seconds "
+        "under their breath when nervous. "
+    ),
+    'background': (
+        "The valley sits between two frozen ridges, its villages built from dark stone and "
+        "copper roofs turned green with age. Lanterns burn through the long twilight, markets "
+        "trade in maps and rumours, and an abandoned observatory watches over the pass. "
+    ),
+}
+HEROES = ['Mara Quill', 'Ivo Brand', 'Sela Dunmore', 'Tobin Reyes', 'Anwen Hale']
+IMAGE_PROMPT_TEXT = (
+    "detailed digital painting, cinematic lighting, a lone figure in a weathered green coat, "
+    "soft volumetric fog, rich colour palette, highly detailed, sharp focus"
+)
+
+FOLDED_PROMPTS = {
+    'character': "portrait of 32 year old wiry traveller, close-cropped dark hair, grey eyes, weathered green coat",
+    'background': "frozen mountain valley, dark stone village with copper roofs, long twilight, lantern glow, landscape",
+}
+
+
+class LatencyDistribution:
+    """
+    Seconds to wait, parsed from 'fixed:S', 'uniform:LOW:HIGH', 'normal:MEAN:SD' or
+    'lognormal:MEDIAN:SIGMA' (a heavy right tail like real model servers)
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        kind, *params = spec.split(':')
+        try:
+            params = [float(p) for p in params]
+        except ValueError:
+            raise ValueError(f"Invalid latency spec {spec!r}")
+        expected = {'fixed': 1, 'uniform': 2, 'normal': 2, 'lognormal': 2}
+        if kind not in expected or len(params) != expected[kind]:
+            raise ValueError(f"Invalid latency spec {spec!r}; use fixed:S, uniform:A:B, normal:M:SD or lognormal:MEDIAN:SIGMA")
+        self.kind = kind
+        self.params = params
+
+    def sample(self, rng):
+        if self.kind == 'fixed':
+            value = self.params[0]
+        elif self.kind == 'uniform':
+            value = rng.uniform(*self.params)
+        elif self.kind == 'normal':
+            value = rng.gauss(*self.params)
+        else:
+            median, sigma = self.params
+            value = rng.lognormvariate(0, sigma) * median
+        return max(0.0, value)
+
+    def __str__(self):
+        return self.spec
+
+
+class StandinConfig:
+    """Behaviour of the stand-in services; rates are probabilities per request"""
+
+    def __init__(self, ollama_latency='lognormal:4:0.4', hf_latency='lognormal:6:0.5',
+                 stability_latency='lognormal:8:0.3', hf_loading_rate=0.1, hf_timeout_rate=0.02,
+                 hf_error_rate=0.0, stability_error_rate=0.0, hang_seconds=45.0,
+                 loading_estimated_time=20.0, seed=None):
+        self.ollama_latency = LatencyDistribution(ollama_latency)
+        self.hf_latency = LatencyDistribution(hf_latency)
+        self.stability_latency = LatencyDistribution(stability_latency)
+        self.hf_loading_rate = hf_loading_rate
+        self.hf_timeout_rate = hf_timeout_rate
+        self.hf_error_rate = hf_error_rate
+        self.stability_error_rate = stability_error_rate
+        self.hang_seconds = hang_seconds
+        self.loading_estimated_time = loading_estimated_time
+        self.rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    def sample(self, distribution):
+        with self._rng_lock:
+            return distribution.sample(self.rng)
+
+    def chance(self, rate):
+        with self._rng_lock:
+            return self.rng.random() < rate
+
+    def choice(self, options):
+        with self._rng_lock:
+            return self.rng.choice(options)
+
+
+_image_cache = {}
+_image_cache_lock = threading.Lock()
+
+
+def synthetic_png(width, height, variant=0):
+    """A gradient 'painting' with a few soft shapes, PNG encoded and cached per size/variant"""
+    key = (width, height, variant)
+    with _image_cache_lock:
+        cached = _image_cache.get(key)
+    if cached is not None:
+        return cached
+
+    rng = random.Random(hash(key))
+    top = tuple(rng.randint(20, 120) for _ in range(3))
+    bottom = tuple(rng.randint(120, 240) for _ in range(3))
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.composite(Image.new('RGB', (width, height), bottom),
+                            Image.new('RGB', (width, height), top), gradient)
+    draw = ImageDraw.Draw(image)
+    for _ in range(6):
+        x, y = rng.randint(0, width), rng.randint(0, height)
+        radius = rng.randint(min(width, height) // 12, min(width, height) // 4)
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius),
+                     fill=tuple(rng.randint(0, 255) for _ in range(3)))
+    image = image.filter(ImageFilter.GaussianBlur(radius=6))
+
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    data = buffer.getvalue()
+    with _image_cache_lock:
+        _image_cache[key] = data
+    return data
+
+
+def synthetic_story_text(prompt, rng_choice):
+    """Output shaped like the real model's: section headers for the story prompt, a phrase otherwise"""
+    if '**[STORY]**' not in prompt:
+        return IMAGE_PROMPT_TEXT
+    hero = rng_choice(HEROES)
+    text = (
+        f"**[STORY]**\n{STORY_SECTIONS['story'].format(hero=hero) * 4}\n\n"
+        f"**[CHARACTER]**\n{STORY_SECTIONS['character'].format(hero=hero) * 2}\n\n"
+        f"**[BACKGROUND]**\n{STORY_SECTIONS['background'].format(hero=hero) * 2}"
+    )
+    if '**[CHARACTER_PROMPT]**' in prompt:
+        # IMAGE_PROMPT_MODE='folded' asks for the image prompts in the same response
+        text += (
+            f"\n\n**[CHARACTER_PROMPT]**\n{FOLDED_PROMPTS['character']}\n\n"
+            f"**[BACKGROUND_PROMPT]**\n{FOLDED_PROMPTS['background']}"
+        )
+    return text
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'StoryStandins/1.0'
+
+    HF_ROUTE = re.compile(r'^/models/(?P<model>.+)$')
+    STABILITY_ROUTE = re.compile(r'^/v1/generation/(?P<engine>[^/]+)/text-to-image$')
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            return self._json(200, {'models': [{'name': 'gemma:2b', 'model': 'gemma:2b'}]})
+        if self.path == '/api/version':
+            return self._json(200, {'version': '0.0.0-standin'})
+        if self.path == '/_standin/stats':
+            return self._json(200, self.server.stats_snapshot())
+        return self._json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._json(400, {'error': 'Invalid JSON body'})
+
+        if self.path == '/api/generate':
+            return self._ollama_generate(body)
+        match = self.HF_ROUTE.match(self.path)
+        if match:
+            return self._huggingface(match.group('model'), body)
+        match = self.STABILITY_ROUTE.match(self.path)
+        if match:
+            return self._stability(body)
+        return self._json(404, {'error': f"Unknown path {self.path}"})
+
+    def _ollama_generate(self, body):
+        text = synthetic_story_text(body.get('prompt', ''), self.config.choice)
+        total = self.config.sample(self.config.ollama_latency)
+        model = body.get('model', 'gemma:2b')
+
+        if body.get('stream', True) is False:
+            time.sleep(total)
+            self.server.count('ollama', 'success')
+            return self._json(200, self._ollama_chunk(model, text, done=True, total=total, eval_count=len(text.split())))
+
+        # Stream words spread over the sampled generation time, like tokens arriving
+        words = text.split(' ')
+        chunk_size = max(1, len(words) // 20)
+        chunks = [' '.join(words[i:i + chunk_size]) + ' ' for i in range(0, len(words), chunk_size)]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for chunk in chunks:
+            time.sleep(total / len(chunks))
+            self._write_chunk(json.dumps(self._ollama_chunk(model, chunk, done=False)) + '\n')
+        self._write_chunk(json.dumps(self._ollama_chunk(model, '', done=True, total=total, eval_count=len(words))) + '\n')
+        self._write_chunk('')
+        self.server.count('ollama', 'success')
+
+    def _ollama_chunk(self, model, text, done, total=0.0, eval_count=0):
+        chunk = {'model': model, 'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ'), 'response': text, 'done': done}
+        if done:
+            # One "token" per word; generation time is the whole sampled latency
+            chunk.update(done_reason='stop', total_duration=int(total * 1e9), eval_count=eval_count,
+                         eval_duration=int(total * 1e9))
+        return chunk
+
+    def _huggingface(self, model, body):
+        config = self.config
+        if config.chance(config.hf_timeout_rate):
+            # Outlast the client's timeout, then answer anyway
+            time.sleep(config.hang_seconds)
+            self.server.count('huggingface', 'timeout')
+            return self._json(504, {'error': 'Gateway timeout'})
+        if config.chance(config.hf_loading_rate):
+            self.server.count('huggingface', 'loading')
+            return self._json(503, {'error': f"Model {model} is currently loading",
+                                    'estimated_time': config.loading_estimated_time})
+
+        parameters = body.get('parameters', {})
+        # Diffusion time grows with the step count; the latency is for the standard 25 steps
+        time.sleep(config.sample(config.hf_latency) * int(parameters.get('num_inference_steps', 25)) / 25)
+        if config.chance(config.hf_error_rate):
+            self.server.count('huggingface', 'error')
+            return self._json(500, {'error': 'Internal server error'})
+
+        data = synthetic_png(int(parameters.get('width', 512)), int(parameters.get('height', 768)),
+                             config.choice(range(IMAGE_VARIANTS)))
+        self.server.count('huggingface', 'success')
+        self._send(200, data, 'image/png')
+
+    def _stability(self, body):
+        config = self.config
+        time.sleep(config.sample(config.stability_latency))
+        if config.chance(config.stability_error_rate):
+            self.server.count('stability', 'error')
+            return self._json(500, {'name': 'server_error', 'message': 'Stand-in failure'})
+
+        data = synthetic_png(int(body.get('width', 1024)), int(body.get('height', 1024)),
+                             config.choice(range(IMAGE_VARIANTS)))
+        self.server.count('stability', 'success')
+        self._json(200, {'artifacts': [{
+            'base64': base64.b64encode(data).decode(),
+            'seed': config.choice(range(2 ** 31)),
+            'finishReason': 'SUCCESS',
+        }]})
+
+    def _json(self, status, payload):
+        self._send(status, json.dumps(payload).encode(), 'application/json')
+
+    def _send(self, status, data, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _write_chunk(self, text):
+        data = text.encode()
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, StandinHandler)
+        self.config = config
+        self._stats = {}
+        self._stats_lock = threading.Lock()
+
+    def count(self, service, outcome):
+        with self._stats_lock:
+            key = f"{service}:{outcome}"
+            self._stats[key] = self._stats.get(key, 0) + 1
+
+    def stats_snapshot(self):
+        with self._stats_lock:
+            return dict(self._stats)
@@ -1,3 +1,820 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import shutil
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextvars import copy_context
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import admission
+from .admission import AdmissionScheduler, admission_controlled, take_tokens
+from .cache import cached_fragment, cache_stats, detail_key, get_generation, list_key
+from .characters import CharacterError, save_story_character
+from .compositor import SceneCompositor
+from .deadline import PLACEHOLDER_MODEL, can_afford, fit_timeout, remaining, start_deadline
+from .downloads import base64_decoded_size, iter_base64_chunks, parse_range_header, ranged_response
+from .export import ExportError, export_queryset, parse_since
+from .inference import OP_TRANSCRIBE, STATUS_OK, InferenceClient, InferenceError, recv_frame, send_frame
+from .models import Character, StoryGeneration, character_name_key
+from .pagination import decode_cursor, encode_cursor, keyset_page
+from .refinement import _run_refinement, refine_story, schedule_refinement
+from .search import build_match_query, like_search_filter, rebuild_search_index, search_stories
+from .services import StoryGeneratorService
+from .singleflight import Flight, _lock_is_stale, _wait_config, generation_key, join_flight
+from .views import _create_story
+
+
+def make_story(**fields):
+    return StoryGeneration.objects.create(
+        prompt=fields.pop('prompt', 'A dragon guards a library'),
+        generated_story=fields.pop('generated_story', 'Once upon a time.'),
+        **fields
+    )
+
+
+def set_created_at(story, created_at):
+    StoryGeneration.objects.filter(id=story.id).update(created_at=created_at)
+    story.created_at = created_at
+
+
+class DownloadTests(TestCase):
+    payload = bytes(range(256)) * 40
+
+    def encoded(self):
+        return base64.b64encode(self.payload).decode()
+
+    def test_parse_range_header(self):
+        self.assertEqual(parse_range_header('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range_header('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range_header('bytes=-100', 1000), (900, 999))
+        # Ranges running past the end are clipped to the file
+        self.assertEqual(parse_range_header('bytes=500-5000', 1000), (500, 999))
+        self.assertEqual(parse_range_header('bytes=-5000', 1000), (0, 999))
+
+    def test_missing_or_malformed_range_serves_everything(self):
+        for header in (None, '', 'bytes=-', 'bytes=0-9,20-29', 'items=0-9', 'bytes=a-b'):
+            self.assertIsNone(parse_range_header(header, 1000), header)
+
+    def test_unsatisfiable_range(self):
+        for header in ('bytes=1000-', 'bytes=2000-3000', 'bytes=50-10', 'bytes=-0'):
+            self.assertIs(parse_range_header(header, 1000), False, header)
+
+    def test_base64_chunks_decode_any_slice(self):
+        encoded = self.encoded()
+        self.assertEqual(base64_decoded_size(encoded), len(self.payload))
+        for start, length in ((0, len(self.payload)), (1, 10), (2, 500), (4000, 100), (len(self.payload) - 1, 1)):
+            chunks = list(iter_base64_chunks(encoded, start, length, chunk_size=48))
+            self.assertEqual(b''.join(chunks), self.payload[start:start + length], (start, length))
+            self.assertTrue(all(len(chunk) <= 48 for chunk in chunks))
+
+    def test_ranged_response(self):
+        encoded = self.encoded()
+        size = base64_decoded_size(encoded)
+
+        def respond(**headers):
+            request = RequestFactory().get('/download/', **headers)
+            return ranged_response(request, size, lambda start, length: iter_base64_chunks(encoded, start, length),
+                                   'image/png', '"v1"', filename='scene.png')
+
+        response = respond()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.payload)
+        self.assertEqual(response['Content-Length'], str(size))
+
+        response = respond(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{size}')
+        self.assertEqual(b''.join(response.streaming_content), self.payload[10:20])
+
+        self.assertEqual(respond(HTTP_RANGE=f'bytes={size}-').status_code, 416)
+        self.assertEqual(respond(HTTP_IF_NONE_MATCH='"v1"').status_code, 304)
+        # A stale If-Range gets the whole file instead of the range
+        self.assertEqual(respond(HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"v0"').status_code, 200)
+
+
+class FragmentCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_saving_or_deleting_a_story_bumps_the_list_generation(self):
+        generation = get_generation()
+        story = make_story()
+        self.assertEqual(get_generation(), generation + 1)
+
+        story.generated_story = 'A different ending.'
+        story.save()
+        self.assertEqual(get_generation(), generation + 2)
+
+        story.delete()
+        self.assertEqual(get_generation(), generation + 3)
+
+    def test_list_keys_follow_the_generation(self):
+        before = list_key('list', None, 1)
+        make_story()
+        self.assertNotEqual(list_key('list', None, 1), before)
+
+    def test_saving_a_story_drops_its_detail_fragment(self):
+        story = make_story()
+        key = detail_key(story.id, story.created_at)
+        cache.set(key, '<p>old</p>')
+        story.save()
+        self.assertIsNone(cache.get(key))
+
+    def test_cached_fragment_renders_once(self):
+        renders = []
+
+        def render():
+            renders.append(1)
+            return '<p>story</p>'
+
+        self.assertEqual(cached_fragment('detail', 'fragment', render), '<p>story</p>')
+        self.assertEqual(cached_fragment('detail', 'fragment', render), '<p>story</p>')
+        self.assertEqual(len(renders), 1)
+        self.assertEqual(cache_stats()['detail'], {'hits': 1, 'misses': 1, 'hit_ratio': 0.5})
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        self.stories = []
+        for i in range(7):
+            story = make_story(prompt=f"Story {i}", genre='horror' if i % 2 else 'fantasy')
+            # Pairs share a timestamp, so the id breaks the tie
+            set_created_at(story, now - timedelta(minutes=i // 2))
+            self.stories.append(story)
+
+    def newest_first(self, stories):
+        return [s.id for s in sorted(stories, key=lambda s: (s.created_at, s.id), reverse=True)]
+
+    def walk(self, queryset, page_size):
+        seen, cursor = [], None
+        while True:
+            page, cursor = keyset_page(queryset, cursor, page_size)
+            seen.extend(story.id for story in page)
+            if cursor is None:
+                return seen
+
+    def test_pages_cover_every_story_once_newest_first(self):
+        self.assertEqual(self.walk(StoryGeneration.objects.all(), 3), self.newest_first(self.stories))
+
+    def test_filtered_pages(self):
+        horror = [s for s in self.stories if s.genre == 'horror']
+        self.assertEqual(self.walk(StoryGeneration.objects.filter_listing(genre='horror'), 2), self.newest_first(horror))
+
+    def test_malformed_cursor_starts_from_the_top(self):
+        self.assertIsNone(decode_cursor('not a cursor!'))
+        first, _ = keyset_page(StoryGeneration.objects.all(), None, 3)
+        page, _ = keyset_page(StoryGeneration.objects.all(), 'not a cursor!', 3)
+        self.assertEqual([s.id for s in page], [s.id for s in first])
+
+    def test_cursor_round_trips(self):
+        story = self.stories[0]
+        self.assertEqual(decode_cursor(encode_cursor(story.created_at, story.id)), (story.created_at, story.id))
+
+    def test_listing_flags_stored_scenes(self):
+        StoryGeneration.objects.filter(id=self.stories[0].id).update(combined_scene_data='aGVsbG8=')
+        flags = dict(StoryGeneration.objects.for_listing().values_list('id', 'has_scene'))
+        self.assertTrue(flags[self.stories[0].id])
+        self.assertFalse(flags[self.stories[1].id])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.in_prompt = make_story(prompt='A dragon guards the library', generated_story='The keeper slept.')
+        self.in_story = make_story(prompt='A quiet harbor', generated_story='Far away, a dragon circled the bay.')
+        self.other = make_story(prompt='A robot learns to paint', generated_story='Colors everywhere.')
+
+    def ids(self, text):
+        return [story.id for story, _ in search_stories(text)]
+
+    def test_matches_rank_prompt_hits_first(self):
+        self.assertEqual(self.ids('dragon'), [self.in_prompt.id, self.in_story.id])
+        _, snippet = search_stories('dragon')[0]
+        self.assertIn('<mark>dragon</mark>', snippet)
+
+    def test_last_word_matches_as_a_prefix(self):
+        self.assertEqual(self.ids('rob'), [self.other.id])
+        self.assertEqual(build_match_query('golden drag'), '"golden" "drag"*')
+
+    def test_query_syntax_in_user_input_is_inert(self):
+        self.assertEqual(self.ids('dragon" OR robot NEAR('), [])
+        self.assertIsNone(build_match_query('"*()'))
+        self.assertEqual(self.ids('"*()'), [])
+
+    def test_triggers_follow_updates_and_deletes(self):
+        self.other.generated_story = 'A dragon made of tin.'
+        self.other.save()
+        self.assertIn(self.other.id, self.ids('dragon'))
+        self.assertEqual(self.ids('colors'), [])
+
+        self.in_prompt.delete()
+        self.assertNotIn(self.in_prompt.id, self.ids('dragon'))
+
+    def test_rebuild_keeps_the_same_results(self):
+        self.assertTrue(rebuild_search_index())
+        self.assertEqual(self.ids('dragon'), [self.in_prompt.id, self.in_story.id])
+
+    def test_like_fallback_needs_every_word(self):
+        matches = StoryGeneration.objects.filter(like_search_filter('dragon bay')).values_list('id', flat=True)
+        self.assertEqual(list(matches), [self.in_story.id])
+
+
+class CompositorTests(TestCase):
+    def setUp(self):
+        self.compositor = SceneCompositor()
+        self.position = self.compositor._analyze_positioning('', '')
+
+    def character(self):
+        # Dark figure on the white backdrop the character prompts ask for
+        image = Image.new('RGB', (400, 600), (255, 255, 255))
+        image.paste((30, 60, 90), (100, 100, 300, 500))
+        return image
+
+    def background(self):
+        return Image.new('RGB', (1024, 768), (200, 40, 40))
+
+    def test_compose_returns_background_sized_scene(self):
+        scene, position = self.compositor.compose(
+            self.character(), self.background(), 'A knight', 'A castle', 'fantasy', remove_background=False
+        )
+        self.assertEqual(scene.size, (800, 600))
+        self.assertEqual(scene.mode, 'RGB')
+        self.assertEqual(position['char_position'], 'center')
+
+    def test_character_is_shrunk_with_white_made_transparent(self):
+        prepared = self.compositor._prepare_character_for_composition(self.character(), self.position)
+        target = int(400 * self.position['char_size_factor'])
+        expected = (int(target * 400 / 600), target)
+        self.assertEqual(prepared.mode, 'RGBA')
+        self.assertEqual(prepared.size, (int(expected[0] * 0.55), int(expected[1] * 0.55)))
+        self.assertEqual(prepared.getpixel((0, 0))[3], 0)
+        self.assertEqual(prepared.getpixel((prepared.width // 2, prepared.height // 2))[3], 255)
+
+    def test_character_falls_back_to_plain_resize(self):
+        prepared = self.compositor._prepare_character_for_composition(self.character(), {})
+        self.assertEqual(prepared.size, (300, 400))
+
+    def test_background_is_resized_to_scene_size(self):
+        prepared = self.compositor._prepare_background_for_composition(self.background(), self.position)
+        self.assertEqual(prepared.size, (800, 600))
+
+    def test_composite_pastes_through_alpha(self):
+        character = self.compositor._prepare_character_for_composition(self.character(), self.position)
+        background = self.compositor._prepare_background_for_composition(self.background(), self.position)
+        scene = self.compositor._composite_final_scene(character, background, self.position, remove_background=False)
+
+        x_offset = (background.width - character.width) // 2
+        y_offset = max(0, min(int(background.height * self.position['char_vertical_pos'] - character.height),
+                              background.height - character.height))
+        self.assertEqual(scene.size, background.size)
+        # The transparent corner shows the background, the figure covers it
+        self.assertEqual(scene.getpixel((x_offset, y_offset)), background.getpixel((x_offset, y_offset)))
+        center = (x_offset + character.width // 2, y_offset + character.height // 2)
+        self.assertEqual(scene.getpixel(center), (30, 60, 90))
+
+    def test_composite_falls_back_to_side_by_side(self):
+        character = Image.new('RGB', (200, 700), (0, 0, 0))
+        background = Image.new('RGB', (800, 600), (255, 0, 0))
+        scene = self.compositor._composite_final_scene(character, background, {}, remove_background=False)
+        self.assertEqual(scene.size, (1000, 700))
+        self.assertEqual(scene.getpixel((10, 10)), (255, 0, 0))
+        self.assertEqual(scene.getpixel((810, 10)), (0, 0, 0))
+
+    def test_benchmark_without_a_baseline_fails(self):
+        missing = os.path.join(tempfile.gettempdir(), 'no-such-dir', 'compositor_baseline.json')
+        with self.assertRaisesMessage(CommandError, 'run with --save-baseline'):
+            call_command('benchmark_compositor', baseline=missing, stdout=StringIO())
+
+
+class InferenceClientTests(TestCase):
+    def serve(self, respond):
+        """Scratch sidecar answering each op with ``respond(op)``, or hanging up when it returns None"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, True)
+        received = []
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                while True:
+                    frame = recv_frame(self.request)
+                    if frame is None:
+                        return
+                    received.append(frame[0])
+                    response = respond(frame[0])
+                    if response is None:
+                        return
+                    send_frame(self.request, *response)
+
+        server = socketserver.ThreadingUnixStreamServer(os.path.join(directory, 'sidecar.sock'), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return InferenceClient(server.server_address, timeout=5), received
+
+    def test_request_is_resent_after_a_dropped_idle_connection(self):
+        client, received = self.serve(lambda op: (STATUS_OK, {'text': 'Once upon a time'}, b''))
+        # A connection whose sidecar end went away while idle
+        stale, peer = socket.socketpair()
+        peer.close()
+        client._local.sock = stale
+
+        self.assertEqual(client.transcribe(b'audio')['text'], 'Once upon a time')
+        self.assertEqual(received, [OP_TRANSCRIBE])
+
+    def test_sent_request_is_not_repeated(self):
+        client, received = self.serve(lambda op: None)
+        with self.assertRaises(InferenceError):
+            client.transcribe(b'audio')
+        self.assertEqual(received, [OP_TRANSCRIBE])
+
+
+ADMISSION = {
+    'ENABLED': True,
+    'CAPACITY': 1,
+    'MAX_QUEUE': 4,
+    'MAX_WAIT': 0.05,
+    'AGING_SECONDS': 1000,
+    'RATE_PER_MINUTE': 600,
+    'BURST': 20,
+    'TRUST_X_FORWARDED_FOR': False,
+}
+
+
+@override_settings(STORY_ADMISSION=ADMISSION)
+class AdmissionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = RequestFactory()
+        self.scheduler = AdmissionScheduler()
+        patcher = mock.patch.object(admission, 'scheduler', self.scheduler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.view = admission_controlled(lambda request: HttpResponse('ok'))
+
+    def post(self, length='short', client='10.0.0.1'):
+        return self.factory.post('/generate/', {'prompt': 'A dragon', 'story_length': length}, REMOTE_ADDR=client)
+
+    def test_queue_is_served_by_priority(self):
+        admitted = []
+        self.assertEqual(self.scheduler.enqueue('medium', lambda: None, ADMISSION)[0], 'admitted')
+        for request_class in ('audio', 'long', 'medium', 'short'):
+            state, _ = self.scheduler.enqueue(request_class, lambda c=request_class: admitted.append(c), ADMISSION)
+            self.assertEqual(state, 'queued')
+        for cost in (1, 1, 1, 2):
+            self.scheduler.release(cost, 1.0, ADMISSION)
+        self.assertEqual(admitted, ['short', 'medium', 'long', 'audio'])
+
+    def test_aging_lets_an_old_heavy_request_go_first(self):
+        admitted = []
+        config = {**ADMISSION, 'AGING_SECONDS': 10}
+        self.scheduler.enqueue('medium', lambda: None, config)
+        _, audio = self.scheduler.enqueue('audio', lambda: admitted.append('audio'), config)
+        self.scheduler.enqueue('short', lambda: admitted.append('short'), config)
+        audio.enqueued_at -= 60
+        self.scheduler.release(1, 1.0, config)
+        self.assertEqual(admitted, ['audio'])
+
+    def test_queue_full(self):
+        config = {**ADMISSION, 'MAX_QUEUE': 1}
+        self.scheduler.enqueue('short', lambda: None, config)
+        self.assertEqual(self.scheduler.enqueue('short', lambda: None, config)[0], 'queued')
+        self.assertEqual(self.scheduler.enqueue('short', lambda: None, config)[0], 'full')
+
+    def test_rate_limit_returns_429(self):
+        with override_settings(STORY_ADMISSION={**ADMISSION, 'RATE_PER_MINUTE': 1, 'BURST': 2}):
+            self.assertEqual(self.view(self.post('long')).status_code, 200)
+            response = self.view(self.post('long'))
+            other_client = self.view(self.post('long', client='10.0.0.2'))
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(other_client.status_code, 200)
+
+    def test_token_bucket_refills(self):
+        config = {**ADMISSION, 'RATE_PER_MINUTE': 60, 'BURST': 1}
+        self.assertEqual(take_tokens('client', 1, config), 0)
+        self.assertAlmostEqual(take_tokens('client', 1, config), 1.0, places=1)
+
+    def test_full_queue_returns_503(self):
+        with override_settings(STORY_ADMISSION={**ADMISSION, 'MAX_QUEUE': 0}):
+            self.scheduler.enqueue('short', lambda: None, ADMISSION)
+            response = self.view(self.post())
+        self.assertEqual(response.status_code, 503)
+        self.assertIn('Retry-After', response)
+
+    def test_queue_timeout_returns_503(self):
+        self.scheduler.enqueue('short', lambda: None, ADMISSION)
+        response = self.view(self.post())
+        self.assertEqual(response.status_code, 503)
+        # The timed-out waiter left the queue
+        self.assertEqual(self.scheduler.enqueue('short', lambda: None, {**ADMISSION, 'MAX_QUEUE': 1})[0], 'queued')
+
+    def test_admitted_request_releases_capacity(self):
+        self.assertEqual(self.view(self.post('audio')).status_code, 200)
+        self.assertEqual(self.scheduler.enqueue('audio', lambda: None, ADMISSION)[0], 'admitted')
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.config = {
+            'ENABLED': True,
+            'DIRECTORY': self.directory,
+            'WAIT_TIMEOUT': 2,
+            'STALE_AFTER': 900,
+            'POLL_INTERVAL': 0.01,
+        }
+
+    def key(self, **data):
+        return generation_key(self.factory.post('/generate/', {'genre': 'fantasy', 'story_length': 'short', **data}))
+
+    def write_lock(self, key, pid, created):
+        path = os.path.join(self.directory, f"{key}.lock")
+        with open(path, 'w') as f:
+            f.write(f"{socket.gethostname()} {pid} {created}")
+        return path
+
+    def dead_pid(self):
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        return process.pid
+
+    def test_key_ignores_case_and_spacing(self):
+        self.assertEqual(self.key(prompt='A  dragon\n guards the Library '), self.key(prompt='a dragon guards the library'))
+        self.assertEqual(self.key(prompt='A dragon'), self.key(prompt='A dragon', input_type='text'))
+
+    def test_key_depends_on_the_other_inputs(self):
+        base = self.key(prompt='A dragon')
+        self.assertNotEqual(base, self.key(prompt='A dragon', genre='horror'))
+        self.assertNotEqual(base, self.key(prompt='A dragon', story_length='long'))
+        self.assertNotEqual(base, self.key(prompt='A dragon', character='Mira'))
+        self.assertIsNone(self.key(prompt='   '))
+
+    def test_live_lock_is_respected(self):
+        path = self.write_lock('k', os.getpid(), time.time())
+        self.assertFalse(_lock_is_stale(path, self.config))
+        flight = join_flight('k', {**self.config, 'WAIT_TIMEOUT': 0.05})
+        self.assertFalse(flight.leader)
+        self.assertIsNone(flight.result)
+
+    def test_lock_of_dead_owner_is_taken_over(self):
+        path = self.write_lock('k', self.dead_pid(), time.time())
+        self.assertTrue(_lock_is_stale(path, self.config))
+        flight = join_flight('k', self.config)
+        self.assertTrue(flight.leader)
+        with open(path) as f:
+            self.assertEqual(int(f.read().split()[1]), os.getpid())
+        flight.release()
+
+    def test_old_lock_is_taken_over(self):
+        self.write_lock('k', os.getpid(), time.time() - 1000)
+        flight = join_flight('k', self.config)
+        self.assertTrue(flight.leader)
+        flight.release()
+
+    def test_finished_result_is_not_reused(self):
+        leader = join_flight('k', self.config)
+        leader.publish({'story_id': 1})
+        again = join_flight('k', self.config)
+        self.assertTrue(again.leader)
+        again.release()
+
+    def test_concurrent_duplicate_gets_the_result(self):
+        path = os.path.join(self.directory, 'k.json')
+        leader = Flight('k', self.config, leader=True)
+        self.write_lock('k', os.getpid(), time.time())
+
+        def publish_later(*args):
+            with open(path, 'w') as f:
+                json.dump({'created_at': time.time(), 'story_id': 7}, f)
+
+        with mock.patch('story_app.singleflight.time.sleep', side_effect=publish_later):
+            follower = join_flight('k', self.config)
+        self.assertFalse(follower.leader)
+        self.assertEqual(follower.result['story_id'], 7)
+        leader.release()
+
+    @override_settings(STORY_DEADLINE={'ENABLED': True, 'BUDGET': 30, 'RESERVE': 5})
+    def test_wait_is_capped_by_the_deadline_budget(self):
+        self.assertEqual(_wait_config({**self.config, 'WAIT_TIMEOUT': 300})['WAIT_TIMEOUT'], 25)
+
+
+class DeadlineTests(TestCase):
+    def run_in_context(self, func):
+        # The deadline is a ContextVar; keep it from leaking into other tests
+        return copy_context().run(func)
+
+    @override_settings(STORY_DEADLINE={'ENABLED': True, 'BUDGET': 30, 'RESERVE': 5})
+    def test_time_already_spent_shrinks_the_budget(self):
+        def check():
+            start_deadline(already_spent=10)
+            self.assertAlmostEqual(remaining(), 15, delta=0.5)
+            self.assertLessEqual(fit_timeout(60), 15)
+            self.assertEqual(fit_timeout(5), 5)
+            self.assertAlmostEqual(fit_timeout(60, share=0.5), 7.5, delta=0.5)
+            self.assertTrue(can_afford(10))
+            self.assertFalse(can_afford(20))
+        self.run_in_context(check)
+
+    @override_settings(STORY_DEADLINE={'ENABLED': True, 'BUDGET': 30, 'RESERVE': 5})
+    def test_exhausted_budget_leaves_a_minimal_timeout(self):
+        def check():
+            start_deadline(already_spent=40)
+            self.assertEqual(remaining(), 0)
+            self.assertEqual(fit_timeout(60), 0.1)
+            self.assertFalse(can_afford(1))
+        self.run_in_context(check)
+
+    @override_settings(STORY_DEADLINE={'ENABLED': False})
+    def test_disabled_deadline_leaves_timeouts_alone(self):
+        def check():
+            self.assertIsNone(start_deadline(already_spent=10))
+            self.assertIsNone(remaining())
+            self.assertEqual(fit_timeout(60), 60)
+            self.assertTrue(can_afford(1000))
+        self.run_in_context(check)
+
+    @override_settings(STORY_DEADLINE={'ENABLED': True, 'BUDGET': 30, 'RESERVE': 5})
+    def test_exhausted_budget_stores_a_placeholder_without_image_data(self):
+        # Rendering needs no model clients
+        service = StoryGeneratorService.__new__(StoryGeneratorService)
+        service.image_tier = 'standard'
+
+        def render():
+            start_deadline(already_spent=40)
+            return service.render_image('a castle at night', 'background', 'horror')
+        result = self.run_in_context(render)
+        self.assertIsNone(result['image_data'])
+
+        story = make_story(genre='horror', background_image_data=result['image_data'],
+                           background_image_model=result['model_used'])
+        self.assertTrue(story.background_image_placeholder)
+        self.assertFalse(story.has_background_image)
+        self.assertIn('#7a0c12', story.placeholder_css)
+
+
+FOLDED_RESPONSE = """**[STORY]**
+Mira found the map under the floorboards.
+
+She followed it to the sea.
+
+**[CHARACTER]**
+Mira is a young cartographer with short red hair and a green coat.
+
+**[BACKGROUND]**
+A windswept harbor town of stone houses at dusk.
+
+**[CHARACTER_PROMPT]**
+"young woman, short red hair, green coat, holding a map, white background"
+
+**[BACKGROUND_PROMPT]**
+harbor town, stone houses, dusk, windswept, no people, landscape
+"""
+
+
+class ParseResponseTests(TestCase):
+    def service(self, mode):
+        # Parsing needs no model clients
+        service = StoryGeneratorService.__new__(StoryGeneratorService)
+        service.image_prompt_mode = mode
+        return service
+
+    def test_folded_response_yields_sections_and_image_prompts(self):
+        parsed = self.service('folded')._parse_response(FOLDED_RESPONSE)
+        self.assertEqual(parsed['story'], "Mira found the map under the floorboards.\n\nShe followed it to the sea.")
+        self.assertEqual(parsed['character_description'],
+                         "Mira is a young cartographer with short red hair and a green coat.")
+        self.assertEqual(parsed['background_description'], "A windswept harbor town of stone houses at dusk.")
+        self.assertEqual(parsed['character_image_prompt'],
+                         "young woman, short red hair, green coat, holding a map, white background")
+        self.assertEqual(parsed['background_image_prompt'],
+                         "harbor town, stone houses, dusk, windswept, no people, landscape")
+
+    def test_sequential_mode_ignores_image_prompt_sections(self):
+        parsed = self.service('sequential')._parse_response(FOLDED_RESPONSE)
+        self.assertEqual(parsed['background_description'], "A windswept harbor town of stone houses at dusk.")
+        self.assertNotIn('character_image_prompt', parsed)
+
+    def test_malformed_image_prompts_are_left_out(self):
+        response = FOLDED_RESPONSE.split('**[CHARACTER_PROMPT]**')[0] + "**[CHARACTER_PROMPT]**\nshort\n"
+        parsed = self.service('folded')._parse_response(response)
+        self.assertEqual(parsed['background_description'], "A windswept harbor town of stone houses at dusk.")
+        self.assertNotIn('character_image_prompt', parsed)
+        self.assertNotIn('background_image_prompt', parsed)
+
+
+@override_settings(STORY_IMAGE_QUALITY={'REFINE': True, 'REFINE_TIER': 'high'})
+class RefinementTests(TestCase):
+    def setUp(self):
+        self.story = make_story(
+            character_image_data='c0', character_image_prompt='a knight', character_image_tier='draft',
+            background_image_data='b0', background_image_prompt='a castle', background_image_tier='draft',
+        )
+        patcher = mock.patch('story_app.refinement._service')
+        self.service = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def rendered(self, full_prompt, image_type, genre):
+        return {'image_data': f'{image_type}-hq', 'model_used': 'hq/model', 'success': True, 'tier': 'high'}
+
+    def test_schedule_marks_draft_story_pending(self):
+        with mock.patch('story_app.refinement._get_executor') as get_executor:
+            self.assertTrue(schedule_refinement(self.story))
+        get_executor.return_value.submit.assert_called_once_with(_run_refinement, self.story.id)
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.refinement_status, 'pending')
+        self.assertTrue(self.story.is_refining)
+
+    def test_schedule_skips_stories_already_at_the_target_tier(self):
+        StoryGeneration.objects.filter(id=self.story.id).update(character_image_tier='high', background_image_tier='high')
+        self.story.refresh_from_db()
+        with mock.patch('story_app.refinement._get_executor') as get_executor:
+            self.assertFalse(schedule_refinement(self.story))
+        get_executor.assert_not_called()
+        self.assertIsNone(self.story.refinement_status)
+
+    def test_refined_images_replace_drafts_and_mark_done(self):
+        self.service.render_image.side_effect = self.rendered
+        self.service.combine_images_into_scene.return_value = {
+            'image_data': 'scene-hq', 'prompt': 'scene', 'model_used': 'PIL+OpenCV_compositor',
+            'success': True, 'composition_info': {},
+        }
+        refine_story(self.story.id)
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.refinement_status, 'done')
+        self.assertEqual(self.story.character_image_data, 'character-hq')
+        self.assertEqual(self.story.background_image_tier, 'high')
+        self.assertEqual(self.story.combined_scene_data, 'scene-hq')
+        self.assertEqual(self.story.combined_scene_tier, 'high')
+        self.assertEqual(self.story.content_updated_at, self.story.refined_at)
+
+    def test_unrendered_images_mark_failed_and_keep_drafts(self):
+        self.service.render_image.return_value = {'success': False, 'model_used': 'placeholder'}
+        with mock.patch('story_app.refinement.invalidate_story') as invalidate:
+            self.assertEqual(refine_story(self.story.id), {})
+        invalidate.assert_not_called()
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.refinement_status, 'failed')
+        self.assertIsNone(self.story.refined_at)
+        self.assertEqual(self.story.character_image_data, 'c0')
+        self.assertEqual(self.story.background_image_tier, 'draft')
+
+    def test_render_error_marks_failed(self):
+        self.service.render_image.side_effect = RuntimeError('provider down')
+        with self.assertRaises(RuntimeError):
+            refine_story(self.story.id)
+        self.story.refresh_from_db()
+        self.assertEqual(self.story.refinement_status, 'failed')
+        self.assertIsNone(self.story.refined_at)
+
+
+class ExportWatermarkTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.stories = [make_story(prompt=f"Story {i}") for i in range(4)]
+        # The last two share a timestamp
+        for story, minutes in zip(self.stories, (3, 2, 1, 1)):
+            set_created_at(story, self.now - timedelta(minutes=minutes))
+
+    def ids(self, queryset):
+        return list(queryset.values_list('id', flat=True))
+
+    def test_full_export_is_oldest_first_and_ends_at_the_newest_row(self):
+        queryset, watermark = export_queryset()
+        self.assertEqual(self.ids(queryset), [s.id for s in self.stories])
+        self.assertEqual(parse_since(watermark), (self.stories[-1].created_at, self.stories[-1].id))
+
+    def test_incremental_export_resumes_after_the_watermark(self):
+        _, watermark = export_queryset()
+        new = make_story(prompt="Story 4")
+        queryset, next_watermark = export_queryset(since=watermark)
+        self.assertEqual(self.ids(queryset), [new.id])
+        self.assertEqual(parse_since(next_watermark)[1], new.id)
+
+    def test_watermark_splits_rows_sharing_a_timestamp(self):
+        middle = self.stories[2]
+        queryset, _ = export_queryset(since=encode_cursor(middle.created_at, middle.id))
+        self.assertEqual(self.ids(queryset), [self.stories[3].id])
+
+    def test_nothing_new_keeps_the_watermark(self):
+        _, watermark = export_queryset()
+        queryset, next_watermark = export_queryset(since=watermark)
+        self.assertEqual(self.ids(queryset), [])
+        self.assertEqual(next_watermark, watermark)
+
+    def test_timestamp_watermark(self):
+        since = (self.now - timedelta(minutes=2)).isoformat()
+        queryset, _ = export_queryset(since=since)
+        self.assertEqual(self.ids(queryset), [self.stories[2].id, self.stories[3].id])
+
+    def test_invalid_watermark(self):
+        with self.assertRaises(ExportError):
+            parse_since('not a watermark')
+
+
+class StorySceneTests(TestCase):
+    def scene(self, order, **result):
+        return {'order': order, 'text': f'Scene text {order}.', 'image_prompt': f'prompt {order}',
+                'background_model': 'some/model', 'tier': 'standard', 'image_data': None,
+                'model_used': None, 'composition_info': None, 'success': False, **result}
+
+    def save(self, scenes):
+        return _create_story({
+            'story': 'The knight rode out. The castle burned.',
+            'character_description': 'A tired knight.',
+            'background_description': 'A burning castle.',
+            'scenes': scenes,
+        }, 'A knight', None, 'fantasy', 'short')
+
+    def test_scene_results_are_saved_in_story_order(self):
+        story = self.save([
+            self.scene(1, background_model=PLACEHOLDER_MODEL, tier=None),
+            self.scene(0, image_data='c2NlbmU=', model_used='PIL+OpenCV_compositor', success=True),
+            self.scene(2, image_data=''),
+        ])
+        first, placeholder, failed = story.scenes.all()
+        self.assertEqual([first.order, placeholder.order, failed.order], [0, 1, 2])
+        self.assertEqual(first.text, 'Scene text 0.')
+        self.assertEqual(first.image_model, 'PIL+OpenCV_compositor')
+        self.assertIsNotNone(first.image_url)
+        self.assertFalse(first.is_placeholder)
+        self.assertTrue(placeholder.is_placeholder)
+        self.assertIsNone(placeholder.image_url)
+        # An empty image is stored as NULL, like the story's own images
+        self.assertIsNone(failed.image_data)
+        self.assertFalse(failed.is_placeholder)
+
+    def test_story_without_scenes_saves_none(self):
+        story = self.save([])
+        self.assertFalse(story.scenes.exists())
+
+    def test_story_page_shows_scene_gallery_with_placeholders(self):
+        story = self.save([
+            self.scene(0, image_data='c2NlbmU=', model_used='PIL+OpenCV_compositor', success=True),
+            self.scene(1, background_model=PLACEHOLDER_MODEL, tier=None),
+        ])
+        response = self.client.get(reverse('story_detail', args=[story.id]))
+        self.assertContains(response, 'Story in Scenes')
+        self.assertContains(response, 'aria-label="Scene 2 placeholder"')
+        self.assertNotContains(response, f'Background: {PLACEHOLDER_MODEL}')
+
+
+class CharacterNameKeyTests(TestCase):
+    def create(self, name):
+        return Character.objects.create(name=name, description='A young cartographer with red hair')
+
+    def test_name_key_ignores_case_and_spacing(self):
+        self.assertEqual(character_name_key('  Mira   the\tBold '), 'mira the bold')
+        self.assertEqual(character_name_key('STRASSE'), character_name_key('straße'))
+        self.assertEqual(character_name_key(None), '')
+
+    def test_save_sets_the_key_and_lookup_uses_it(self):
+        character = self.create('Mira the Bold')
+        self.assertEqual(character.name_key, 'mira the bold')
+        self.assertEqual(Character.objects.lookup(' MIRA  the bold'), character)
+        self.assertIsNone(Character.objects.lookup('Mira'))
+
+    def test_names_differing_only_in_case_collide(self):
+        self.create('Mira')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            self.create('  mira ')
+
+
+class SaveStoryCharacterTests(TestCase):
+    def story(self, **fields):
+        return make_story(**{'character_description': 'A young cartographer with red hair',
+                             'character_image_data': 'cG9ydHJhaXQ=', 'character_image_model': 'some/model', **fields})
+
+    def test_saving_an_existing_name_replaces_the_portrait(self):
+        first, created = save_story_character(self.story(), 'Mira')
+        self.assertTrue(created)
+        second, created = save_story_character(self.story(character_image_data='bmV3'), '  mira ')
+        self.assertFalse(created)
+        self.assertEqual(second.id, first.id)
+        self.assertEqual(Character.objects.get().image_data, 'bmV3')
+
+    def test_placeholder_portrait_is_refused(self):
+        story = self.story(character_image_data=None, character_image_model=PLACEHOLDER_MODEL)
+        with self.assertRaisesMessage(CharacterError, 'only a placeholder'):
+            save_story_character(story, 'Mira')
+        self.assertFalse(Character.objects.exists())
@@ -4,9 +4,21 @@ from . import views
 urlpatterns = [
     path('', views.index, name='index'),
     path('generate/', views.generate_story, name='generate_story'),
+    path('generate/async/', views.generate_story_async, name='generate_story_async'),
     path('story/<int:story_id>/', views.story_detail, name='story_detail'),
+    path('story/<int:story_id>/image/<str:kind>/', views.story_image, name='story_image'),
+    path('story/<int:story_id>/scenes/<int:order>/image/', views.story_scene_image, name='story_scene_image'),
     path('stories/', views.story_list, name='story_list'),
+    path('search/', views.search_stories_view, name='search_stories'),
     path('delete/<int:story_id>/', views.delete_story, name='delete_story'),
     path('download/scene/<int:story_id>/', views.download_combined_scene, name='download_combined_scene'),
     path('download/audio/<int:story_id>/', views.download_audio_file, name='download_audio_file'),
+    path('characters/', views.character_library, name='character_library'),
+    path('characters/<int:character_id>/portrait/', views.character_portrait, name='character_portrait'),
+    path('story/<int:story_id>/save-character/', views.save_character, name='save_character'),
+    path('export/', views.export_stories_view, name='export_stories'),
+    path('stats/cache/', views.cache_stats_view, name='cache_stats'),
+    path('stats/profiles/', views.profiles_view, name='profiles'),
+    path('stats/profiles/<str:file_name>', views.profile_file_view, name='profile_file'),
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
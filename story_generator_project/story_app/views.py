@@ -1,28 +1,169 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import condition, require_http_methods
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotAllowed,
+    JsonResponse, StreamingHttpResponse,
+)
+from django.template.loader import render_to_string
+from django.utils.cache import patch_cache_control
+from django.utils.safestring import mark_safe
 from django.core.files.storage import default_storage
-from .forms import StoryPromptForm
-from .models import StoryGeneration
+from .admission import admission_controlled, record_admission_wait
+from .deadline import start_deadline
+from .characters import CharacterError, record_character_use, save_story_character
+from .forms import CharacterSaveForm, ProfilerSettingsForm, StoryFilterForm, StoryPromptForm, StorySearchForm
+from .models import IMAGE_DATA_FIELDS, Character, StoryGeneration, StoryScene
 from .services import StoryGeneratorService
+from .async_services import AsyncStoryGeneratorService
+from .cache import cache_stats, cached_fragment, detail_key, list_key
+from .export import CONTENT_TYPES, ExportError, export_queryset, iter_export
+from .metrics import (
+    STORIES_GENERATED, record_stage, render_prometheus, start_stage_log, summarize_stage_log, timed_stage,
+)
+from .memory import finish_request_tracking, start_request_tracking
+from .pagination import keyset_page
+from .profiling import list_profiles, profile_path, profiler_settings, set_runtime_config
+from .refinement import schedule_refinement
+from .search import search_stories
+from .singleflight import coalesce_identical, record_flight_wait
+from .downloads import (
+    base64_decoded_size, guess_content_type, iter_base64_chunks,
+    iter_file_chunks, make_etag, not_modified, ranged_response,
+)
+from urllib.parse import urlencode
 import logging
-import base64
-from django.http import HttpResponse, Http404
-from django.utils.encoding import smart_str
 import os
+import time
 
 logger = logging.getLogger(__name__)
 
+# Metadata the audio pipelines add themselves; text-only results get it here
+TEXT_INPUT_METADATA = {
+    'input_type': 'text',
+    'success': True,
+    'audio_transcription': None,
+    'audio_duration': 0,
+    'transcription_result': None
+}
+
+def _latest_created_at():
+    """Timestamp of the newest story, used to key cached list fragments"""
+    return StoryGeneration.objects.values_list('created_at', flat=True).first()
+
+def _recent_stories_html():
+    """Render (or fetch from cache) the recent stories block on the index page"""
+    key = list_key('recent', _latest_created_at())
+    return mark_safe(cached_fragment('recent', key, lambda: render_to_string(
+        'story_app/_recent_stories.html',
+        {'recent_stories': StoryGeneration.objects.for_listing()[:5]}
+    )))
+
 def index(request):
-    """Main page with the story generation form"""
-    form = StoryPromptForm()
-    recent_stories = StoryGeneration.objects.all()[:5]
+    """Main page with the story generation form (?character=<id> preselects a library character)"""
+    initial = {'character': request.GET['character']} if request.GET.get('character', '').isdigit() else {}
+    return _index_with_form(request, StoryPromptForm(initial=initial))
+
+def _index_with_form(request, form):
     return render(request, 'story_app/index.html', {
         'form': form,
-        'recent_stories': recent_stories
+        'recent_stories_html': _recent_stories_html()
     })
 
+def _save_audio_prompt(request, audio_file):
+    """Keep the uploaded audio next to the story; returns the storage path or None"""
+    try:
+        return default_storage.save(f'audio_prompts/{audio_file.name}', audio_file)
+    except Exception as e:
+        logger.error(f"Failed to save audio file: {e}")
+        messages.warning(request, "Audio file could not be saved, but transcription was successful.")
+        return None
+
+def _create_story(complete_story, text_prompt, audio_file_saved, genre, length):
+    """Save to database with all data including audio information"""
+    story = StoryGeneration.from_story_package(complete_story, text_prompt, audio_file_saved, genre, length)
+    with timed_stage('db.save'):
+        story.save()
+        scenes = [StoryScene.from_scene_result(story, scene) for scene in complete_story.get('scenes', [])]
+        if scenes:
+            StoryScene.objects.bulk_create(scenes)
+        if story.character_id:
+            record_character_use([story.character_id])
+    # Draft-tier images are re-rendered in the background when refinement is on
+    schedule_refinement(story)
+    return story
+
+def _success_message(complete_story):
+    success_parts = []
+    
+    if complete_story.get('input_type') == 'audio':
+        success_parts.append('audio transcription')
+    elif complete_story.get('input_type') == 'both':
+        success_parts.append('text + audio processing')
+    else:
+        success_parts.append('text processing')
+    
+    # Add generated content info
+    success_parts.append('complete story')
+    
+    if complete_story.get('character_image', {}).get('success'):
+        success_parts.append('character portrait')
+    if complete_story.get('background_image', {}).get('success'):
+        success_parts.append('environment artwork')
+    if complete_story.get('combined_scene', {}).get('success'):
+        success_parts.append('combined scene composition')
+    if complete_story.get('character_name'):
+        success_parts.append(f"{complete_story['character_name']}'s saved portrait")
+    scene_count = sum(1 for scene in complete_story.get('scenes', []) if scene['success'])
+    if scene_count:
+        success_parts.append(f'{scene_count} illustrated scenes')
+    
+    # Generate success message
+    if len(success_parts) > 3:
+        success_msg = f"Complete story package ready! {', '.join(success_parts[:-1])}, and {success_parts[-1]} are all set!"
+    elif len(success_parts) > 1:
+        success_msg = f"Story package created! {', '.join(success_parts[:-1])}, and {success_parts[-1]} generated successfully!"
+    else:
+        success_msg = "Your story is ready! (Image generation encountered issues, but the story is complete)"
+    
+    # Add audio-specific info
+    if complete_story.get('audio_duration', 0) > 0:
+        duration_str = f"{complete_story['audio_duration']:.1f} seconds"
+        success_msg += f" Audio duration: {duration_str}."
+    
+    # Add transcription info if available
+    transcription_result = complete_story.get('transcription_result', {})
+    if transcription_result and transcription_result.get('success'):
+        if transcription_result.get('language'):
+            success_msg += f" Detected language: {transcription_result['language']}."
+    return success_msg
+
+def _render_story_result(request, story_obj, complete_story, genre, length):
+    with timed_stage('render.result'):
+        return render(request, 'story_app/story_result.html', {
+            'story_obj': story_obj,
+            'prompt': story_obj.effective_prompt,
+            'genre': genre.title(),
+            'length': length.title(),
+            'image_generation_attempted': True,
+            'combined_scene_generated': complete_story.get('combined_scene', {}).get('success', False),
+            'audio_processed': complete_story.get('input_type') in ['audio', 'both'],
+            'transcription_result': complete_story.get('transcription_result', {})
+        })
+
+def _store_stage_timings(story_obj, stage_log, request_started):
+    # Stored after the insert and render so the breakdown includes both
+    record_stage('request.total', time.perf_counter() - request_started)
+    memory = finish_request_tracking(f"story {story_obj.id}", stage_log)
+    story_obj.stage_timings = summarize_stage_log(stage_log, memory)
+    StoryGeneration.objects.filter(id=story_obj.id).update(stage_timings=story_obj.stage_timings)
+
 @require_http_methods(["POST"])
+@coalesce_identical
+@admission_controlled
 def generate_story(request):
     """Handle complete story generation with text and/or audio input"""
     form = StoryPromptForm(request.POST, request.FILES)
@@ -33,7 +174,12 @@ def generate_story(request):
         input_type = form.cleaned_data['input_type']
         length = form.cleaned_data['story_length']
         genre = form.cleaned_data['genre']
+        character = form.cleaned_data['character']
         
+        stage_log = start_stage_log()
+        start_deadline(already_spent=record_flight_wait(request) + record_admission_wait(request))
+        start_request_tracking()
+        request_started = time.perf_counter()
         try:
             story_service = StoryGeneratorService()
             
@@ -41,11 +187,9 @@ def generate_story(request):
             if audio_file:
                 validation_result = story_service.validate_audio_file(audio_file)
                 if not validation_result['valid']:
+                    STORIES_GENERATED.inc(input_type=input_type, outcome='invalid_audio')
                     messages.error(request, f"Audio validation failed: {validation_result['error']}")
-                    return render(request, 'story_app/index.html', {
-                        'form': form,
-                        'recent_stories': StoryGeneration.objects.all()[:5]
-                    })
+                    return _index_with_form(request, form)
                 
                 if validation_result.get('warning'):
                     messages.warning(request, validation_result['warning'])
@@ -53,161 +197,308 @@ def generate_story(request):
             # Generate story based on input type
             if input_type == 'audio' and audio_file:
                 messages.info(request, 'Transcribing audio and creating your complete story package... This may take a few moments.')
-                complete_story = story_service.generate_story_from_audio(audio_file, length, genre)
+                complete_story = story_service.generate_story_from_audio(audio_file, length, genre, character)
                 
             elif input_type == 'both' and (text_prompt or audio_file):
                 messages.info(request, 'Processing both text and audio inputs to create your story package... This may take a few moments.')
-                complete_story = story_service.generate_story_from_mixed_input(text_prompt, audio_file, length, genre)
+                complete_story = story_service.generate_story_from_mixed_input(text_prompt, audio_file, length, genre, character)
                 
             else:
                 messages.info(request, 'Creating your complete story package with images... This may take a few moments.')
-                complete_story = story_service.generate_complete_story_with_images(text_prompt, length, genre)
-                complete_story.update({
-                    'input_type': 'text',
-                    'success': True,
-                    'audio_transcription': None,
-                    'audio_duration': 0,
-                    'transcription_result': None
-                })
+                complete_story = story_service.generate_complete_story_with_images(text_prompt, length, genre, character)
+                complete_story.update(TEXT_INPUT_METADATA)
             
             # Check if story generation was successful
             if not complete_story.get('success', True):
                 error_msg = complete_story.get('error', 'Unknown error occurred during story generation')
+                STORIES_GENERATED.inc(input_type=input_type, outcome='failed')
                 messages.error(request, f'Story generation failed: {error_msg}')
                 return redirect('index')
             
             logger.info(f"Generated complete story package for input type: {input_type}")
             
-            # Extract image data
-            character_image = complete_story.get('character_image', {})
-            background_image = complete_story.get('background_image', {})
-            combined_scene = complete_story.get('combined_scene', {})
-            
-            # Save audio file if provided
-            audio_file_saved = None
-            if audio_file:
-                try:
-                    file_path = default_storage.save(f'audio_prompts/{audio_file.name}', audio_file)
-                    audio_file_saved = file_path
-                except Exception as e:
-                    logger.error(f"Failed to save audio file: {e}")
-                    messages.warning(request, "Audio file could not be saved, but transcription was successful.")
-            
-            # Save to database with all data including audio information
-            story_obj = StoryGeneration.objects.create(
-                prompt=text_prompt or "",
-                generated_story=complete_story['story'],
-                character_description=complete_story['character_description'],
-                background_description=complete_story['background_description'],
-                
-                # Audio-related fields
-                audio_file=audio_file_saved,
-                audio_transcription=complete_story.get('audio_transcription'),
-                audio_duration=complete_story.get('audio_duration', 0),
-                input_type=complete_story.get('input_type', 'text'),
-                
-                # Image data
-                character_image_data=character_image.get('image_data'),
-                character_image_prompt=character_image.get('prompt'),
-                character_image_model=character_image.get('model_used'),
-                
-                # Background image data
-                background_image_data=background_image.get('image_data'),
-                background_image_prompt=background_image.get('prompt'),
-                background_image_model=background_image.get('model_used'),
-                
-                # Combined scene data
-                combined_scene_data=combined_scene.get('image_data'),
-                combined_scene_prompt=combined_scene.get('prompt'),
-                combined_scene_model=combined_scene.get('model_used'),
-                combination_info=combined_scene.get('composition_info'),
-                
-                genre=genre,
-                story_length=length
-            )
-            
-            success_parts = []
+            audio_file_saved = _save_audio_prompt(request, audio_file) if audio_file else None
+            story_obj = _create_story(complete_story, text_prompt, audio_file_saved, genre, length)
+            request.generated_story_id = story_obj.id
+            messages.success(request, _success_message(complete_story))
+            response = _render_story_result(request, story_obj, complete_story, genre, length)
             
-            if complete_story.get('input_type') == 'audio':
-                success_parts.append('audio transcription')
-            elif complete_story.get('input_type') == 'both':
-                success_parts.append('text + audio processing')
-            else:
-                success_parts.append('text processing')
-            
-            # Add generated content info
-            success_parts.append('complete story')
-            
-            if character_image.get('success'):
-                success_parts.append('character portrait')
-            if background_image.get('success'):
-                success_parts.append('environment artwork')
-            if combined_scene.get('success'):
-                success_parts.append('combined scene composition')
-            
-            # Generate success message
-            if len(success_parts) > 3:
-                success_msg = f"Complete story package ready! {', '.join(success_parts[:-1])}, and {success_parts[-1]} are all set!"
-            elif len(success_parts) > 1:
-                success_msg = f"Story package created! {', '.join(success_parts[:-1])}, and {success_parts[-1]} generated successfully!"
-            else:
-                success_msg = "Your story is ready! (Image generation encountered issues, but the story is complete)"
-            
-            # Add audio-specific info
-            if complete_story.get('audio_duration', 0) > 0:
-                duration_str = f"{complete_story['audio_duration']:.1f} seconds"
-                success_msg += f" Audio duration: {duration_str}."
-            
-            # Add transcription info if available
-            transcription_result = complete_story.get('transcription_result', {})
-            if transcription_result and transcription_result.get('success'):
-                if transcription_result.get('language'):
-                    success_msg += f" Detected language: {transcription_result['language']}."
-            
-            messages.success(request, success_msg)
-            
-            return render(request, 'story_app/story_result.html', {
-                'story_obj': story_obj,
-                'prompt': story_obj.effective_prompt,
-                'genre': genre.title(),
-                'length': length.title(),
-                'image_generation_attempted': True,
-                'combined_scene_generated': combined_scene.get('success', False),
-                'audio_processed': complete_story.get('input_type') in ['audio', 'both'],
-                'transcription_result': transcription_result
-            })
+            _store_stage_timings(story_obj, stage_log, request_started)
+            STORIES_GENERATED.inc(input_type=story_obj.input_type, outcome='success')
+            return response
             
         except Exception as e:
+            STORIES_GENERATED.inc(input_type=input_type, outcome='error')
             logger.error(f"Error generating story with audio support: {e}")
             messages.error(request, 'Sorry, there was an error generating your story package. Please try again.')
             return redirect('index')
+        finally:
+            # No-op when already finished above or when tracking is disabled
+            finish_request_tracking()
     
     else:
         messages.error(request, 'Please correct the errors in the form.')
-        return render(request, 'story_app/index.html', {
-            'form': form,
-            'recent_stories': StoryGeneration.objects.all()[:5]
-        })
+        return _index_with_form(request, form)
+
+@coalesce_identical
+@admission_controlled
+async def generate_story_async(request):
+    """
+    generate_story for ASGI deployments: model calls are awaited and CPU-bound stages run
+    in executor threads, so a generation waiting on a provider doesn't hold a worker thread
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    
+    form = StoryPromptForm(request.POST, request.FILES)
+    # Validation looks up the library character
+    if not await sync_to_async(form.is_valid)():
+        messages.error(request, 'Please correct the errors in the form.')
+        return await sync_to_async(_index_with_form)(request, form)
     
+    text_prompt = form.cleaned_data['prompt']
+    audio_file = form.cleaned_data['audio_file']
+    input_type = form.cleaned_data['input_type']
+    length = form.cleaned_data['story_length']
+    genre = form.cleaned_data['genre']
+    character = form.cleaned_data['character']
+    
+    stage_log = start_stage_log()
+    start_deadline(already_spent=record_flight_wait(request) + record_admission_wait(request))
+    start_request_tracking()
+    request_started = time.perf_counter()
+    try:
+        # Loads the Whisper model unless the inference sidecar is configured
+        story_service = await sync_to_async(AsyncStoryGeneratorService, thread_sensitive=False)()
+        async with story_service:
+            if audio_file:
+                validation_result = await story_service.avalidate_audio_file(audio_file)
+                if not validation_result['valid']:
+                    STORIES_GENERATED.inc(input_type=input_type, outcome='invalid_audio')
+                    messages.error(request, f"Audio validation failed: {validation_result['error']}")
+                    return await sync_to_async(_index_with_form)(request, form)
+                if validation_result.get('warning'):
+                    messages.warning(request, validation_result['warning'])
+            
+            if input_type == 'audio' and audio_file:
+                messages.info(request, 'Transcribing audio and creating your complete story package... This may take a few moments.')
+                complete_story = await story_service.agenerate_story_from_audio(audio_file, length, genre, character)
+            elif input_type == 'both' and (text_prompt or audio_file):
+                messages.info(request, 'Processing both text and audio inputs to create your story package... This may take a few moments.')
+                complete_story = await story_service.agenerate_story_from_mixed_input(text_prompt, audio_file, length, genre, character)
+            else:
+                messages.info(request, 'Creating your complete story package with images... This may take a few moments.')
+                complete_story = await story_service.agenerate_complete_story_with_images(text_prompt, length, genre, character)
+                complete_story.update(TEXT_INPUT_METADATA)
+        
+        if not complete_story.get('success', True):
+            error_msg = complete_story.get('error', 'Unknown error occurred during story generation')
+            STORIES_GENERATED.inc(input_type=input_type, outcome='failed')
+            messages.error(request, f'Story generation failed: {error_msg}')
+            return redirect('index')
+        
+        logger.info(f"Generated complete story package for input type: {input_type}")
+        
+        audio_file_saved = await sync_to_async(_save_audio_prompt)(request, audio_file) if audio_file else None
+        story_obj = await sync_to_async(_create_story)(complete_story, text_prompt, audio_file_saved, genre, length)
+        request.generated_story_id = story_obj.id
+        messages.success(request, _success_message(complete_story))
+        response = await sync_to_async(_render_story_result)(request, story_obj, complete_story, genre, length)
+        
+        await sync_to_async(_store_stage_timings)(story_obj, stage_log, request_started)
+        STORIES_GENERATED.inc(input_type=story_obj.input_type, outcome='success')
+        return response
+    
+    except Exception as e:
+        STORIES_GENERATED.inc(input_type=input_type, outcome='error')
+        logger.error(f"Error generating story (async): {e!r}")
+        messages.error(request, 'Sorry, there was an error generating your story package. Please try again.')
+        return redirect('index')
+    finally:
+        finish_request_tracking()
+    
+def _story_updated_at(request, story_id):
+    """Look up when a story's page last changed, once per request, for the conditional GET checks"""
+    cached = getattr(request, '_story_updated_at', None)
+    if cached is None or cached[0] != story_id:
+        row = StoryGeneration.objects.filter(id=story_id).values_list('created_at', 'refined_at').first()
+        request._story_updated_at = (story_id, row and (row[1] or row[0]))
+    return request._story_updated_at[1]
+
+def _story_detail_etag(request, story_id):
+    # Pending flash messages make the page unique, so skip revalidation
+    if len(messages.get_messages(request)):
+        return None
+    updated_at = _story_updated_at(request, story_id)
+    if updated_at is None:
+        return None
+    return f'"story-{story_id}-{int(updated_at.timestamp() * 1000)}"'
+
+def _story_detail_last_modified(request, story_id):
+    if len(messages.get_messages(request)):
+        return None
+    return _story_updated_at(request, story_id)
+
+@condition(etag_func=_story_detail_etag, last_modified_func=_story_detail_last_modified)
 def story_detail(request, story_id):
     """View a specific story with all its details including combined scene"""
     try:
-        story_obj = StoryGeneration.objects.get(id=story_id)
-        return render(request, 'story_app/story_result.html', {
+        # Images are linked by URL, so neither the page nor the cached fragment holds their data
+        story_obj = StoryGeneration.objects.for_detail().get(id=story_id)
+        context = {
             'story_obj': story_obj,
             'genre': story_obj.genre_display if story_obj.genre else 'Unknown',
             'length': story_obj.story_length.title() if story_obj.story_length else 'Unknown',
             'combined_scene_generated': story_obj.has_combined_scene,
             'audio_processed': story_obj.has_audio
-        })
+        }
+        context['story_content'] = mark_safe(cached_fragment(
+            'detail',
+            detail_key(story_obj.id, story_obj.content_updated_at),
+            lambda: render_to_string('story_app/_story_content.html', context)
+        ))
+        response = render(request, 'story_app/story_result.html', context)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
     except StoryGeneration.DoesNotExist:
         messages.error(request, 'Story not found.')
         return redirect('index')
 
 def story_list(request):
-    """View all generated stories with combined scene indicators"""
-    stories = StoryGeneration.objects.all()[:20]
-    return render(request, 'story_app/story_list.html', {'stories': stories})
+    """View generated stories page by page, optionally filtered by genre, input type and length"""
+    filter_form = StoryFilterForm(request.GET or None)
+    filters = filter_form.cleaned_data if filter_form.is_valid() else {}
+    genre = filters.get('genre') or None
+    input_type = filters.get('input_type') or None
+    story_length = filters.get('story_length') or None
+    cursor = filters.get('cursor') or None
+    page_size = getattr(settings, 'STORY_LIST_PAGE_SIZE', 20)
+    
+    def render_page():
+        queryset = StoryGeneration.objects.for_listing().filter_listing(genre, input_type, story_length)
+        stories, next_cursor = keyset_page(queryset, cursor, page_size)
+        filter_params = {k: v for k, v in [('genre', genre), ('input_type', input_type), ('story_length', story_length)] if v}
+        next_query = urlencode({**filter_params, 'cursor': next_cursor}) if next_cursor else None
+        return render_to_string('story_app/_story_list.html', {
+            'stories': stories,
+            'next_query': next_query,
+            'first_query': urlencode(filter_params),
+            'is_first_page': not cursor,
+        })
+    
+    key = list_key('list', _latest_created_at(), genre, input_type, story_length, cursor, page_size)
+    stories_html = cached_fragment('list', key, render_page)
+    return render(request, 'story_app/story_list.html', {
+        'filter_form': filter_form if filter_form.is_bound else StoryFilterForm(),
+        'stories_html': mark_safe(stories_html)
+    })
+
+def search_stories_view(request):
+    """Full-text search over prompts, transcriptions, stories, characters and settings"""
+    form = StorySearchForm(request.GET or None)
+    query = form.cleaned_data['q'].strip() if form.is_valid() else ''
+    page_size = getattr(settings, 'STORY_LIST_PAGE_SIZE', 20)
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+    except ValueError:
+        page = 1
+    
+    results = []
+    if query:
+        # Fetch one extra row to know whether there is a next page
+        results = search_stories(query, limit=page_size + 1, offset=(page - 1) * page_size)
+    
+    has_next = len(results) > page_size
+    return render(request, 'story_app/search.html', {
+        'form': form if form.is_bound else StorySearchForm(),
+        'query': query,
+        'results': results[:page_size],
+        'page': page,
+        'next_query': urlencode({'q': query, 'page': page + 1}) if has_next else None,
+        'prev_query': urlencode({'q': query, 'page': page - 1}) if page > 1 else None,
+    })
+
+@staff_member_required
+def cache_stats_view(request):
+    """Expose fragment cache hit ratios for monitoring"""
+    return JsonResponse(cache_stats())
+
+@staff_member_required
+def profiles_view(request):
+    """Captured request profiles with their stage timings, and the runtime profiler switch"""
+    if request.method == 'POST':
+        form = ProfilerSettingsForm(request.POST)
+        if form.is_valid():
+            values = set_runtime_config(form.cleaned_data['enabled'], form.cleaned_data['sample_rate'])
+            messages.success(
+                request,
+                f"Profiling {'enabled' if values['ENABLED'] else 'disabled'} "
+                f"(sample rate {values['SAMPLE_RATE']:.0%})."
+            )
+            return redirect('profiles')
+    else:
+        config = profiler_settings()
+        form = ProfilerSettingsForm(initial={'enabled': config['ENABLED'], 'sample_rate': config['SAMPLE_RATE']})
+    
+    return render(request, 'story_app/profiles.html', {
+        'form': form,
+        'profiles': list_profiles(),
+        'profile_header': profiler_settings()['HEADER'],
+    })
+
+@staff_member_required
+def profile_file_view(request, file_name):
+    """Download one captured profile file (.folded or .speedscope.json)"""
+    path = profile_path(file_name)
+    if path is None:
+        raise Http404("Profile not found")
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=file_name)
+
+@staff_member_required
+def export_stories_view(request):
+    """
+    Stream stories as JSONL or Parquet (?format=jsonl|parquet) or their media as a tar or zip
+    archive (?format=tar|zip), optionally filtered and after a ?since= watermark. The
+    X-Export-Watermark header is the ?since= value for the next incremental export.
+    """
+    filter_form = StoryFilterForm(request.GET)
+    if not filter_form.is_valid():
+        return HttpResponseBadRequest('Invalid filters')
+    filters = filter_form.cleaned_data
+    export_format = request.GET.get('format', 'jsonl')
+    if export_format not in CONTENT_TYPES:
+        return HttpResponseBadRequest(f"Unknown format; use one of {', '.join(CONTENT_TYPES)}")
+    try:
+        queryset, watermark = export_queryset(
+            filters.get('genre') or None, filters.get('input_type') or None,
+            filters.get('story_length') or None, request.GET.get('since')
+        )
+        chunks = iter_export(export_format, queryset)
+    except ExportError as e:
+        return HttpResponseBadRequest(str(e))
+    
+    response = StreamingHttpResponse(chunks, content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="stories.{export_format}"'
+    if watermark:
+        response['X-Export-Watermark'] = watermark
+    return response
+
+def metrics_view(request):
+    """Pipeline stage timings and counters in the Prometheus text format"""
+    token = settings.METRICS_TOKEN
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return HttpResponseForbidden('Invalid metrics token')
+    
+    extra_lines = [
+        '# HELP story_fragment_cache_requests_total Rendered fragment cache lookups by kind and result',
+        '# TYPE story_fragment_cache_requests_total counter',
+    ]
+    for kind, kind_stats in cache_stats().items():
+        for result in ('hits', 'misses'):
+            extra_lines.append(
+                f'story_fragment_cache_requests_total{{kind="{kind}",result="{result}"}} {kind_stats[result]}'
+            )
+    return HttpResponse(render_prometheus(extra_lines), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 def delete_story(request, story_id):
     """Delete a specific story"""
@@ -221,21 +512,75 @@ def delete_story(request, story_id):
     
     return redirect('index')
 
+def _inline_image(request, etag, load_image_data, filename):
+    """PNG response for base64 image data loaded only after the ETag check; 404 when there is none"""
+    response = not_modified(request, etag)
+    if response is None:
+        image_data = load_image_data()
+        if not image_data:
+            raise Http404('Image not found')
+        response = ranged_response(
+            request,
+            base64_decoded_size(image_data),
+            lambda start, length: iter_base64_chunks(image_data, start, length),
+            content_type='image/png',
+            etag=etag,
+            filename=filename,
+            as_attachment=False,
+        )
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+def story_image(request, story_id, kind):
+    """A story's character, background or combined scene image, as linked from the story page"""
+    if kind not in IMAGE_DATA_FIELDS:
+        raise Http404('Unknown image')
+    updated_at = _story_updated_at(request, story_id)
+    if updated_at is None:
+        raise Http404('Story not found')
+    return _inline_image(
+        request,
+        # Images only change when a refinement finishes, which moves the story's update time
+        make_etag('image', story_id, kind, updated_at.timestamp()),
+        lambda: StoryGeneration.objects.filter(id=story_id).values_list(IMAGE_DATA_FIELDS[kind], flat=True).first(),
+        f"story_{story_id}_{kind}.png",
+    )
+
+def story_scene_image(request, story_id, order):
+    """One scene image of a multi-scene story; scenes are never re-rendered once saved"""
+    return _inline_image(
+        request,
+        make_etag('story-scene', story_id, order),
+        lambda: StoryScene.objects.filter(story_id=story_id, order=order).values_list('image_data', flat=True).first(),
+        f"story_{story_id}_scene_{order + 1}.png",
+    )
+
 def download_combined_scene(request, story_id):
-    """NEW: Download the combined scene image as a file"""
+    """Stream the combined scene image as a file, with Range and ETag support"""
     try:
-        story_obj = StoryGeneration.objects.get(id=story_id)
-        if not story_obj.has_combined_scene:
+        # Image columns stay unloaded until the ETag check has failed
+        story_obj = StoryGeneration.objects.for_listing().get(id=story_id)
+        if not story_obj.has_scene:
             messages.error(request, 'No combined scene available for this story.')
             return redirect('story_detail', story_id=story_id)
         
-        image_data = base64.b64decode(story_obj.combined_scene_data)
-        
-        # Create response with proper headers
-        response = HttpResponse(image_data, content_type='image/png')
-        response['Content-Disposition'] = f'attachment; filename="story_{story_id}_scene.png"'
+        # The scene only changes when a refinement finishes, which moves content_updated_at
+        etag = make_etag('scene', story_obj.id, story_obj.content_updated_at.timestamp())
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
         
-        return response
+        scene_data = StoryGeneration.objects.filter(id=story_id).values_list('combined_scene_data', flat=True).first()
+        size = base64_decoded_size(scene_data)
+        return ranged_response(
+            request,
+            size,
+            lambda start, length: iter_base64_chunks(scene_data, start, length),
+            content_type='image/png',
+            etag=etag,
+            filename=f"story_{story_id}_scene.png",
+            as_attachment=not request.GET.get('inline'),
+        )
         
     except StoryGeneration.DoesNotExist:
         messages.error(request, 'Story not found.')
@@ -245,10 +590,61 @@ def download_combined_scene(request, story_id):
         messages.error(request, 'Error downloading image.')
         return redirect('story_detail', story_id=story_id)
     
-def download_audio_file(request, story_id):
-    """Download the original audio file"""
+def character_library(request):
+    """Saved characters, most used first, with links to write another story about each"""
+    return render(request, 'story_app/characters.html', {
+        'characters': Character.objects.for_library(),
+    })
+
+@require_http_methods(["POST"])
+def save_character(request, story_id):
+    """Save a story's character (description, portrait, image prompt) to the library"""
     try:
         story_obj = StoryGeneration.objects.get(id=story_id)
+    except StoryGeneration.DoesNotExist:
+        messages.error(request, 'Story not found.')
+        return redirect('index')
+    
+    form = CharacterSaveForm(request.POST)
+    if not form.is_valid():
+        messages.error(request, 'Please give the character a name.')
+        return redirect('story_detail', story_id=story_id)
+    try:
+        character, created = save_story_character(story_obj, form.cleaned_data['name'])
+    except CharacterError as e:
+        messages.error(request, str(e))
+        return redirect('story_detail', story_id=story_id)
+    
+    messages.success(request, f"{'Saved' if created else 'Updated'} {character.name} in your character library.")
+    return redirect('character_library')
+
+def character_portrait(request, character_id):
+    """Serve a library character's portrait, with Range and ETag support"""
+    updated_at = Character.objects.filter(id=character_id).values_list('updated_at', flat=True).first()
+    if updated_at is None:
+        raise Http404('Character not found')
+    
+    # Saving the same name again replaces the portrait and moves updated_at
+    etag = make_etag('character', character_id, updated_at.timestamp())
+    response = not_modified(request, etag)
+    if response is None:
+        image_data = Character.objects.filter(id=character_id).values_list('image_data', flat=True).first()
+        response = ranged_response(
+            request,
+            base64_decoded_size(image_data),
+            lambda start, length: iter_base64_chunks(image_data, start, length),
+            content_type='image/png',
+            etag=etag,
+            filename=f"character_{character_id}.png",
+            as_attachment=False,
+        )
+    patch_cache_control(response, no_cache=True)
+    return response
+    
+def download_audio_file(request, story_id):
+    """Stream the original audio file, with Range support so players can seek"""
+    try:
+        story_obj = StoryGeneration.objects.only('audio_file', 'audio_transcription', 'created_at').get(id=story_id)
         if not story_obj.has_audio:
             messages.error(request, 'No audio file available for this story.')
             return redirect('story_detail', story_id=story_id)
@@ -258,12 +654,25 @@ def download_audio_file(request, story_id):
             messages.error(request, 'Audio file not found.')
             return redirect('story_detail', story_id=story_id)
         
-        # Create response with proper headers
-        response = HttpResponse(audio_file.read(), content_type='audio/mpeg')
-        filename = os.path.basename(audio_file.name)
-        response['Content-Disposition'] = f'attachment; filename="{smart_str(filename)}"'
+        size = default_storage.size(audio_file.name)
+        try:
+            modified = default_storage.get_modified_time(audio_file.name).timestamp()
+        except (NotImplementedError, OSError):
+            modified = story_obj.created_at.timestamp()
+        etag = make_etag('audio', audio_file.name, size, modified)
         
-        return response
+        def stream_audio(start, length):
+            return iter_file_chunks(default_storage.open(audio_file.name, 'rb'), start, length)
+        
+        return ranged_response(
+            request,
+            size,
+            stream_audio,
+            content_type=guess_content_type(audio_file.name),
+            etag=etag,
+            filename=os.path.basename(audio_file.name),
+            as_attachment=not request.GET.get('inline'),
+        )
         
     except StoryGeneration.DoesNotExist:
         messages.error(request, 'Story not found.')
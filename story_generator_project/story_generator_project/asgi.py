@@ -14,3 +14,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'story_generator_project.settings')
 
 application = get_asgi_application()
+
+# Load the Ollama model now rather than on the first story (STORY_OLLAMA['WARM_UP'])
+from story_app.llm import warm_up_in_background  # noqa: E402
+warm_up_in_background()
@@ -1,6 +1,7 @@
 import os
+import tempfile
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -28,6 +29,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'story_app.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'story_generator_project.urls'
@@ -50,11 +52,44 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'story_generator_project.wsgi.application'
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgres switches to PostgreSQL (requires psycopg); SQLite is the default
+DB_ENGINE = config('DB_ENGINE', default='sqlite')
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='story_generator'),
+            'USER': config('DB_USER', default='postgres'),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default='5432'),
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'connect_timeout': config('DB_CONNECT_TIMEOUT', default=5, cast=int),
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Seconds the sqlite3 driver waits for a lock before raising "database is locked"
+                'timeout': config('SQLITE_BUSY_TIMEOUT', default=10, cast=int),
+            },
+        }
     }
+
+# Applied to every new SQLite connection by story_app.db.configure_sqlite_connection
+SQLITE_PRAGMAS = {
+    'journal_mode': config('SQLITE_JOURNAL_MODE', default='WAL'),
+    'synchronous': config('SQLITE_SYNCHRONOUS', default='NORMAL'),
+    'busy_timeout': config('SQLITE_BUSY_TIMEOUT', default=10, cast=int) * 1000,
 }
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -84,6 +119,149 @@ STATICFILES_DIRS = [
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Story fragments, admission buckets and counters live here. LocMemCache is per process,
+# so with several workers use a shared backend (Redis, Memcached) for them to be shared
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='story-generator'),
+    }
+}
+
+# External model services; point these at `manage.py run_standins` to load-test offline
+OLLAMA_BASE_URL = config('OLLAMA_BASE_URL', default='http://localhost:11434')
+HF_INFERENCE_URL = config('HF_INFERENCE_URL', default='https://api-inference.huggingface.co')
+STABILITY_API_URL = config('STABILITY_API_URL', default='https://api.stability.ai')
+
+# Ollama generation options; see story_app/llm.py for what the defaults are sized to
+STORY_OLLAMA = {
+    'MODEL': config('OLLAMA_MODEL', default='gemma:2b'),
+    'KEEP_ALIVE': config('OLLAMA_KEEP_ALIVE', default='30m'),
+    'NUM_CTX': config('OLLAMA_NUM_CTX', default=4096, cast=int),
+    'NUM_THREAD': config('OLLAMA_NUM_THREAD', default=None, cast=lambda v: int(v) if v else None),
+    'STORY_NUM_PREDICT': {'short': 1280, 'medium': 1600, 'long': 2048},
+    'FOLDED_NUM_PREDICT': 128,
+    'IMAGE_PROMPT_NUM_PREDICT': config('OLLAMA_IMAGE_PROMPT_NUM_PREDICT', default=80, cast=int),
+    'WARM_UP': config('OLLAMA_WARM_UP', default=True, cast=bool),
+    'CANDIDATE_MODELS': config('OLLAMA_CANDIDATE_MODELS', default='', cast=Csv()),
+}
+
+# How the two image prompts are extracted after the story call: 'sequential' (one LLM
+# call each, before its image), 'concurrent' (both calls at once) or 'folded' (written by
+# the story call itself, with a separate call only for a prompt it failed to produce)
+IMAGE_PROMPT_MODE = config('IMAGE_PROMPT_MODE', default='sequential')
+
+# Scene compositing runs in a warm process pool ('process') or in the request thread ('thread')
+STORY_COMPOSITOR = {
+    'MODE': config('COMPOSITOR_MODE', default='process'),
+    'POOL_SIZE': config('COMPOSITOR_POOL_SIZE', default=2, cast=int),
+    'QUEUE_DEPTH': config('COMPOSITOR_QUEUE_DEPTH', default=8, cast=int),
+    'TASK_TIMEOUT': config('COMPOSITOR_TASK_TIMEOUT', default=120, cast=int),
+    'START_METHOD': 'spawn',
+    # ONNX Runtime threads per worker for rembg
+    'ONNX_THREADS': config('COMPOSITOR_ONNX_THREADS', default=1, cast=int),
+}
+
+# Local sidecar owning the Whisper and rembg models (manage.py run_inference_sidecar);
+# leave INFERENCE_SOCKET empty to load the models inside each web worker
+INFERENCE_SIDECAR = {
+    'SOCKET': config('INFERENCE_SOCKET', default=''),
+    'TIMEOUT': config('INFERENCE_TIMEOUT', default=300, cast=int),
+}
+
+# Admission control for /generate/ and /generate/async/: CAPACITY cost units run at once
+# per worker process (short/medium text = 1, long = 2, audio = 3), the rest queue by class
+STORY_ADMISSION = {
+    'ENABLED': config('ADMISSION_ENABLED', default=True, cast=bool),
+    'CAPACITY': config('ADMISSION_CAPACITY', default=4, cast=int),
+    'MAX_QUEUE': config('ADMISSION_MAX_QUEUE', default=16, cast=int),
+    'MAX_WAIT': config('ADMISSION_MAX_WAIT', default=30, cast=int),
+    'AGING_SECONDS': 20,
+    'RATE_PER_MINUTE': config('ADMISSION_RATE_PER_MINUTE', default=12, cast=float),
+    'BURST': config('ADMISSION_BURST', default=6, cast=int),
+    'TRUST_X_FORWARDED_FOR': config('ADMISSION_TRUST_X_FORWARDED_FOR', default=False, cast=bool),
+}
+
+# Identical generate submissions (double clicks, client retries) share one pipeline run;
+# lock files in DIRECTORY coordinate the worker processes on a host
+STORY_SINGLE_FLIGHT = {
+    'ENABLED': config('SINGLE_FLIGHT_ENABLED', default=True, cast=bool),
+    'DIRECTORY': config('SINGLE_FLIGHT_DIRECTORY', default=os.path.join(tempfile.gettempdir(), 'story_generator_inflight')),
+    'WAIT_TIMEOUT': config('SINGLE_FLIGHT_WAIT_TIMEOUT', default=300, cast=int),
+    'STALE_AFTER': 900,
+    'POLL_INTERVAL': 0.25,
+}
+
+# Start the background image from the user prompt while the story is written (opt-in:
+# a speculation that doesn't match the story costs an extra provider call)
+STORY_SPECULATIVE_BACKGROUND = {
+    'ENABLED': config('SPECULATIVE_BACKGROUND', default=False, cast=bool),
+    'MIN_OVERLAP': config('SPECULATIVE_MIN_OVERLAP', default=0.5, cast=float),
+    'TOP_TERMS': 4,
+}
+
+# Image quality tier (draft, standard, high); with refinement on, images below
+# REFINE_TIER are re-rendered after the response and swapped in on the same story
+STORY_IMAGE_QUALITY = {
+    'TIER': config('IMAGE_QUALITY_TIER', default='standard'),
+    'REFINE': config('IMAGE_REFINE', default=False, cast=bool),
+    'REFINE_TIER': config('IMAGE_REFINE_TIER', default='high'),
+    'REFINE_WORKERS': config('IMAGE_REFINE_WORKERS', default=1, cast=int),
+}
+
+# Multi-scene stories: COUNT > 0 splits each story into key scenes, each with its own
+# background composed with the character portrait; backgrounds share a provider rate limit
+STORY_SCENES = {
+    'COUNT': config('SCENE_COUNT', default=0, cast=int),
+    'MAX_COUNT': 6,
+    'CONCURRENCY': config('SCENE_CONCURRENCY', default=2, cast=int),
+    'PROVIDER_RATE_PER_MINUTE': config('SCENE_PROVIDER_RATE_PER_MINUTE', default=30, cast=int),
+    'PROVIDER_BURST': config('SCENE_PROVIDER_BURST', default=4, cast=int),
+}
+
+# Per-request time budget; stages shrink timeouts or fall back locally as it runs out
+STORY_DEADLINE = {
+    'ENABLED': config('DEADLINE_ENABLED', default=True, cast=bool),
+    'BUDGET': config('DEADLINE_BUDGET', default=90, cast=float),
+    'RESERVE': config('DEADLINE_RESERVE', default=5, cast=float),
+    'STORY_SHARE': 0.5,
+    'MIN_LLM_CALL': 10,
+    'MIN_IMAGE_CALL': 6,
+    'MIN_COMPOSITE': 4,
+}
+
+# Stories per page on the story list
+STORY_LIST_PAGE_SIZE = 20
+
+# Rendered story fragments (seconds)
+STORY_FRAGMENT_CACHE = {
+    'DETAIL_TIMEOUT': 60 * 60,
+    'LIST_TIMEOUT': 60,
+}
+
+# Bearer token required by /metrics (empty = open, e.g. behind an internal-only scrape network)
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Opt-in tracemalloc accounting per pipeline stage; warns when a request's peak exceeds the budget
+STORY_MEMORY_TRACKING = {
+    'ENABLED': config('MEMORY_TRACKING', default=False, cast=bool),
+    'BUDGET_MB': config('MEMORY_BUDGET_MB', default=512, cast=int),
+    'TOP_ALLOCATIONS': 5,
+    'TRACEBACK_FRAMES': 1,
+}
+
+# Sampling profiler; ENABLED/SAMPLE_RATE can also be changed at runtime on /stats/profiles/
+STORY_PROFILER = {
+    'ENABLED': config('PROFILER_ENABLED', default=False, cast=bool),
+    'SAMPLE_RATE': config('PROFILER_SAMPLE_RATE', default=0.0, cast=float),
+    'HEADER': 'X-Story-Profile',
+    'HEADER_TOKEN': config('PROFILER_HEADER_TOKEN', default=''),
+    'INTERVAL': 0.005,
+    'DIRECTORY': config('PROFILER_DIRECTORY', default=str(BASE_DIR / 'profiles')),
+    'FORMATS': ['collapsed', 'speedscope'],
+    'MAX_PROFILES': 200,
+}
+
 
 
 # Media files configuration (for audio uploads)
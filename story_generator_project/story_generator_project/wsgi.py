@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'story_generator_project.settings')
 
 application = get_wsgi_application()
+
+# Load the Ollama model now rather than on the first story (STORY_OLLAMA['WARM_UP'])
+from story_app.llm import warm_up_in_background  # noqa: E402
+warm_up_in_background()